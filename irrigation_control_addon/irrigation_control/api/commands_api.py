@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException
+
+from ..models import schemas
+from ..services.command_queue import command_queue
+
+router = APIRouter()
+
+@router.get("/commands/{command_id}", response_model=schemas.Response)
+async def get_command(command_id: int) -> schemas.Response:
+    """Get the state of a queued solenoid or group command"""
+    command = command_queue.get(command_id)
+    if command is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Command {command_id} not found"
+        )
+    return schemas.Response(
+        success=True,
+        message="Command retrieved successfully",
+        data=command.to_dict()
+    )
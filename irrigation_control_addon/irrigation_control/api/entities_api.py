@@ -1,31 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
 from typing import List
-import os
+from functools import partial
 
 from ..models import schemas
 from ..services.db_service import DatabaseService
 from ..services.ha_service import HomeAssistantService
+from ..services.admission import admission_controller, turn_on_admitted
+from ..services.commands import switch_zones
+from ..services.command_queue import command_queue
+from ..services.timeline import schedule_timeline
+from ..services.slot_plans import slot_plans
 from ..core.config import settings
+from ..core.database import run_db
+from ..core.container import get_db_service, get_ha_service
 
 router = APIRouter()
 
-def get_ha_service() -> HomeAssistantService:
-    token = os.getenv("SUPERVISOR_TOKEN")
-    if not token:
-        raise HTTPException(status_code=500, message="Supervisor token not available")
-    return HomeAssistantService(token)
-
-def get_db_service(db: Session) -> DatabaseService:
-    return DatabaseService(db)
-
 @router.get("/ha-switches", response_model=List[dict])
 async def get_available_switches(
     ha_service: HomeAssistantService = Depends(get_ha_service)
 ) -> List[dict]:
     """Get all available switch entities from Home Assistant"""
     try:
-        switches = ha_service.get_switches()
+        switches = await ha_service.get_switches()
         return switches
     except Exception as e:
         raise HTTPException(
@@ -41,7 +38,7 @@ async def create_solenoid(
 ) -> schemas.Response:
     """Create a new solenoid mapping"""
     # Verify the switch exists in Home Assistant
-    switches = ha_service.get_switches()
+    switches = await ha_service.get_switches()
     if not any(s["entity_id"] == solenoid.entity_id for s in switches):
         raise HTTPException(
             status_code=400,
@@ -49,7 +46,7 @@ async def create_solenoid(
         )
 
     # Check if already mapped
-    existing = db_service.get_solenoid_by_entity_id(solenoid.entity_id)
+    existing = await run_db(db_service.get_solenoid_by_entity_id, solenoid.entity_id)
     if existing:
         raise HTTPException(
             status_code=400,
@@ -57,7 +54,7 @@ async def create_solenoid(
         )
 
     # Create solenoid
-    db_solenoid = db_service.create_solenoid(solenoid)
+    db_solenoid = await run_db(db_service.create_solenoid, solenoid)
     if not db_solenoid:
         raise HTTPException(
             status_code=500,
@@ -75,7 +72,7 @@ async def list_solenoids(
     db_service: DatabaseService = Depends(get_db_service)
 ) -> schemas.Response:
     """List all mapped solenoids"""
-    solenoids = db_service.get_solenoids()
+    solenoids = await run_db(db_service.get_solenoids)
     return schemas.Response(
         success=True,
         message="Solenoids retrieved successfully",
@@ -88,7 +85,7 @@ async def get_solenoid(
     db_service: DatabaseService = Depends(get_db_service)
 ) -> schemas.Response:
     """Get a specific solenoid by ID"""
-    solenoid = db_service.get_solenoid(solenoid_id)
+    solenoid = await run_db(db_service.get_solenoid, solenoid_id)
     if not solenoid:
         raise HTTPException(
             status_code=404,
@@ -106,46 +103,63 @@ async def delete_solenoid(
     db_service: DatabaseService = Depends(get_db_service)
 ) -> schemas.Response:
     """Delete a solenoid mapping"""
-    success = db_service.delete_solenoid(solenoid_id)
+    success = await run_db(db_service.delete_solenoid, solenoid_id)
     if not success:
         raise HTTPException(
             status_code=404,
             detail=f"Solenoid {solenoid_id} not found"
         )
+    # The solenoid may be targeted directly or through any number of groups
+    schedules = await run_db(db_service.get_schedules)
+    schedule_timeline.rebuild(schedules)
+    slot_plans.rebuild(schedules)
     return schemas.Response(
         success=True,
         message="Solenoid deleted successfully"
     )
 
-@router.post("/solenoids/{solenoid_id}/control", response_model=schemas.Response)
+@router.post("/solenoids/{solenoid_id}/control", response_model=schemas.Response, status_code=202)
 async def control_solenoid(
     solenoid_id: int,
     action: str,
     db_service: DatabaseService = Depends(get_db_service),
     ha_service: HomeAssistantService = Depends(get_ha_service)
 ) -> schemas.Response:
-    """Control a solenoid (turn on/off)"""
+    """Queue a solenoid command (turn on/off); poll GET /api/commands/{command_id}"""
     if action not in ["turn_on", "turn_off"]:
         raise HTTPException(
             status_code=400,
             detail="Action must be either 'turn_on' or 'turn_off'"
         )
 
-    solenoid = db_service.get_solenoid(solenoid_id)
+    solenoid = await run_db(db_service.get_solenoid, solenoid_id)
     if not solenoid:
         raise HTTPException(
             status_code=404,
             detail=f"Solenoid {solenoid_id} not found"
         )
 
-    success = ha_service.control_switch(solenoid.entity_id, action)
-    if not success:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to {action} solenoid"
+    gate = ungate = None
+    if action == "turn_on":
+        # Admission is awaited outside the workers and zone locks, so a stop
+        # queued meanwhile is not held up behind a turn-on waiting for a slot
+        gate = partial(
+            admission_controller.acquire,
+            owner="manual",
+            timeout=settings.MANUAL_ADMISSION_TIMEOUT
         )
+        ungate = partial(admission_controller.release, owner="manual")
+        attempt = partial(turn_on_admitted, ha_service, owner="manual")
+    else:
+        # Released now so the stop also withdraws a manual turn-on still
+        # waiting. Only the manual hold goes: a zone a schedule or sequential
+        # run still holds stays on and is reported "in_use".
+        admission_controller.release(solenoid.entity_id, "manual")
+        attempt = partial(switch_zones, ha_service, action=action, owner="manual")
+    command = command_queue.submit([solenoid.entity_id], action, attempt, gate, ungate)
 
     return schemas.Response(
         success=True,
-        message=f"Solenoid {action} successfully"
+        message=f"Solenoid {action} queued",
+        data=command.to_dict()
     )
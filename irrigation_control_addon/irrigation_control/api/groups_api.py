@@ -1,15 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
 from typing import List
+from functools import partial
 
 from ..models import schemas
 from ..services.db_service import DatabaseService
+from ..services.admission import admission_controller, turn_on_admitted
+from ..services.commands import switch_zones
+from ..services.command_queue import command_queue
+from ..services.timeline import schedule_timeline
+from ..services.slot_plans import slot_plans
+from ..core.config import settings
+from ..core.database import run_db
+from ..core.container import get_db_service, get_ha_service
 
 router = APIRouter()
 
-def get_db_service(db: Session) -> DatabaseService:
-    return DatabaseService(db)
-
 @router.post("/groups", response_model=schemas.Response)
 async def create_group(
     group: schemas.ZoneGroupCreate,
@@ -18,13 +23,13 @@ async def create_group(
     """Create a new zone group"""
     # Verify all solenoids exist
     for solenoid_id in group.solenoid_ids:
-        if not db_service.get_solenoid(solenoid_id):
+        if not await run_db(db_service.get_solenoid, solenoid_id):
             raise HTTPException(
                 status_code=400,
                 detail=f"Solenoid {solenoid_id} not found"
             )
 
-    db_group = db_service.create_group(group)
+    db_group = await run_db(db_service.create_group, group)
     if not db_group:
         raise HTTPException(
             status_code=500,
@@ -42,7 +47,7 @@ async def list_groups(
     db_service: DatabaseService = Depends(get_db_service)
 ) -> schemas.Response:
     """List all zone groups"""
-    groups = db_service.get_groups()
+    groups = await run_db(db_service.get_groups)
     return schemas.Response(
         success=True,
         message="Groups retrieved successfully",
@@ -55,7 +60,7 @@ async def get_group(
     db_service: DatabaseService = Depends(get_db_service)
 ) -> schemas.Response:
     """Get a specific zone group by ID"""
-    group = db_service.get_group(group_id)
+    group = await run_db(db_service.get_group, group_id)
     if not group:
         raise HTTPException(
             status_code=404,
@@ -76,27 +81,32 @@ async def update_group(
     """Update a zone group"""
     # Verify all solenoids exist
     for solenoid_id in group.solenoid_ids:
-        if not db_service.get_solenoid(solenoid_id):
+        if not await run_db(db_service.get_solenoid, solenoid_id):
             raise HTTPException(
                 status_code=400,
                 detail=f"Solenoid {solenoid_id} not found"
             )
 
     # Verify group exists
-    existing_group = db_service.get_group(group_id)
+    existing_group = await run_db(db_service.get_group, group_id)
     if not existing_group:
         raise HTTPException(
             status_code=404,
             detail=f"Group {group_id} not found"
         )
 
-    updated_group = db_service.update_group(group_id, group)
+    updated_group = await run_db(db_service.update_group, group_id, group)
     if not updated_group:
         raise HTTPException(
             status_code=500,
             detail="Failed to update group"
         )
 
+    # Membership changes which solenoids the group's schedules drive
+    for schedule in await run_db(db_service.get_group_schedules, group_id):
+        schedule_timeline.update_schedule(schedule)
+        slot_plans.update_schedule(schedule)
+
     return schemas.Response(
         success=True,
         message="Group updated successfully",
@@ -109,53 +119,64 @@ async def delete_group(
     db_service: DatabaseService = Depends(get_db_service)
 ) -> schemas.Response:
     """Delete a zone group"""
-    success = db_service.delete_group(group_id)
+    schedule_ids = [
+        schedule.id for schedule in await run_db(db_service.get_group_schedules, group_id)
+    ]
+    success = await run_db(db_service.delete_group, group_id)
     if not success:
         raise HTTPException(
             status_code=404,
             detail=f"Group {group_id} not found"
         )
+    for schedule_id in schedule_ids:
+        schedule_timeline.remove_schedule(schedule_id)
+        slot_plans.remove_schedule(schedule_id)
     return schemas.Response(
         success=True,
         message="Group deleted successfully"
     )
 
-@router.post("/groups/{group_id}/control", response_model=schemas.Response)
+@router.post("/groups/{group_id}/control", response_model=schemas.Response, status_code=202)
 async def control_group(
     group_id: int,
     action: str,
     db_service: DatabaseService = Depends(get_db_service),
     ha_service = Depends(get_ha_service)
 ) -> schemas.Response:
-    """Control all solenoids in a group (turn on/off)"""
+    """Queue a command for all solenoids in a group (turn on/off)"""
     if action not in ["turn_on", "turn_off"]:
         raise HTTPException(
             status_code=400,
             detail="Action must be either 'turn_on' or 'turn_off'"
         )
 
-    group = db_service.get_group(group_id)
+    group = await run_db(db_service.get_group, group_id)
     if not group:
         raise HTTPException(
             status_code=404,
             detail=f"Group {group_id} not found"
         )
 
-    # Control each solenoid in the group
-    success = True
-    failed_solenoids = []
-    for solenoid in group.solenoids:
-        if not ha_service.control_switch(solenoid.entity_id, action):
-            success = False
-            failed_solenoids.append(solenoid.entity_id)
-
-    if not success:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to {action} solenoids: {', '.join(failed_solenoids)}"
+    # Control the whole group, batched where the integration allows it
+    entity_ids = [solenoid.entity_id for solenoid in group.solenoids]
+    gate = ungate = None
+    if action == "turn_on":
+        # Admission is awaited outside the workers, as for a single solenoid
+        gate = partial(
+            admission_controller.acquire,
+            owner="manual",
+            timeout=settings.MANUAL_ADMISSION_TIMEOUT
         )
+        ungate = partial(admission_controller.release, owner="manual")
+        attempt = partial(turn_on_admitted, ha_service, owner="manual", source="group")
+    else:
+        # Only the manual hold goes, as for a single solenoid
+        admission_controller.release_many(entity_ids, "manual")
+        attempt = partial(switch_zones, ha_service, action=action, owner="manual")
+    command = command_queue.submit(entity_ids, action, attempt, gate, ungate)
 
     return schemas.Response(
         success=True,
-        message=f"Group {action} successfully"
+        message=f"Group {action} queued",
+        data=command.to_dict()
     )
@@ -1,43 +1,86 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import List, Optional
+from datetime import datetime, timedelta
 
 from ..models import schemas
 from ..services.db_service import DatabaseService
 from ..services.scheduler_service import SchedulerService
+from ..services.sequential_engine import sequential_engine
+from ..services.run_registry import run_registry
+from ..services.timeline import (
+    compile_slots,
+    schedule_solenoid_ids,
+    schedule_timeline
+)
+from ..models import database_models as models
 from ..core.config import settings
+from ..core.database import run_db
+from ..core.container import get_db_service, get_scheduler_service
 
 router = APIRouter()
 
-def get_db_service(db: Session) -> DatabaseService:
-    return DatabaseService(db)
+def find_slot_conflicts(
+    name: str,
+    event_type: models.EventType,
+    priority: int,
+    time_slots: list,
+    solenoid_ids: tuple,
+    schedule_id: Optional[int] = None
+) -> List[dict]:
+    """Check slots against the timeline index of every other enabled schedule"""
+    candidate = models.Schedule(
+        id=schedule_id, name=name, event_type=event_type, priority=priority
+    )
+    occurrences = compile_slots(candidate, time_slots, solenoid_ids)
+    return schedule_timeline.find_conflicts(occurrences, exclude_schedule_id=schedule_id)
 
-def get_scheduler_service(scheduler, ha_service) -> SchedulerService:
-    return SchedulerService(scheduler, ha_service)
+def reject_conflicts(conflicts: List[dict]) -> None:
+    """Strict mode: refuse a schedule that overlaps existing slots"""
+    if conflicts:
+        names = sorted({c["conflicting_schedule_name"] or str(c["conflicting_schedule_id"]) for c in conflicts})
+        raise HTTPException(
+            status_code=409,
+            detail=f"Schedule overlaps {len(conflicts)} existing slot(s) in: {', '.join(names)}"
+        )
 
 @router.post("/schedules", response_model=schemas.Response)
 async def create_schedule(
     schedule: schemas.ScheduleCreate,
+    strict: bool = Query(False, description="Reject the schedule if its slots overlap existing ones"),
     db_service: DatabaseService = Depends(get_db_service),
     scheduler_service: SchedulerService = Depends(get_scheduler_service)
 ) -> schemas.Response:
     """Create a new irrigation schedule"""
     # Validate target exists
     if schedule.target_type == "solenoid":
-        if not db_service.get_solenoid(schedule.target_id):
+        solenoid = await run_db(db_service.get_solenoid, schedule.target_id)
+        if not solenoid:
             raise HTTPException(
                 status_code=400,
                 detail=f"Solenoid {schedule.target_id} not found"
             )
+        solenoid_ids = (solenoid.id,) if solenoid.is_active else ()
     else:  # target_type == "group"
-        if not db_service.get_group(schedule.target_id):
+        group = await run_db(db_service.get_group, schedule.target_id)
+        if not group:
             raise HTTPException(
                 status_code=400,
                 detail=f"Group {schedule.target_id} not found"
             )
+        solenoid_ids = tuple(sorted(s.id for s in group.solenoids if s.is_active))
+
+    # Check for overlaps with existing slots on the same solenoids
+    conflicts = []
+    if schedule.is_enabled:
+        conflicts = find_slot_conflicts(
+            schedule.name, schedule.event_type, schedule.priority,
+            schedule.time_slots, solenoid_ids
+        )
+        if strict:
+            reject_conflicts(conflicts)
 
     # Create schedule in database
-    db_schedule = db_service.create_schedule(schedule)
+    db_schedule = await run_db(db_service.create_schedule, schedule)
     if not db_schedule:
         raise HTTPException(
             status_code=500,
@@ -46,20 +89,22 @@ async def create_schedule(
 
     # Create scheduler jobs if schedule is enabled
     if db_schedule.is_enabled:
-        success = scheduler_service.add_or_update_schedule(db_schedule)
+        success = await scheduler_service.add_or_update_schedule(db_schedule)
         if not success:
             # Schedule was created in DB but jobs failed
             # We'll keep the schedule but warn the user
             return schemas.Response(
                 success=True,
                 message="Schedule created but job creation failed. Please check configuration.",
-                data=db_schedule
+                data=db_schedule,
+                conflicts=conflicts or None
             )
 
     return schemas.Response(
         success=True,
         message="Schedule created successfully",
-        data=db_schedule
+        data=db_schedule,
+        conflicts=conflicts or None
     )
 
 @router.get("/schedules", response_model=schemas.Response)
@@ -67,20 +112,31 @@ async def list_schedules(
     db_service: DatabaseService = Depends(get_db_service)
 ) -> schemas.Response:
     """List all irrigation schedules"""
-    schedules = db_service.get_schedules()
+    schedules = await run_db(db_service.get_schedules)
     return schemas.Response(
         success=True,
         message="Schedules retrieved successfully",
         data=schedules
     )
 
+@router.get("/schedules/next", response_model=schemas.Response)
+async def get_next_schedules(
+    n: int = Query(5, ge=1, le=500, description="Number of upcoming slot starts")
+) -> schemas.Response:
+    """Get the next slot starts across all enabled schedules"""
+    return schemas.Response(
+        success=True,
+        message="Upcoming schedules retrieved successfully",
+        data={"next": schedule_timeline.next_occurrences(n)}
+    )
+
 @router.get("/schedules/{schedule_id}", response_model=schemas.Response)
 async def get_schedule(
     schedule_id: int,
     db_service: DatabaseService = Depends(get_db_service)
 ) -> schemas.Response:
     """Get a specific schedule by ID"""
-    schedule = db_service.get_schedule(schedule_id)
+    schedule = await run_db(db_service.get_schedule, schedule_id)
     if not schedule:
         raise HTTPException(
             status_code=404,
@@ -96,12 +152,35 @@ async def get_schedule(
 async def update_schedule(
     schedule_id: int,
     schedule: schemas.ScheduleUpdate,
+    strict: bool = Query(False, description="Reject the update if its slots overlap existing ones"),
     db_service: DatabaseService = Depends(get_db_service),
     scheduler_service: SchedulerService = Depends(get_scheduler_service)
 ) -> schemas.Response:
     """Update a schedule"""
+    existing = await run_db(db_service.get_schedule, schedule_id)
+    if not existing:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Schedule {schedule_id} not found"
+        )
+
+    # Check the resulting slots for overlaps with other schedules
+    conflicts = []
+    is_enabled = existing.is_enabled if schedule.is_enabled is None else schedule.is_enabled
+    if is_enabled:
+        conflicts = find_slot_conflicts(
+            schedule.name or existing.name,
+            schedule.event_type or existing.event_type,
+            existing.priority if schedule.priority is None else schedule.priority,
+            existing.time_slots if schedule.time_slots is None else schedule.time_slots,
+            schedule_solenoid_ids(existing),
+            schedule_id=schedule_id
+        )
+        if strict:
+            reject_conflicts(conflicts)
+
     # Update schedule in database
-    updated_schedule = db_service.update_schedule(schedule_id, schedule)
+    updated_schedule = await run_db(db_service.update_schedule, schedule_id, schedule)
     if not updated_schedule:
         raise HTTPException(
             status_code=404,
@@ -110,21 +189,23 @@ async def update_schedule(
 
     # Update scheduler jobs
     if updated_schedule.is_enabled:
-        success = scheduler_service.add_or_update_schedule(updated_schedule)
+        success = await scheduler_service.add_or_update_schedule(updated_schedule)
         if not success:
             return schemas.Response(
                 success=True,
                 message="Schedule updated but job update failed. Please check configuration.",
-                data=updated_schedule
+                data=updated_schedule,
+                conflicts=conflicts or None
             )
     else:
         # Remove jobs if schedule is disabled
-        scheduler_service.remove_schedule(schedule_id)
+        await scheduler_service.remove_schedule(schedule_id)
 
     return schemas.Response(
         success=True,
         message="Schedule updated successfully",
-        data=updated_schedule
+        data=updated_schedule,
+        conflicts=conflicts or None
     )
 
 @router.delete("/schedules/{schedule_id}", response_model=schemas.Response)
@@ -135,10 +216,10 @@ async def delete_schedule(
 ) -> schemas.Response:
     """Delete a schedule"""
     # Remove scheduler jobs first
-    scheduler_service.remove_schedule(schedule_id)
+    await scheduler_service.remove_schedule(schedule_id)
     
     # Delete from database
-    success = db_service.delete_schedule(schedule_id)
+    success = await run_db(db_service.delete_schedule, schedule_id)
     if not success:
         raise HTTPException(
             status_code=404,
@@ -157,14 +238,14 @@ async def run_schedule(
     scheduler_service: SchedulerService = Depends(get_scheduler_service)
 ) -> schemas.Response:
     """Run a schedule immediately"""
-    schedule = db_service.get_schedule(schedule_id)
+    schedule = await run_db(db_service.get_schedule, schedule_id)
     if not schedule:
         raise HTTPException(
             status_code=404,
             detail=f"Schedule {schedule_id} not found"
         )
 
-    success = scheduler_service.run_schedule_now(schedule)
+    success = await scheduler_service.run_schedule_now(schedule)
     if not success:
         raise HTTPException(
             status_code=500,
@@ -175,3 +256,78 @@ async def run_schedule(
         success=True,
         message="Schedule started successfully"
     )
+
+@router.post("/scheduler/reconcile", response_model=schemas.Response)
+async def reconcile_scheduler(
+    db_service: DatabaseService = Depends(get_db_service),
+    scheduler_service: SchedulerService = Depends(get_scheduler_service)
+) -> schemas.Response:
+    """Diff the stored scheduler jobs against the schedules and fix the differences"""
+    summary = await scheduler_service.reconcile(await run_db(db_service.get_schedules))
+    return schemas.Response(
+        success=True,
+        message="Scheduler reconciled successfully",
+        data=summary
+    )
+
+@router.get("/runs/active", response_model=schemas.Response)
+async def list_active_runs() -> schemas.Response:
+    """Get every open zone with its owner, source and deadline, and zone faults"""
+    return schemas.Response(
+        success=True,
+        message="Active runs retrieved successfully",
+        data={
+            "zones": run_registry.zone_count(),
+            "runs": run_registry.active(),
+            "faults": run_registry.faults()
+        }
+    )
+
+@router.get("/runs/sequential", response_model=schemas.Response)
+async def list_sequential_runs() -> schemas.Response:
+    """Get progress of active and recently finished sequential runs"""
+    return schemas.Response(
+        success=True,
+        message="Sequential runs retrieved successfully",
+        data={"runs": sequential_engine.get_progress()}
+    )
+
+@router.delete("/runs/sequential/{run_id}", response_model=schemas.Response)
+async def cancel_sequential_run(run_id: int) -> schemas.Response:
+    """Cancel a sequential run, closing its open zone"""
+    if not sequential_engine.cancel_run(run_id):
+        raise HTTPException(
+            status_code=404,
+            detail=f"Sequential run {run_id} not found"
+        )
+    return schemas.Response(
+        success=True,
+        message="Sequential run cancelled successfully"
+    )
+
+@router.get("/timeline", response_model=schemas.Response)
+async def get_timeline(
+    from_: Optional[datetime] = Query(None, alias="from", description="Range start (default now)"),
+    to: Optional[datetime] = Query(None, description="Range end (default one week after start)"),
+    solenoid_id: Optional[int] = Query(None, description="Only slots driving this solenoid")
+) -> schemas.Response:
+    """Get the compiled slot occurrences overlapping a time range"""
+    # Query times may come with or without an offset; compare them all in
+    # the timeline's timezone
+    start = schedule_timeline.localize(from_) if from_ else datetime.now(schedule_timeline.timezone)
+    end = schedule_timeline.localize(to) if to else start + timedelta(weeks=1)
+    if end <= start:
+        raise HTTPException(
+            status_code=400,
+            detail="'to' must be after 'from'"
+        )
+    if end - start > timedelta(weeks=52):
+        raise HTTPException(
+            status_code=400,
+            detail="Timeline range is limited to 52 weeks"
+        )
+    return schemas.Response(
+        success=True,
+        message="Timeline retrieved successfully",
+        data={"occurrences": schedule_timeline.between(start, end, solenoid_id)}
+    )
@@ -3,6 +3,18 @@ from sqlalchemy.orm import Session
 
 from ..models import schemas
 from ..core.config import settings
+from ..services.ha_service import endpoint_latency
+from ..services.scheduler_service import dispatch_latency
+from ..services.admission import admission_controller
+from ..services.arbiter import run_arbiter
+from ..services.commands import command_layer
+from ..services.command_queue import command_queue
+from ..services.confirmations import switch_confirmations
+from ..services.rate_limit import switch_rate_limiter
+from ..services.dispatcher import slot_dispatcher
+from ..services.deadlines import zone_deadlines
+from ..services.run_registry import run_registry
+from ..services.run_journal import run_journal
 
 router = APIRouter()
 
@@ -62,7 +74,8 @@ async def get_status() -> schemas.Response:
         "status": "healthy",
         "supervisor_token": bool(settings.SUPERVISOR_TOKEN),
         "database_url": settings.DATABASE_URL != "",
-        "scheduler_url": settings.SCHEDULER_DB_URL != ""
+        "scheduler_url": settings.SCHEDULER_DB_URL != "",
+        "running_jobs": run_registry.zone_count()
     }
     
     return schemas.Response(
@@ -70,3 +83,26 @@ async def get_status() -> schemas.Response:
         message="System status retrieved successfully",
         data=status
     )
+
+@router.get("/settings/metrics", response_model=schemas.Response)
+async def get_metrics() -> schemas.Response:
+    """Get runtime performance counters"""
+    metrics = {
+        "ha_endpoints": endpoint_latency.snapshot(),
+        "scheduler": dispatch_latency.snapshot(),
+        "admission": admission_controller.snapshot(),
+        "arbiter": run_arbiter.snapshot(),
+        "dispatcher": slot_dispatcher.snapshot(),
+        "deadlines": zone_deadlines.snapshot(),
+        "journal": run_journal.snapshot(),
+        "commands": command_layer.snapshot(),
+        "command_queue": command_queue.snapshot(),
+        "rate_limits": switch_rate_limiter.snapshot(),
+        "confirmations": switch_confirmations.snapshot()
+    }
+    
+    return schemas.Response(
+        success=True,
+        message="Metrics retrieved successfully",
+        data=metrics
+    )
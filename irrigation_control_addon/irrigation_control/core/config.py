@@ -1,5 +1,6 @@
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Any, Dict, List, Optional
 import os
 
 class Settings(BaseSettings):
@@ -10,11 +11,47 @@ class Settings(BaseSettings):
     # Home Assistant integration
     SUPERVISOR_URL: str = "http://supervisor"
     CORE_URL: str = "http://supervisor/core"
+    CORE_WS_URL: str = "ws://supervisor/core/websocket"
     SUPERVISOR_TOKEN: Optional[str] = os.getenv("SUPERVISOR_TOKEN")
     
+    # Home Assistant HTTP client
+    HA_MAX_CONNECTIONS: int = 20  # per host
+    HA_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    HA_KEEPALIVE_EXPIRY: float = 30.0  # seconds
+    HA_CONNECT_TIMEOUT: float = 3.0  # seconds
+    HA_READ_TIMEOUT: float = 10.0  # seconds
+    HA_UNBATCHED_PREFIXES: List[str] = []  # entity_id prefixes that need one call per entity
+    # Token buckets for slow radios, from the rate_limits option, e.g.
+    # [{"match": "switch.zwave_", "rate": 2, "burst": 4},
+    #  {"match": "integration:esphome", "rate": 10, "burst": 10}]
+    HA_RATE_LIMITS: List[Dict[str, Any]] = []
+    
+    # Home Assistant command queue
+    COMMAND_WORKERS: int = 4
+    COMMAND_MAX_RETRIES: int = 5
+    COMMAND_RETRY_BACKOFF: float = 1.0  # seconds before the first retry, doubling after
+    COMMAND_RETRY_BACKOFF_MAX: float = 30.0  # seconds
+    COMMAND_TIMEOUT: float = 120.0  # seconds after which an unsent command expires
+    HA_BREAKER_THRESHOLD: int = 5  # consecutive failures before commands are held
+    HA_BREAKER_RESET: float = 15.0  # seconds before a held queue tries again
+    SWITCH_CONFIRM_TIMEOUT: float = 10.0  # seconds for a switch to report a command's state
+    
+    # Home Assistant state mirror (WebSocket API)
+    HA_STATE_MIRROR_ENABLED: bool = True
+    HA_WS_RECONNECT_MIN: float = 1.0  # seconds
+    HA_WS_RECONNECT_MAX: float = 60.0  # seconds
+    
     # Database
     DATABASE_URL: str = "sqlite:////data/db/irrigation_addon.db"
     SCHEDULER_DB_URL: str = "sqlite:////data/db/apscheduler_jobs.sqlite"
+    DB_THREAD_POOL_SIZE: int = 4  # threads (and connections) for blocking database work
+    # SQLite pragmas applied to every connection; WAL lets API reads run
+    # while the scheduler and history writers commit
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT: int = 5000  # milliseconds a writer waits for the lock
+    SQLITE_MMAP_SIZE: int = 64 * 1024 * 1024  # bytes
+    SQLITE_CACHE_SIZE: int = 8192  # KiB of page cache per connection
     
     # API Settings
     API_V1_STR: str = "/api"
@@ -22,11 +59,16 @@ class Settings(BaseSettings):
     # Scheduler Settings
     MAX_INSTANCES: int = 3
     TIMEZONE: str = "UTC"
+    SLOT_DISPATCHER_ENABLED: bool = False  # One timer for every slot instead of cron jobs
     
     # Irrigation Settings
     MIN_DURATION: int = 1  # minutes
     MAX_DURATION: int = 360  # minutes (6 hours)
     MAX_SLOTS_PER_EVENT: int = 50  # Maximum number of time slots for P1/P2 events
+    MAX_CONCURRENT_ZONES: int = 3  # From the addon's max_concurrent_zones option
+    MANUAL_ADMISSION_TIMEOUT: float = 30.0  # seconds a manual turn-on waits for a free zone
+    RUN_JOURNAL_PATH: str = "/data/db/run_journal.jsonl"
+    RUN_JOURNAL_RECOVERY: str = "resume"  # 'resume' or 'close' zones left open by a restart
     
     # P1/P2 Event Settings
     P1_ENABLED: bool = True
@@ -36,6 +78,14 @@ class Settings(BaseSettings):
     P1_DEFAULT_PRIORITY: int = 1
     P2_DEFAULT_PRIORITY: int = 2
     
+    @field_validator("HA_RATE_LIMITS")
+    @classmethod
+    def check_rate_limits(cls, limits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        for limit in limits:
+            if float(limit.get("rate", 0)) <= 0:
+                raise ValueError(f"rate_limits: rate for {limit.get('match')!r} must be above 0")
+        return limits
+
     class Config:
         case_sensitive = True
 
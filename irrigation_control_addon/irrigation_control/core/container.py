@@ -0,0 +1,55 @@
+from typing import AsyncIterator, Optional
+
+from fastapi import Depends, HTTPException
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from .database import engine, SessionLocal, run_db
+from ..services.db_service import DatabaseService
+from ..services.ha_service import HomeAssistantService
+from ..services.scheduler_service import SchedulerService
+
+class ServiceContainer:
+    """
+    Services shared by every request, built once at startup.
+
+    Holds the database engine and session factory, the Home Assistant
+    service over the pooled HTTP client, and the scheduler service bound to
+    the app's scheduler. Route handlers reach them through the dependencies
+    below, so no request builds its own client, engine or scheduler.
+    """
+
+    def __init__(self, engine: Engine, session_factory: sessionmaker):
+        self.engine = engine
+        self.session_factory = session_factory
+        self.ha_service: Optional[HomeAssistantService] = None
+        self.scheduler_service: Optional[SchedulerService] = None
+
+    def bind(self, ha_service: HomeAssistantService, scheduler_service: SchedulerService) -> None:
+        """Register the services built at startup"""
+        self.ha_service = ha_service
+        self.scheduler_service = scheduler_service
+
+# App-wide container, bound in main's startup event
+container = ServiceContainer(engine, SessionLocal)
+
+async def get_db() -> AsyncIterator[Session]:
+    """Request-scoped session from the shared pool, closed after the response"""
+    db = container.session_factory()
+    try:
+        yield db
+    finally:
+        await run_db(db.close)
+
+def get_db_service(db: Session = Depends(get_db)) -> DatabaseService:
+    return DatabaseService(db)
+
+def get_ha_service() -> HomeAssistantService:
+    if container.ha_service is None:
+        raise HTTPException(status_code=503, detail="Home Assistant service not started")
+    return container.ha_service
+
+def get_scheduler_service() -> SchedulerService:
+    if container.scheduler_service is None:
+        raise HTTPException(status_code=503, detail="Scheduler not started")
+    return container.scheduler_service
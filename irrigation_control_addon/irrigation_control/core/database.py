@@ -0,0 +1,115 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Iterator, List, TypeVar
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from .config import settings
+
+T = TypeVar("T")
+
+def sqlite_pragmas() -> dict:
+    """Pragmas set on every new SQLite connection"""
+    return {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        # Negative sizes are in KiB rather than pages
+        "cache_size": -settings.SQLITE_CACHE_SIZE
+    }
+
+def make_engine(url: str, pool_size: int = 5) -> Engine:
+    """
+    Create an engine with the add-on's storage profile
+
+    SQLite connections get the pragmas from sqlite_pragmas() as they are
+    opened; other databases are created as given.
+
+    Args:
+        url: SQLAlchemy database URL
+        pool_size: Connections kept open in the pool
+    """
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_size=pool_size, pool_pre_ping=True)
+
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=pool_size
+    )
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    return engine
+
+# Keep a pooled connection for every database thread
+engine = make_engine(settings.DATABASE_URL, pool_size=settings.DB_THREAD_POOL_SIZE)
+
+# APScheduler's jobstore shares the engine when both live in one database
+scheduler_engine = (
+    engine if settings.SCHEDULER_DB_URL == settings.DATABASE_URL
+    else make_engine(settings.SCHEDULER_DB_URL, pool_size=1)
+)
+
+SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+# Blocking database work from async code runs here, never on the event loop
+db_executor = ThreadPoolExecutor(
+    max_workers=settings.DB_THREAD_POOL_SIZE, thread_name_prefix="db"
+)
+
+async def run_db(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking database call on the database thread pool and await it"""
+    return await asyncio.get_running_loop().run_in_executor(
+        db_executor, partial(func, *args, **kwargs)
+    )
+
+class QueryCounter:
+    """SQL statements run on an engine while counting"""
+
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+@contextmanager
+def count_queries(bind: Engine = None) -> Iterator[QueryCounter]:
+    """
+    Record every statement executed on `bind` inside the block
+
+    Used to check that a read path runs a fixed number of queries however
+    many rows it returns, e.g.
+
+        with count_queries() as queries:
+            DatabaseService(db).get_schedules()
+        assert queries.count == 6  # schedules and five relationships
+
+    Args:
+        bind: Engine to watch, the app's engine by default
+    """
+    bind = bind if bind is not None else engine
+    counter = QueryCounter()
+
+    def record(conn, cursor, statement, parameters, context, executemany) -> None:
+        counter.statements.append(statement)
+
+    event.listen(bind, "before_cursor_execute", record)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute", record)
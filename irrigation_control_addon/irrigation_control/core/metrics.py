@@ -0,0 +1,118 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+
+class LatencyStats:
+    """Running latency statistics for a single named operation"""
+
+    __slots__ = ("count", "errors", "total", "min", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.last: Optional[float] = None
+
+    def record(self, seconds: float, error: bool = False) -> None:
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total += seconds
+        self.last = seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self) -> dict:
+        """Return the statistics in milliseconds"""
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": ms(self.total / self.count) if self.count else None,
+            "min_ms": ms(self.min),
+            "max_ms": ms(self.max),
+            "last_ms": ms(self.last),
+        }
+
+
+class LatencyRegistry:
+    """Collection of latency statistics keyed by operation name"""
+
+    def __init__(self):
+        self._stats: Dict[str, LatencyStats] = {}
+
+    def record(self, name: str, seconds: float, error: bool = False) -> None:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = LatencyStats()
+        stats.record(seconds, error)
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        """Time the wrapped block and record it under `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record(name, time.perf_counter() - start, error=True)
+            raise
+        self.record(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: stats.snapshot() for name, stats in self._stats.items()}
+
+    def reset(self) -> None:
+        self._stats.clear()
+
+
+class LatencyHistogram:
+    """Latencies counted into fixed buckets, for percentiles across many samples"""
+
+    DEFAULT_BOUNDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last bucket: above every bound
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given fraction of samples"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        """Return the buckets keyed by their upper bound in milliseconds"""
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 3) if value is not None and value != float("inf") else None
+
+        buckets = {f"le_{round(bound * 1000)}ms": count for bound, count in zip(self.bounds, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "avg_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.percentile(0.5)),
+            "p95_ms": ms(self.percentile(0.95)),
+            "p99_ms": ms(self.percentile(0.99)),
+            "buckets": buckets
+        }
@@ -1,10 +1,10 @@
 import os
 import logging
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect
 from sqlalchemy.exc import SQLAlchemyError
 
 from models.database_models import Base
-from core.config import settings
+from core.database import engine, scheduler_engine
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,21 +19,13 @@ def init_db():
             os.makedirs(db_dir)
             logger.info(f"Created database directory: {db_dir}")
 
-        # Create database engine
-        engine = create_engine(
-            settings.DATABASE_URL,
-            connect_args={"check_same_thread": False}
-        )
-
         # Create all tables
         Base.metadata.create_all(bind=engine)
         logger.info("Successfully created database tables")
 
-        # Also create APScheduler jobs database
-        scheduler_engine = create_engine(
-            settings.SCHEDULER_DB_URL,
-            connect_args={"check_same_thread": False}
-        )
+        # Also create APScheduler jobs database; connecting switches it to WAL
+        with scheduler_engine.connect():
+            pass
         # APScheduler will create its tables automatically when needed
         logger.info("Initialized APScheduler database")
 
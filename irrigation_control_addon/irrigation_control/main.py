@@ -2,14 +2,25 @@ from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.events import EVENT_JOB_SUBMITTED
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 import os
 
 from .core.config import settings
-from .api import entities_api, groups_api, schedules_api, settings_api
+from .core.database import engine, scheduler_engine, db_executor, run_db
+from .core.container import container
+from .api import commands_api, entities_api, groups_api, schedules_api, settings_api
 from .models.database_models import Base
+from .services.ha_service import HomeAssistantService, close_http_client
+from .services.ha_state_mirror import start_state_mirror, stop_state_mirror
+from .services.scheduler_service import SchedulerService, record_dispatch_latency, set_job_runner
+from .services.db_service import DatabaseService
+from .services.dispatcher import slot_dispatcher
+from .services.deadlines import zone_deadlines
+from .services.run_journal import run_journal
+from .services.command_queue import command_queue
+from .services.confirmations import switch_confirmations
 
 app = FastAPI(
     title="Irrigation Control",
@@ -30,26 +41,27 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# Database setup
-SQLALCHEMY_DATABASE_URL = "sqlite:////data/db/irrigation_addon.db"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-
-# Initialize scheduler with SQLite job store
+# Initialize scheduler with SQLite job store, on the tuned shared engine
 jobstores = {
-    'default': SQLAlchemyJobStore(url='sqlite:////data/db/apscheduler_jobs.sqlite')
+    'default': SQLAlchemyJobStore(engine=scheduler_engine)
 }
-scheduler = BackgroundScheduler(jobstores=jobstores)
+# Jobs run as awaited tasks on the uvicorn event loop
+scheduler = AsyncIOScheduler(jobstores=jobstores, timezone=settings.TIMEZONE)
+scheduler.add_listener(record_dispatch_latency, EVENT_JOB_SUBMITTED)
 
 def init_db():
     Base.metadata.create_all(bind=engine)
 
+def load_schedules():
+    with container.session_factory() as db:
+        return DatabaseService(db).get_schedules()
+
 # Include routers
 app.include_router(entities_api.router, prefix="/api", tags=["entities"])
 app.include_router(groups_api.router, prefix="/api", tags=["groups"])
 app.include_router(schedules_api.router, prefix="/api", tags=["schedules"])
 app.include_router(settings_api.router, prefix="/api", tags=["settings"])
+app.include_router(commands_api.router, prefix="/api", tags=["commands"])
 
 # Root route
 @app.get("/")
@@ -69,10 +81,48 @@ async def startup_event():
     # Initialize database
     init_db()
     
-    # Start the scheduler
-    scheduler.start()
+    ha_service = HomeAssistantService(os.getenv("SUPERVISOR_TOKEN"))
+    scheduler_service = SchedulerService(scheduler, ha_service)
+    set_job_runner(scheduler_service)
+    # Route handlers share these instead of building their own per request
+    container.bind(ha_service, scheduler_service)
+    
+    # Start mirroring Home Assistant states over the WebSocket API
+    if settings.HA_STATE_MIRROR_ENABLED:
+        mirror = start_state_mirror(ha_service)
+        # Switch commands are confirmed from its state_changed events
+        mirror.add_state_listener(switch_confirmations.on_state_changed)
+    
+    # Re-arm zone stop deadlines and cut-offs checkpointed before a restart
+    zone_deadlines.start(ha_service)
+    
+    # Close or resume zones the journal shows were left open
+    await run_journal.recover(ha_service)
+    
+    # Start draining queued solenoid and group commands
+    command_queue.start()
+    
+    # Start the scheduler paused so no job fires before the jobstore is reconciled
+    scheduler.start(paused=True)
+    
+    # Diff the stored jobs against the schedules in the database; this also
+    # compiles the timeline and the slot plans jobs resolve when they fire
+    await scheduler_service.reconcile(await run_db(load_schedules))
+    
+    scheduler.resume()
+    
+    # Optionally fire every slot from one timer instead of per-slot cron jobs
+    if settings.SLOT_DISPATCHER_ENABLED:
+        slot_dispatcher.start()
 
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
+    slot_dispatcher.stop()
     scheduler.shutdown()
+    await command_queue.stop()
+    await zone_deadlines.stop()
+    await run_journal.stop()
+    await stop_state_mirror()
+    await close_http_client()
+    db_executor.shutdown(wait=True)
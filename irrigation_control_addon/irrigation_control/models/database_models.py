@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Table, Time, Enum
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Integer, String, Table, Time, Enum
 from sqlalchemy.orm import relationship, DeclarativeBase
 from datetime import time
 from typing import List
@@ -108,3 +108,18 @@ class ScheduleHistory(Base):
     status = Column(String)  # 'completed', 'interrupted', 'skipped', 'error'
     reason = Column(String, nullable=True)  # Why was it skipped or interrupted?
     event_type = Column(Enum(EventType))
+
+class ScheduleJob(Base):
+    __tablename__ = "schedule_jobs"
+
+    job_id = Column(String, primary_key=True)  # APScheduler job id
+    schedule_id = Column(Integer, index=True, nullable=False)
+
+class ZoneDeadline(Base):
+    __tablename__ = "zone_deadlines"
+
+    key = Column(String, primary_key=True)  # e.g. "stop:run_3", "cutoff:switch.zone_1"
+    kind = Column(String, nullable=False)  # 'stop' or 'cutoff'
+    entity_ids = Column(String, nullable=False)  # Comma-separated zones to turn off
+    owner = Column(String, nullable=True)  # Admission owner holding the zones
+    due_at = Column(Float, nullable=False)  # Unix time
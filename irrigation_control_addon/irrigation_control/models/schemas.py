@@ -124,6 +124,7 @@ class Response(BaseModel):
         dict,
         None
     ]] = None
+    conflicts: Optional[List[dict]] = None  # Overlapping schedule slots, if any
 
 # Status/Health Models
 class SystemStatus(BaseModel):
@@ -0,0 +1,300 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..core.config import settings
+from ..core.metrics import LatencyRegistry
+from ..models.database_models import EventType
+from .commands import command_layer, switch_zones
+from .deadlines import Deadline, zone_deadlines
+from .run_registry import run_registry
+
+logger = logging.getLogger(__name__)
+
+# Queue order within the same Schedule.priority: P1 before P2 before manual
+_EVENT_RANK = {EventType.P1: 0, EventType.P2: 1, EventType.MANUAL: 2}
+
+# Lets regular stops at exactly MAX_DURATION win over the safety cut-off
+CUTOFF_MARGIN = 60  # seconds
+
+def cutoff_key(entity_id: str) -> str:
+    return f"cutoff:{entity_id}"
+
+def cutoff_at(entity_id: str) -> Optional[float]:
+    """Unix time an open zone's safety cut-off fires"""
+    deadline = zone_deadlines.get(cutoff_key(entity_id))
+    return deadline.due_at if deadline is not None else None
+
+class _Waiter:
+    __slots__ = ("key", "entity_id", "owner", "future", "enqueued_at")
+
+    def __init__(self, key: Tuple, entity_id: str, owner: str, future: asyncio.Future):
+        self.key = key
+        self.entity_id = entity_id
+        self.owner = owner
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return self.key < other.key
+
+class ZoneAdmissionController:
+    """
+    Limits how many zones are open at once.
+
+    Every turn-on acquires a slot for its entity on behalf of an owner (a
+    schedule, a sequential run or a manual action). An entity that is already
+    open admits further owners without using more capacity. Requests over the
+    limit wait in a priority queue ordered by Schedule.priority (higher
+    first), then event type, then arrival, and are admitted as zones close.
+
+    Opening a zone also arms its safety cut-off at MAX_DURATION, disarmed
+    when the last owner lets go of the zone.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._holders: Dict[str, Set[str]] = {}
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.wait_latency = LatencyRegistry()
+        self.timeouts = 0
+
+    @property
+    def open_zones(self) -> int:
+        return len(self._holders)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._queue if not waiter.future.done())
+
+    def _can_admit(self, entity_id: str) -> bool:
+        return entity_id in self._holders or len(self._holders) < self.capacity
+
+    def _admit(self, entity_id: str, owner: str) -> None:
+        if entity_id not in self._holders and cutoff_key(entity_id) not in zone_deadlines:
+            # A cut-off re-armed after a restart keeps its original time
+            zone_deadlines.schedule(
+                cutoff_key(entity_id), settings.MAX_DURATION * 60 + CUTOFF_MARGIN,
+                [entity_id], kind="cutoff"
+            )
+        self._holders.setdefault(entity_id, set()).add(owner)
+
+    def _drain(self) -> None:
+        """Admit queued requests in priority order while capacity allows"""
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._can_admit(head.entity_id):
+                break
+            heapq.heappop(self._queue)
+            self._admit(head.entity_id, head.owner)
+            self.wait_latency.record("admission_wait", time.perf_counter() - head.enqueued_at)
+            head.future.set_result(True)
+
+    def demand(self, entity_id: str, exclude: Optional[str] = None) -> int:
+        """Number of owners holding an entity, not counting `exclude`"""
+        holders = self._holders.get(entity_id, ())
+        return len(holders) - (exclude in holders)
+
+    def holds(self, entity_id: str, owner: str) -> bool:
+        return owner in self._holders.get(entity_id, ())
+
+    def try_acquire(self, entity_id: str, owner: str) -> bool:
+        """Admit without waiting if possible; never jumps an existing queue"""
+        if entity_id in self._holders or (not self._queue and self._can_admit(entity_id)):
+            self._admit(entity_id, owner)
+            self.wait_latency.record("admission_wait", 0.0)
+            return True
+        return False
+
+    async def acquire(
+        self,
+        entity_id: str,
+        owner: str,
+        priority: int = 0,
+        event_type: EventType = EventType.MANUAL,
+        timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Wait until the entity may be turned on
+
+        Returns:
+            bool: True once admitted, False on timeout or if the request was
+            withdrawn by release() before being admitted
+        """
+        if self.try_acquire(entity_id, owner):
+            return True
+
+        waiter = _Waiter(
+            (-priority, _EVENT_RANK.get(event_type, len(_EVENT_RANK)), next(self._seq)),
+            entity_id,
+            owner,
+            asyncio.get_running_loop().create_future()
+        )
+        heapq.heappush(self._queue, waiter)
+        logger.info(f"Zone limit reached, queued {entity_id} for {owner} (depth {self.queue_depth})")
+
+        try:
+            return await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"Timed out waiting to admit {entity_id} for {owner}")
+            self._drain()
+            return False
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.result():
+                self.release(entity_id, owner)
+            raise
+
+    def release(self, entity_id: str, owner: Optional[str] = None) -> None:
+        """
+        Give up an owner's hold on an entity (all holds if owner is None)
+
+        Pending requests for the same entity and owner are withdrawn, so a
+        stop that arrives before its start was admitted cancels the start.
+        Every path closing a zone comes through here, so this also clears the
+        zone from the run registry.
+        """
+        run_registry.stopped(entity_id, owner)
+        for waiter in self._queue:
+            if (
+                waiter.entity_id == entity_id
+                and (owner is None or waiter.owner == owner)
+                and not waiter.future.done()
+            ):
+                waiter.future.set_result(False)
+
+        holders = self._holders.get(entity_id)
+        if holders is not None:
+            if owner is None:
+                holders.clear()
+            else:
+                holders.discard(owner)
+            if not holders:
+                del self._holders[entity_id]
+                zone_deadlines.cancel(cutoff_key(entity_id))
+        self._drain()
+
+    def release_many(self, entity_ids: List[str], owner: Optional[str] = None) -> None:
+        """
+        Release several entities at once
+
+        Their pending requests are withdrawn before any hold is dropped, so
+        capacity freed by one entity is not handed to another being stopped.
+        """
+        entity_ids = set(entity_ids)
+        for waiter in self._queue:
+            if (
+                waiter.entity_id in entity_ids
+                and (owner is None or waiter.owner == owner)
+                and not waiter.future.done()
+            ):
+                waiter.future.set_result(False)
+        for entity_id in entity_ids:
+            self.release(entity_id, owner)
+
+    def snapshot(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "open_zones": self.open_zones,
+            "queue_depth": self.queue_depth,
+            "timeouts": self.timeouts,
+            "wait": self.wait_latency.snapshot().get("admission_wait")
+        }
+
+async def turn_on_admitted(
+    ha_service,
+    entity_ids: List[str],
+    owner: str,
+    source: str = "manual",
+    schedule_id: Optional[int] = None,
+    deadline: Optional[float] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Turn on zones already admitted for `owner`
+
+    Zones that turn on are recorded in the run registry under `source`, due
+    to close at `deadline` (Unix time) or else at their safety cut-off; the
+    hold on zones that fail is given up again.
+
+    Returns:
+        Dict mapping each entity_id to {"success", "latency_ms", "admitted"}
+    """
+    results = await switch_zones(ha_service, entity_ids, 'turn_on', owner=owner)
+    for entity_id, result in results.items():
+        result["admitted"] = True
+        if result["success"]:
+            run_registry.started(
+                entity_id, owner, source, schedule_id,
+                deadline if deadline is not None else cutoff_at(entity_id)
+            )
+        else:
+            admission_controller.release(entity_id, owner)
+    return results
+
+async def admit_and_turn_on(
+    ha_service,
+    entity_ids: List[str],
+    owner: str,
+    priority: int = 0,
+    event_type: EventType = EventType.MANUAL,
+    timeout: Optional[float] = None,
+    source: str = "manual",
+    schedule_id: Optional[int] = None,
+    deadline: Optional[float] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Turn on zones through the admission controller
+
+    Zones admitted straight away are switched together in one batched call;
+    the rest are switched one by one as they are admitted (see
+    turn_on_admitted).
+
+    Returns:
+        Dict mapping each entity_id to {"success", "latency_ms", "admitted"}
+    """
+    controller = admission_controller
+    ready = [entity_id for entity_id in entity_ids if controller.try_acquire(entity_id, owner)]
+    waiting = [entity_id for entity_id in entity_ids if entity_id not in ready]
+    results: Dict[str, Dict[str, Any]] = {}
+    turn_on = partial(
+        turn_on_admitted, ha_service, owner=owner, source=source,
+        schedule_id=schedule_id, deadline=deadline
+    )
+
+    async def admit_one(entity_id: str) -> None:
+        admitted = await controller.acquire(entity_id, owner, priority, event_type, timeout)
+        if not admitted or not controller.holds(entity_id, owner):
+            # Timed out, or stopped between admission and this turn-on
+            results[entity_id] = {"success": False, "latency_ms": None, "admitted": False}
+            return
+        results.update(await turn_on([entity_id]))
+
+    waiters = [asyncio.ensure_future(admit_one(entity_id)) for entity_id in waiting]
+    if ready:
+        results.update(await turn_on(ready))
+    if waiters:
+        await asyncio.gather(*waiters)
+    return results
+
+# App-wide controller enforcing the max_concurrent_zones option
+admission_controller = ZoneAdmissionController(settings.MAX_CONCURRENT_ZONES)
+command_layer.set_demand_source(admission_controller.demand)
+
+def _on_deadline_expired(deadline: Deadline) -> None:
+    # A cut-off zone is closed for every owner
+    if deadline.kind == "cutoff":
+        admission_controller.release_many(deadline.entity_ids)
+    # A stop re-armed after a restart has lost its handler and only turns
+    # the zones off, so give up the owner's hold here
+    elif deadline.callback is None and deadline.owner is not None:
+        admission_controller.release_many(deadline.entity_ids, deadline.owner)
+
+zone_deadlines.add_expiry_listener(_on_deadline_expired)
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from functools import partial
+from typing import Dict, List, Optional, Set
+
+from ..core.config import settings
+from ..core.database import SessionLocal, run_db
+from ..models.database_models import EventType
+from .admission import admission_controller, admit_and_turn_on
+from .commands import switch_zones
+from .db_service import DatabaseService
+from .deadlines import zone_deadlines
+from .sequential_engine import SequentialRun, sequential_engine
+
+logger = logging.getLogger(__name__)
+
+class ArbitratedRun:
+    """A schedule run known to the arbiter (parallel or sequential)"""
+
+    __slots__ = (
+        "key", "schedule_id", "event_type", "priority", "entity_ids", "duration",
+        "ha_service", "sequential_run_id", "deadline", "remaining", "suspended",
+        "managed", "blockers", "sequential"
+    )
+
+    def __init__(
+        self,
+        schedule_id: int,
+        event_type: EventType,
+        priority: int,
+        entity_ids: List[str],
+        duration_minutes: Optional[int],
+        ha_service,
+        sequential: bool = False,
+        key: Optional[str] = None
+    ):
+        self.key = key or f"schedule_{schedule_id}"
+        self.schedule_id = schedule_id
+        self.event_type = event_type
+        self.priority = priority
+        self.entity_ids = entity_ids
+        self.duration = (duration_minutes or settings.MAX_DURATION) * 60  # seconds
+        self.ha_service = ha_service
+        self.sequential_run_id: Optional[int] = None
+        self.deadline: Optional[float] = None  # loop time a parallel run stops
+        self.remaining: Optional[float] = None  # seconds left while suspended
+        self.suspended = False
+        self.managed = False  # True once the arbiter owns the run's stop
+        self.blockers: Set[str] = set()  # keys of P1 runs holding this run
+        self.sequential = sequential  # zones opened one at a time by the sequential engine
+
+    @property
+    def deadline_key(self) -> str:
+        """Key of an arbiter-owned stop in the deadline wheel"""
+        return f"stop:{self.key}"
+
+class RunArbiter:
+    """
+    Runtime P1/P2 arbitration.
+
+    Keeps the active runs indexed per zone in memory. A starting P1 run
+    suspends every P2 run sharing one of its zones, and a P2 run starting on
+    a zone held by a P1 run is suspended straight away. When the last P1 run
+    blocking it ends, the P2 run resumes with the time it had left. Every
+    decision is a few dictionary lookups per zone; nothing touches the DB
+    except the history rows written in the background.
+
+    Once a run has been suspended the arbiter owns its stop, so the
+    schedule's original stop job must leave it alone (see owns_stop).
+    """
+
+    def __init__(self):
+        self._runs: Dict[str, ArbitratedRun] = {}
+        self._p1_by_zone: Dict[str, Set[str]] = defaultdict(set)
+        self._p2_by_zone: Dict[str, Set[str]] = defaultdict(set)
+        self._blocked: Dict[str, Set[str]] = defaultdict(set)  # P1 key -> P2 keys
+        self._tasks: Set[asyncio.Task] = set()
+        self.suspensions = 0
+        self.resumptions = 0
+        sequential_engine.add_finish_listener(self._on_sequential_finished)
+
+    def _index(self, run: ArbitratedRun) -> Optional[Dict[str, Set[str]]]:
+        if run.event_type == EventType.P1:
+            return self._p1_by_zone
+        if run.event_type == EventType.P2:
+            return self._p2_by_zone
+        return None
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def start_run(self, run: ArbitratedRun) -> bool:
+        """
+        Register a starting run
+
+        Returns:
+            bool: True if the run's zones should be opened now, False if it
+            starts suspended behind an active P1 run
+        """
+        if run.key in self._runs:
+            self.finish_run(run.key)
+        self._runs[run.key] = run
+        index = self._index(run)
+        if index is not None:
+            for entity_id in run.entity_ids:
+                index[entity_id].add(run.key)
+        loop = asyncio.get_running_loop()
+        run.deadline = loop.time() + run.duration
+
+        if run.event_type == EventType.P2:
+            blockers = set()
+            for entity_id in run.entity_ids:
+                blockers |= self._p1_by_zone.get(entity_id, set())
+            if blockers:
+                for key in blockers:
+                    self._block(run, key)
+                run.suspended = True
+                run.managed = True
+                run.remaining = run.duration
+                self.suspensions += 1
+                self._record(run, "suspended", f"Blocked by {', '.join(sorted(blockers))}")
+                logger.info(f"P2 run {run.key} held back by active P1 run(s)")
+                return False
+
+        elif run.event_type == EventType.P1:
+            victims = set()
+            for entity_id in run.entity_ids:
+                victims |= self._p2_by_zone.get(entity_id, set())
+            for key in victims:
+                await self._suspend(self._runs[key], run)
+
+        return True
+
+    def owns_stop(self, key: str) -> bool:
+        """True if the arbiter, not the schedule's stop job, ends this run"""
+        run = self._runs.get(key)
+        return run is not None and run.managed
+
+    def finish_run(self, key: str) -> None:
+        """Forget a finished run and resume the P2 runs it was holding"""
+        run = self._runs.pop(key, None)
+        if run is None:
+            return
+        zone_deadlines.cancel(run.deadline_key)
+        index = self._index(run)
+        if index is not None:
+            for entity_id in run.entity_ids:
+                keys = index.get(entity_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[entity_id]
+        for blocker in run.blockers:
+            self._blocked.get(blocker, set()).discard(key)
+
+        for victim_key in self._blocked.pop(key, set()):
+            victim = self._runs.get(victim_key)
+            if victim is None:
+                continue
+            victim.blockers.discard(key)
+            if victim.suspended and not victim.blockers:
+                self._spawn(self._resume(victim))
+
+    def _block(self, victim: ArbitratedRun, by_key: str) -> None:
+        victim.blockers.add(by_key)
+        self._blocked[by_key].add(victim.key)
+
+    async def _suspend(self, victim: ArbitratedRun, by_run: ArbitratedRun) -> None:
+        by_key = by_run.key
+        self._block(victim, by_key)
+        if victim.suspended:
+            return
+        victim.suspended = True
+        victim.managed = True
+        self.suspensions += 1
+
+        # Open zones the P1 run is about to water are handed to it rather
+        # than closed and reopened; a sequential P1 run opens its zones one
+        # at a time, so it takes nothing over
+        handed_over = set()
+        if not by_run.sequential:
+            for entity_id in victim.entity_ids:
+                if entity_id in by_run.entity_ids and admission_controller.demand(entity_id):
+                    admission_controller.try_acquire(entity_id, by_key)
+                    handed_over.add(entity_id)
+
+        if victim.sequential_run_id is not None:
+            # Its turn-off of a handed-over zone is suppressed as in use
+            sequential_engine.suspend_run(victim.sequential_run_id)
+        else:
+            zone_deadlines.cancel(victim.deadline_key)
+            victim.remaining = max(0.0, victim.deadline - asyncio.get_running_loop().time())
+            admission_controller.release_many(victim.entity_ids, victim.key)
+            closing = [entity_id for entity_id in victim.entity_ids if entity_id not in handed_over]
+            if closing:
+                await switch_zones(victim.ha_service, closing, 'turn_off', owner=victim.key)
+
+        self._record(victim, "suspended", f"Pre-empted by {by_key}")
+        logger.info(f"Suspended P2 run {victim.key} for {by_key}")
+
+    async def _resume(self, run: ArbitratedRun) -> None:
+        run.suspended = False
+        self.resumptions += 1
+
+        if run.sequential_run_id is not None:
+            sequential_engine.resume_run(run.sequential_run_id)
+            self._record(run, "resumed", "P1 runs finished")
+        else:
+            loop = asyncio.get_running_loop()
+            run.deadline = loop.time() + run.remaining
+            zone_deadlines.schedule(
+                run.deadline_key, run.remaining, run.entity_ids, owner=run.key,
+                callback=partial(self._on_deadline, run.key)
+            )
+            self._record(
+                run, "resumed", "P1 runs finished",
+                duration_minutes=round(run.remaining / 60)
+            )
+            await admit_and_turn_on(
+                run.ha_service, run.entity_ids, run.key, run.priority, run.event_type,
+                source="schedule", schedule_id=run.schedule_id,
+                deadline=time.time() + run.remaining
+            )
+        logger.info(f"Resumed P2 run {run.key}")
+
+    def _on_deadline(self, key: str) -> None:
+        run = self._runs.get(key)
+        if run is not None and not run.suspended:
+            self._spawn(self._stop_managed(run))
+
+    async def _stop_managed(self, run: ArbitratedRun) -> None:
+        admission_controller.release_many(run.entity_ids, run.key)
+        await switch_zones(run.ha_service, run.entity_ids, 'turn_off', owner=run.key)
+        self.finish_run(run.key)
+
+    def _on_sequential_finished(self, sequential_run: SequentialRun) -> None:
+        # Manual runs key each slot of a schedule separately
+        for key, run in list(self._runs.items()):
+            if run.sequential_run_id == sequential_run.run_id:
+                self.finish_run(key)
+
+    def _record(
+        self,
+        run: ArbitratedRun,
+        status: str,
+        reason: str,
+        duration_minutes: Optional[int] = None
+    ) -> None:
+        """Write ScheduleHistory rows off the event loop"""
+        def write() -> None:
+            db = SessionLocal()
+            try:
+                DatabaseService(db).add_history_entries(
+                    run.schedule_id, run.entity_ids, status, run.event_type,
+                    reason=reason, duration_minutes=duration_minutes
+                )
+            finally:
+                db.close()
+
+        self._spawn(run_db(write))
+
+    def snapshot(self) -> dict:
+        return {
+            "active_runs": sum(1 for run in self._runs.values() if not run.suspended),
+            "suspended_runs": sum(1 for run in self._runs.values() if run.suspended),
+            "suspensions": self.suspensions,
+            "resumptions": self.resumptions
+        }
+
+# App-wide arbiter shared by every SchedulerService
+run_arbiter = RunArbiter()
@@ -0,0 +1,451 @@
+import asyncio
+import enum
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from ..core.config import settings
+from ..core.metrics import LatencyRegistry
+
+logger = logging.getLogger(__name__)
+
+# Finished commands kept for GET /api/commands/{command_id}
+COMMAND_HISTORY = 500
+
+class CommandState(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    RETRYING = "retrying"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    EXPIRED = "expired"
+
+class CircuitBreaker:
+    """
+    Holds commands back while Home Assistant core is unreachable.
+
+    After `threshold` consecutive retryable failures (connection errors and
+    5xx responses, as while HA core restarts) the breaker opens and commands
+    wait instead of burning their retries. Once `reset_timeout` has passed a
+    single trial command is let through: if HA answers the breaker closes,
+    otherwise it opens again.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self.trips = 0
+
+    def allow(self) -> bool:
+        """Whether a command may be sent now"""
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._trial = False
+        if self.state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return self.state == "closed"
+
+    def retry_in(self) -> float:
+        """Seconds a held-back command waits before asking again"""
+        if self.state == "open":
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        return min(1.0, self.reset_timeout)
+
+    def abandon_trial(self) -> None:
+        """The trial command was allowed but sent nothing"""
+        self._trial = False
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info("Home Assistant answered again, resuming commands")
+        self.state = "closed"
+        self._failures = 0
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self._failures >= self.threshold):
+            if self.state == "closed":
+                self.trips += 1
+                logger.warning(
+                    f"Home Assistant unreachable after {self._failures} failures, "
+                    f"holding commands for {self.reset_timeout}s"
+                )
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self._failures, "trips": self.trips}
+
+class Command:
+    """One queued switch command and what became of it"""
+
+    __slots__ = (
+        "command_id", "action", "entity_ids", "attempt", "gate", "ungate", "state", "attempts",
+        "remaining", "admitted", "gating", "results", "error", "created_at", "started_at",
+        "finished_at", "lock"
+    )
+
+    def __init__(
+        self,
+        command_id: int,
+        action: str,
+        entity_ids: List[str],
+        attempt: Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]],
+        gate: Optional[Callable[[str], Awaitable[bool]]] = None,
+        ungate: Optional[Callable[[str], None]] = None
+    ):
+        self.command_id = command_id
+        self.action = action
+        self.entity_ids = entity_ids
+        self.attempt = attempt  # switches the entities given, returns per-entity results
+        self.gate = gate  # waits until an entity may be switched, False if refused
+        self.ungate = ungate  # gives back what the gate took for an entity never sent
+        self.state = CommandState.QUEUED
+        self.attempts = 0
+        self.remaining: Set[str] = set(entity_ids)  # entities still to be switched
+        self.admitted: Set[str] = set()  # gated entities let through, not yet sent
+        self.gating: Dict[str, asyncio.Task] = {}  # gates still being waited on
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.lock = asyncio.Lock()  # one worker at a time; a gate may requeue it meanwhile
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def to_dict(self) -> dict:
+        return {
+            "command_id": self.command_id,
+            "action": self.action,
+            "entity_ids": list(self.entity_ids),
+            "state": self.state.value,
+            "attempts": self.attempts,
+            "retries": max(0, self.attempts - 1),
+            "results": dict(self.results),
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "latency_ms": (
+                round((self.finished_at - self.created_at) * 1000, 3)
+                if self.finished_at is not None else None
+            )
+        }
+
+class CommandQueue:
+    """
+    Queue of switch commands drained by a pool of workers.
+
+    Control endpoints submit a command and return straight away. A worker
+    sends it; entities that fail with a retryable error are tried again
+    after an exponential backoff, up to `max_retries` times, and commands
+    still unsent after `timeout` seconds expire rather than switch a zone
+    long after it was asked for. Commands for the same entity are sent one
+    at a time in submission order, and a newer command for an entity
+    supersedes the retries of an older one.
+
+    A command may carry a gate, such as zone admission, awaited per entity
+    in a task of its own rather than by a worker. The command goes back on
+    the queue as gates open and those entities are sent, so neither the
+    workers nor the entity locks are held while a zone waits for a slot.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_retries: int,
+        backoff: float,
+        backoff_max: float,
+        timeout: float,
+        breaker: CircuitBreaker,
+        history_size: int = COMMAND_HISTORY
+    ):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.breaker = breaker
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._commands: Dict[int, Command] = {}
+        self._finished: Deque[int] = deque()
+        self._history_size = history_size
+        self._ids = itertools.count(1)
+        self._latest: Dict[str, int] = {}  # entity_id -> newest command for it
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._workers: List[asyncio.Task] = []
+        self._timers: Set[asyncio.TimerHandle] = set()
+        self._gates: Set[asyncio.Task] = set()
+        self.latency = LatencyRegistry()
+        self.counts = {
+            state: 0
+            for state in (CommandState.SUCCEEDED, CommandState.FAILED, CommandState.EXPIRED)
+        }
+        self.retries = 0
+
+    def submit(
+        self,
+        entity_ids: List[str],
+        action: str,
+        attempt: Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]],
+        gate: Optional[Callable[[str], Awaitable[bool]]] = None,
+        ungate: Optional[Callable[[str], None]] = None
+    ) -> Command:
+        """
+        Queue a command and return it without waiting
+
+        Args:
+            entity_ids: Zones to switch
+            action: Either 'turn_on' or 'turn_off', for reporting
+            attempt: Coroutine function switching the entities it is given
+                and returning per-entity results ("success", "retryable")
+            gate: Coroutine function waiting until one entity may be
+                switched; entities it refuses fail without being attempted
+            ungate: Undoes a gate that let an entity through which then
+                expired unsent
+        """
+        command = Command(
+            next(self._ids), action, list(dict.fromkeys(entity_ids)), attempt, gate, ungate
+        )
+        self._commands[command.command_id] = command
+        for entity_id in command.entity_ids:
+            self._latest[entity_id] = command.command_id
+        self._queue.put_nowait(command)
+        return command
+
+    def get(self, command_id: int) -> Optional[Command]:
+        return self._commands.get(command_id)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """Start the workers on the running loop"""
+        self._workers = [
+            asyncio.ensure_future(self._worker()) for _ in range(self.workers)
+        ]
+        logger.info(f"Command queue started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        for task in [*self._workers, *self._gates]:
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._gates, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self) -> None:
+        while True:
+            command = await self._queue.get()
+            try:
+                await self._run(command)
+            except Exception as e:
+                logger.error(f"Command {command.command_id} failed: {str(e)}")
+                self._finish(command, CommandState.FAILED, str(e))
+            finally:
+                self._queue.task_done()
+
+    def _superseded(self, command: Command) -> None:
+        """Drop entities a newer command has taken over"""
+        for entity_id in list(command.remaining):
+            if self._latest.get(entity_id) != command.command_id:
+                command.remaining.discard(entity_id)
+                command.results[entity_id] = {"success": False, "latency_ms": None, "superseded": True}
+
+    async def _run(self, command: Command) -> None:
+        async with command.lock:
+            if not command.done:
+                await self._step(command)
+
+    async def _step(self, command: Command) -> None:
+        self._superseded(command)
+        if time.time() - command.created_at > self.timeout:
+            self._finish(command, CommandState.EXPIRED, f"Not sent within {self.timeout}s")
+            return
+        if command.gate is not None:
+            for entity_id in command.entity_ids:
+                if (
+                    entity_id in command.remaining
+                    and entity_id not in command.admitted
+                    and entity_id not in command.gating
+                ):
+                    command.gating[entity_id] = self._spawn_gate(command, entity_id)
+        ready = [
+            entity_id for entity_id in command.entity_ids
+            if entity_id in command.remaining
+            and (command.gate is None or entity_id in command.admitted)
+        ]
+        if not ready:
+            if not command.gating:
+                self._complete(command)
+            return
+        if not self.breaker.allow():
+            command.error = "Waiting for Home Assistant"
+            self._retry_later(command, self.breaker.retry_in())
+            return
+
+        results = await self._attempt(command, ready)
+        if results is None:
+            self.breaker.abandon_trial()
+            if not command.gating:
+                self._complete(command)
+            return
+        command.attempts += 1
+
+        retry = []
+        for entity_id, result in results.items():
+            command.results[entity_id] = result
+            command.admitted.discard(entity_id)
+            if result["success"] or not result.get("retryable"):
+                command.remaining.discard(entity_id)
+            else:
+                retry.append(entity_id)
+        if retry:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        if retry and command.attempts <= self.max_retries:
+            self.retries += 1
+            command.state = CommandState.RETRYING
+            delay = min(self.backoff_max, self.backoff * 2 ** (command.attempts - 1))
+            logger.info(
+                f"Command {command.command_id}: retrying {', '.join(retry)} in {delay}s "
+                f"(attempt {command.attempts})"
+            )
+            self._retry_later(command, delay)
+            return
+        command.remaining.difference_update(retry)
+        if not command.gating:
+            self._complete(command)
+
+    def _complete(self, command: Command) -> None:
+        failed = [
+            entity_id for entity_id, result in command.results.items()
+            if not result["success"] and not result.get("superseded")
+        ]
+        if failed:
+            self._finish(command, CommandState.FAILED, f"Failed to {command.action} {', '.join(failed)}")
+        else:
+            self._finish(command, CommandState.SUCCEEDED)
+
+    async def _attempt(
+        self, command: Command, entity_ids: List[str]
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Switch entities under their locks; None if all were superseded meanwhile"""
+        async with AsyncExitStack() as stack:
+            # Sorted so commands sharing entities cannot deadlock
+            for entity_id in sorted(entity_ids):
+                await stack.enter_async_context(self._locks.setdefault(entity_id, asyncio.Lock()))
+            self._superseded(command)
+            entity_ids = [entity_id for entity_id in entity_ids if entity_id in command.remaining]
+            if not entity_ids:
+                return None
+
+            command.state = CommandState.RUNNING
+            if command.started_at is None:
+                command.started_at = time.time()
+                self.latency.record("queue_wait", command.started_at - command.created_at)
+            started = time.perf_counter()
+            results = await command.attempt(entity_ids)
+            self.latency.record("attempt", time.perf_counter() - started)
+        return {
+            entity_id: results.get(entity_id, {"success": False, "latency_ms": None})
+            for entity_id in entity_ids
+        }
+
+    def _spawn_gate(self, command: Command, entity_id: str) -> asyncio.Task:
+        task = asyncio.ensure_future(self._await_gate(command, entity_id))
+        self._gates.add(task)
+        task.add_done_callback(self._gates.discard)
+        return task
+
+    async def _await_gate(self, command: Command, entity_id: str) -> None:
+        """Wait on one entity's gate, then hand the command back to the workers"""
+        try:
+            opened = await command.gate(entity_id)
+        except Exception as e:
+            logger.error(f"Command {command.command_id}: gate for {entity_id} failed: {str(e)}")
+            opened = False
+        finally:
+            command.gating.pop(entity_id, None)
+        if entity_id in command.remaining:
+            if opened:
+                command.admitted.add(entity_id)
+            else:
+                command.remaining.discard(entity_id)
+                command.results[entity_id] = {"success": False, "latency_ms": None, "admitted": False}
+        self._queue.put_nowait(command)
+
+    def _retry_later(self, command: Command, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+
+        def requeue() -> None:
+            self._timers.discard(timer)
+            self._queue.put_nowait(command)
+
+        timer = loop.call_later(delay, requeue)
+        self._timers.add(timer)
+
+    def _finish(self, command: Command, state: CommandState, error: Optional[str] = None) -> None:
+        for task in command.gating.values():
+            task.cancel()
+        command.gating.clear()
+        if command.ungate is not None:
+            # Let through but never sent, e.g. expired while HA was down
+            for entity_id in command.admitted & command.remaining:
+                command.ungate(entity_id)
+        command.admitted.clear()
+        command.state = state
+        command.error = error
+        command.finished_at = time.time()
+        command.attempt = command.gate = command.ungate = None  # drop the bound services
+        self.counts[state] += 1
+        self.latency.record(
+            "command", command.finished_at - command.created_at,
+            error=state != CommandState.SUCCEEDED
+        )
+        for entity_id in command.entity_ids:
+            if self._latest.get(entity_id) == command.command_id:
+                del self._latest[entity_id]
+        self._finished.append(command.command_id)
+        while len(self._finished) > self._history_size:
+            self._commands.pop(self._finished.popleft(), None)
+
+    def snapshot(self) -> dict:
+        latency = self.latency.snapshot()
+        return {
+            "workers": len(self._workers),
+            "depth": self.depth,
+            "pending": len(self._commands) - len(self._finished),
+            "succeeded": self.counts[CommandState.SUCCEEDED],
+            "failed": self.counts[CommandState.FAILED],
+            "expired": self.counts[CommandState.EXPIRED],
+            "retries": self.retries,
+            "breaker": self.breaker.snapshot(),
+            "queue_wait": latency.get("queue_wait"),
+            "attempt": latency.get("attempt"),
+            "command": latency.get("command")
+        }
+
+# App-wide queue behind the solenoid and group control endpoints
+command_queue = CommandQueue(
+    settings.COMMAND_WORKERS,
+    settings.COMMAND_MAX_RETRIES,
+    settings.COMMAND_RETRY_BACKOFF,
+    settings.COMMAND_RETRY_BACKOFF_MAX,
+    settings.COMMAND_TIMEOUT,
+    CircuitBreaker(settings.HA_BREAKER_THRESHOLD, settings.HA_BREAKER_RESET)
+)
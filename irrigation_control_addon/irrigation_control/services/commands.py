@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .confirmations import switch_confirmations
+from .ha_state_mirror import get_state_mirror
+
+logger = logging.getLogger(__name__)
+
+# A repeat of the last command for an entity within this window is dropped
+COALESCE_WINDOW = 2.0  # seconds
+
+_EXPECTED_STATE = {"turn_on": "on", "turn_off": "off"}
+
+class CommandLayer:
+    """
+    Sends zones only the switch transitions they really need.
+
+    Demand for a zone comes from the demand source, the admission
+    controller's count of owners holding it, so a turn_off is held back
+    while another run still needs the valve. A command identical to one in
+    flight waits for that one instead of being sent again, and a repeat of
+    the last command sent for an entity is dropped if it was sent within
+    COALESCE_WINDOW or the mirrored state already matches. Every call that
+    is not sent is counted by reason. Every command sent registers the
+    state its switch should report with the confirmation tracker.
+    """
+
+    def __init__(self, window: float = COALESCE_WINDOW):
+        self.window = window
+        self._last: Dict[str, Tuple[str, float]] = {}  # entity_id -> (action, sent at)
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._demand: Callable[[str, Optional[str]], int] = lambda entity_id, exclude: 0
+        self.sent = 0
+        self.suppressed: Counter = Counter()
+
+    def set_demand_source(self, demand: Callable[[str, Optional[str]], int]) -> None:
+        """Use `demand(entity_id, exclude_owner)` to count who still needs a zone"""
+        self._demand = demand
+
+    def _redundant(self, entity_id: str, action: str) -> Optional[str]:
+        """Why `action` need not be sent to `entity_id`, or None"""
+        last = self._last.get(entity_id)
+        if last is None or last[0] != action:
+            return None
+        if time.monotonic() - last[1] < self.window:
+            return "coalesced"
+        mirror = get_state_mirror()
+        if mirror is None or not mirror.is_synced:
+            return None  # Nothing to confirm the state with; send it again
+        state = mirror.get(entity_id)
+        if state is not None and state.get("state") == _EXPECTED_STATE[action]:
+            return "redundant"
+        return None  # Changed behind our back; send it again
+
+    async def switch(
+        self,
+        ha_service,
+        entity_ids: List[str],
+        action: str,
+        owner: Optional[str] = None,
+        force: bool = False
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Switch zones, sending only real transitions
+
+        Args:
+            ha_service: Service used for the commands that are sent
+            entity_ids: Zones to switch
+            action: Either 'turn_on' or 'turn_off'
+            owner: Owner the command is for; its own hold on a zone does not
+                count as demand keeping the zone on
+            force: Send regardless of demand and of what was sent before
+
+        Returns:
+            Dict mapping each entity_id to {"success", "latency_ms",
+            "suppressed"}, where "suppressed" names why nothing was sent
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        waits: Dict[str, asyncio.Future] = {}
+        send: List[str] = []
+
+        for entity_id in dict.fromkeys(entity_ids):
+            reason = None
+            if not force:
+                if action == "turn_off" and self._demand(entity_id, owner):
+                    reason = "in_use"
+                elif (entity_id, action) in self._inflight:
+                    waits[entity_id] = self._inflight[(entity_id, action)]
+                    self.suppressed["coalesced"] += 1
+                    continue
+                else:
+                    reason = self._redundant(entity_id, action)
+            if reason is not None:
+                self.suppressed[reason] += 1
+                results[entity_id] = {"success": True, "latency_ms": 0.0, "suppressed": reason}
+            else:
+                send.append(entity_id)
+
+        if send:
+            loop = asyncio.get_running_loop()
+            futures = {entity_id: loop.create_future() for entity_id in send}
+            for entity_id, future in futures.items():
+                self._inflight[(entity_id, action)] = future
+                # Before sending, so an event beating the response still counts
+                switch_confirmations.expect(entity_id, _EXPECTED_STATE[action], owner)
+            try:
+                sent = await ha_service.control_switches(send, action)
+            except Exception as e:
+                logger.error(f"Failed to {action} {', '.join(send)}: {str(e)}")
+                sent = {entity_id: {"success": False, "latency_ms": None} for entity_id in send}
+            except asyncio.CancelledError:
+                # Release anyone coalesced onto the cancelled call
+                for entity_id in send:
+                    self._inflight.pop((entity_id, action), None)
+                    self._last.pop(entity_id, None)
+                    switch_confirmations.withdraw(entity_id)
+                    futures[entity_id].set_result({"success": False, "latency_ms": None})
+                raise
+            self.sent += len(send)
+            now = time.monotonic()
+            for entity_id in send:
+                self._inflight.pop((entity_id, action), None)
+                result = dict(sent.get(entity_id, {"success": False, "latency_ms": None}))
+                result["suppressed"] = None
+                if result["success"]:
+                    self._last[entity_id] = (action, now)
+                else:
+                    self._last.pop(entity_id, None)
+                    switch_confirmations.withdraw(entity_id)
+                results[entity_id] = result
+                futures[entity_id].set_result(result)
+
+        for entity_id, future in waits.items():
+            result = dict(await asyncio.shield(future))
+            result["suppressed"] = "coalesced"
+            results[entity_id] = result
+        return results
+
+    def snapshot(self) -> dict:
+        return {
+            "sent": self.sent,
+            "suppressed": dict(self.suppressed),
+            "suppressed_total": sum(self.suppressed.values())
+        }
+
+# App-wide command layer in front of every zone switch command
+command_layer = CommandLayer()
+
+async def switch_zones(
+    ha_service,
+    entity_ids: List[str],
+    action: str,
+    owner: Optional[str] = None,
+    force: bool = False
+) -> Dict[str, Dict[str, Any]]:
+    """Switch zones through the app-wide command layer"""
+    return await command_layer.switch(ha_service, entity_ids, action, owner, force)
+
+async def switch_zone(
+    ha_service,
+    entity_id: str,
+    action: str,
+    owner: Optional[str] = None,
+    force: bool = False
+) -> bool:
+    """Switch one zone through the app-wide command layer"""
+    results = await command_layer.switch(ha_service, [entity_id], action, owner, force)
+    return results[entity_id]["success"]
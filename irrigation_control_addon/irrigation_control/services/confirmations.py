@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from ..core.config import settings
+from ..core.database import SessionLocal, run_db
+from ..core.metrics import LatencyHistogram
+from ..models.database_models import EventType
+from .db_service import DatabaseService
+from .ha_state_mirror import get_state_mirror
+from .run_registry import run_registry
+
+logger = logging.getLogger(__name__)
+
+class Expectation:
+    """A switch that should report `state` soon after a command was sent"""
+
+    __slots__ = ("entity_id", "state", "owner", "schedule_id", "sent_at", "future", "handle")
+
+    def __init__(
+        self,
+        entity_id: str,
+        state: str,
+        owner: Optional[str],
+        schedule_id: Optional[int],
+        sent_at: float,
+        future: asyncio.Future
+    ):
+        self.entity_id = entity_id
+        self.state = state  # 'on' or 'off'
+        self.owner = owner
+        self.schedule_id = schedule_id
+        self.sent_at = sent_at  # loop time the command was sent
+        self.future = future  # True when confirmed, False on timeout or withdrawal
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+class SwitchConfirmations:
+    """
+    Confirms switch commands from the state mirror's state_changed events.
+
+    A command registers what its switch should report before it is sent,
+    so an event arriving ahead of the HTTP response still counts. The
+    expectation resolves when a matching event comes in; after `timeout`
+    the mirrored state is checked once more and the zone is otherwise
+    marked as a fault in the run registry and the schedule history. A newer
+    command for the same switch replaces the older expectation.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._pending: Dict[str, Expectation] = {}
+        self._tasks: Set[asyncio.Future] = set()
+        self.latency = LatencyHistogram()
+        self.confirmed = 0
+        self.timeouts = 0
+        self.unverified = 0
+
+    def expect(self, entity_id: str, state: str, owner: Optional[str] = None) -> Optional[asyncio.Future]:
+        """
+        Register that `entity_id` should report `state`
+
+        Returns:
+            Future resolving to True once confirmed and False otherwise, or
+            None when the state mirror is not in sync to confirm anything
+        """
+        mirror = get_state_mirror()
+        if mirror is None or not mirror.is_synced:
+            self.unverified += 1
+            return None
+        self._resolve(entity_id, False)
+        loop = asyncio.get_running_loop()
+        current = mirror.get(entity_id)
+        if current is not None and current.get("state") == state:
+            # Already there: Home Assistant will not send a state change
+            run_registry.clear_fault(entity_id)
+            future = loop.create_future()
+            future.set_result(True)
+            return future
+        expectation = Expectation(
+            entity_id, state, owner, _schedule_id_of(entity_id, owner),
+            loop.time(), loop.create_future()
+        )
+        expectation.handle = loop.call_later(self.timeout, self._expire, expectation)
+        self._pending[entity_id] = expectation
+        return expectation.future
+
+    def withdraw(self, entity_id: str) -> None:
+        """Forget the expectation of a command that was not sent after all"""
+        self._resolve(entity_id, False)
+
+    def on_state_changed(self, entity_id: str, new_state: Dict[str, Any]) -> None:
+        """State mirror listener"""
+        expectation = self._pending.get(entity_id)
+        if expectation is not None and new_state.get("state") == expectation.state:
+            self._confirm(expectation)
+
+    def _confirm(self, expectation: Expectation) -> None:
+        self.latency.record(asyncio.get_running_loop().time() - expectation.sent_at)
+        self.confirmed += 1
+        run_registry.clear_fault(expectation.entity_id)
+        self._resolve(expectation.entity_id, True)
+
+    def _resolve(self, entity_id: str, confirmed: bool) -> None:
+        expectation = self._pending.pop(entity_id, None)
+        if expectation is None:
+            return
+        if expectation.handle is not None:
+            expectation.handle.cancel()
+        if not expectation.future.done():
+            expectation.future.set_result(confirmed)
+
+    def _expire(self, expectation: Expectation) -> None:
+        expectation.handle = None
+        if self._pending.get(expectation.entity_id) is not expectation:
+            return
+        mirror = get_state_mirror()
+        state = mirror.get(expectation.entity_id) if mirror is not None else None
+        if state is not None and state.get("state") == expectation.state:
+            # Confirmed by a resync rather than an event
+            self._confirm(expectation)
+            return
+
+        self.timeouts += 1
+        reason = f"Switch did not report '{expectation.state}' within {self.timeout}s"
+        logger.error(f"{expectation.entity_id}: {reason}")
+        run_registry.fault(expectation.entity_id, expectation.state, reason)
+        self._resolve(expectation.entity_id, False)
+        self._record(expectation, reason)
+
+    def _record(self, expectation: Expectation, reason: str) -> None:
+        """Write the fault to the schedule history off the event loop"""
+        def write() -> None:
+            db = SessionLocal()
+            try:
+                service = DatabaseService(db)
+                event_type = EventType.MANUAL
+                if expectation.schedule_id is not None:
+                    schedule = service.get_schedule(expectation.schedule_id)
+                    if schedule is not None:
+                        event_type = schedule.event_type
+                service.add_history_entries(
+                    expectation.schedule_id, [expectation.entity_id], "error", event_type,
+                    reason=reason
+                )
+            finally:
+                db.close()
+
+        task = asyncio.ensure_future(run_db(write))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def snapshot(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "confirmed": self.confirmed,
+            "timeouts": self.timeouts,
+            "unverified": self.unverified,
+            "latency": self.latency.snapshot()
+        }
+
+def _schedule_id_of(entity_id: str, owner: Optional[str]) -> Optional[int]:
+    """Schedule a command was sent for, if any"""
+    if owner is None:
+        return None
+    run = run_registry.get(entity_id, owner)
+    if run is not None:
+        return run.schedule_id
+    # "schedule_4", or "schedule_4_slot_9" for a slot run manually
+    parts = owner.split("_")
+    if len(parts) > 1 and parts[0] == "schedule" and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+# App-wide tracker fed by the state mirror
+switch_confirmations = SwitchConfirmations(settings.SWITCH_CONFIRM_TIMEOUT)
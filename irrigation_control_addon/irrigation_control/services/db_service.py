@@ -1,6 +1,7 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy.exc import SQLAlchemyError
 from typing import List, Optional
+from datetime import datetime
 import logging
 
 from ..models import database_models as models
@@ -8,6 +9,18 @@ from ..models import schemas
 
 logger = logging.getLogger(__name__)
 
+# Relationships serialized with every schedule and group, loaded with one
+# extra query per relationship instead of one per row
+SCHEDULE_LOADS = (
+    selectinload(models.Schedule.time_slots),
+    selectinload(models.Schedule.conditions),
+    selectinload(models.Schedule.solenoid),
+    selectinload(models.Schedule.group).selectinload(models.ZoneGroup.solenoids)
+)
+GROUP_LOADS = (
+    selectinload(models.ZoneGroup.solenoids),
+)
+
 class DatabaseService:
     def __init__(self, db: Session):
         self.db = db
@@ -68,20 +81,24 @@ class DatabaseService:
                     db_group.solenoids.append(solenoid)
 
             self.db.commit()
-            self.db.refresh(db_group)
-            return db_group
+            return self.get_group(db_group.id)
         except SQLAlchemyError as e:
             logger.error(f"Error creating group: {str(e)}")
             self.db.rollback()
             return None
 
     def get_group(self, group_id: int) -> Optional[models.ZoneGroup]:
-        return self.db.query(models.ZoneGroup).filter(
+        return self.db.query(models.ZoneGroup).options(*GROUP_LOADS).filter(
             models.ZoneGroup.id == group_id
         ).first()
 
+    def get_group_schedules(self, group_id: int) -> List[models.Schedule]:
+        return self.db.query(models.Schedule).options(*SCHEDULE_LOADS).filter(
+            models.Schedule.group_id == group_id
+        ).all()
+
     def get_groups(self) -> List[models.ZoneGroup]:
-        return self.db.query(models.ZoneGroup).all()
+        return self.db.query(models.ZoneGroup).options(*GROUP_LOADS).all()
 
     def update_group(self, group_id: int, group: schemas.ZoneGroupCreate) -> Optional[models.ZoneGroup]:
         try:
@@ -101,8 +118,7 @@ class DatabaseService:
                     db_group.solenoids.append(solenoid)
 
             self.db.commit()
-            self.db.refresh(db_group)
-            return db_group
+            return self.get_group(db_group.id)
         except SQLAlchemyError as e:
             logger.error(f"Error updating group: {str(e)}")
             self.db.rollback()
@@ -146,20 +162,19 @@ class DatabaseService:
                 self.db.add(db_slot)
 
             self.db.commit()
-            self.db.refresh(db_schedule)
-            return db_schedule
+            return self.get_schedule(db_schedule.id)
         except SQLAlchemyError as e:
             logger.error(f"Error creating schedule: {str(e)}")
             self.db.rollback()
             return None
 
     def get_schedule(self, schedule_id: int) -> Optional[models.Schedule]:
-        return self.db.query(models.Schedule).filter(
+        return self.db.query(models.Schedule).options(*SCHEDULE_LOADS).filter(
             models.Schedule.id == schedule_id
         ).first()
 
     def get_schedules(self) -> List[models.Schedule]:
-        return self.db.query(models.Schedule).all()
+        return self.db.query(models.Schedule).options(*SCHEDULE_LOADS).all()
 
     def update_schedule(self, schedule_id: int, schedule: schemas.ScheduleUpdate) -> Optional[models.Schedule]:
         try:
@@ -189,8 +204,7 @@ class DatabaseService:
                     self.db.add(db_slot)
 
             self.db.commit()
-            self.db.refresh(db_schedule)
-            return db_schedule
+            return self.get_schedule(db_schedule.id)
         except SQLAlchemyError as e:
             logger.error(f"Error updating schedule: {str(e)}")
             self.db.rollback()
@@ -208,3 +222,36 @@ class DatabaseService:
             logger.error(f"Error deleting schedule: {str(e)}")
             self.db.rollback()
             return False
+
+    # History Operations
+    def add_history_entries(
+        self,
+        schedule_id: int,
+        entity_ids: List[str],
+        status: str,
+        event_type: models.EventType,
+        reason: Optional[str] = None,
+        duration_minutes: Optional[int] = None
+    ) -> bool:
+        """Record one history row per solenoid of a run"""
+        try:
+            solenoids = self.db.query(models.SolenoidDevice).filter(
+                models.SolenoidDevice.entity_id.in_(entity_ids)
+            ).all()
+            now = datetime.now().time()
+            for solenoid in solenoids:
+                self.db.add(models.ScheduleHistory(
+                    schedule_id=schedule_id,
+                    solenoid_id=solenoid.id,
+                    start_time=now,
+                    duration_minutes=duration_minutes,
+                    status=status,
+                    reason=reason,
+                    event_type=event_type
+                ))
+            self.db.commit()
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Error recording schedule history: {str(e)}")
+            self.db.rollback()
+            return False
@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, select
+
+from ..core.database import SessionLocal, run_db
+from ..models.database_models import ZoneDeadline
+from .commands import switch_zones
+
+logger = logging.getLogger(__name__)
+
+# Checkpoints are written at most this often, batching every change in between
+CHECKPOINT_INTERVAL = 1.0  # seconds
+
+class Deadline:
+    """When a set of zones must be turned off, and on whose behalf"""
+
+    __slots__ = ("key", "kind", "entity_ids", "owner", "due_at", "callback", "rounds", "bucket")
+
+    def __init__(
+        self,
+        key: str,
+        kind: str,
+        entity_ids: tuple,
+        owner: Optional[str],
+        due_at: float,
+        callback: Optional[Callable] = None
+    ):
+        self.key = key
+        self.kind = kind
+        self.entity_ids = entity_ids
+        self.owner = owner
+        self.due_at = due_at  # Unix time
+        self.callback = callback  # in-process handler; lost on restart
+        self.rounds = 0
+        self.bucket = 0
+
+class DeadlineWheel:
+    """
+    Hashed timing wheel for zone stop deadlines and safety cut-offs.
+
+    Deadlines live in `size` buckets of `resolution` seconds each; one
+    expiring after more than a full turn of the wheel carries the number of
+    turns left. Arming, cancelling and extending a deadline are dictionary
+    operations, and each tick only looks at one bucket. The wheel only ticks
+    while deadlines are armed.
+
+    A deadline either calls the handler it was armed with or, if it has
+    none, turns its zones off, the admission controller's expiry listener
+    releasing its owner's hold. Handlers do not survive a restart, so every
+    deadline is checkpointed to SQLite in batches and re-armed on startup
+    with the turn-off fallback; deadlines that passed while the add-on was
+    down fire straight away. Run journal recovery takes over the stops of
+    the zones it deals with.
+    """
+
+    def __init__(self, resolution: float = 1.0, size: int = 512, session_factory=SessionLocal):
+        self.resolution = resolution
+        self.size = size
+        self._session_factory = session_factory
+        self._buckets: List[Dict[str, Deadline]] = [{} for _ in range(size)]
+        self._deadlines: Dict[str, Deadline] = {}
+        self._tick = 0  # last processed tick
+        self._origin: Optional[float] = None  # loop time of tick 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._writes: Dict[str, Optional[Deadline]] = {}  # key -> row to save, None to delete
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._listeners: List[Callable[[Deadline], None]] = []
+        self._ha_service = None
+        self.expired = 0
+        self.cutoffs = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._deadlines
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def add_expiry_listener(self, listener: Callable[[Deadline], None]) -> None:
+        """Call `listener(deadline)` after any deadline expires"""
+        self._listeners.append(listener)
+
+    def get(self, key: str) -> Optional[Deadline]:
+        return self._deadlines.get(key)
+
+    def remaining(self, key: str) -> Optional[float]:
+        """Seconds until `key` expires, None if it is not armed"""
+        deadline = self._deadlines.get(key)
+        if deadline is None:
+            return None
+        return max(0.0, deadline.due_at - time.time())
+
+    def schedule(
+        self,
+        key: str,
+        delay: float,
+        entity_ids: Iterable[str],
+        kind: str = "stop",
+        owner: Optional[str] = None,
+        callback: Optional[Callable] = None
+    ) -> Deadline:
+        """
+        Arm `key` to expire in `delay` seconds, replacing any earlier deadline
+
+        Args:
+            key: Unique name, e.g. "stop:run_3" or "cutoff:switch.zone_1"
+            delay: Seconds from now
+            entity_ids: Zones turned off on expiry when there is no callback
+            kind: 'stop' for regular stops, 'cutoff' for safety cut-offs
+            owner: Admission owner holding the zones
+            callback: Called on expiry instead of turning the zones off; may
+                return a coroutine, which is run as a task
+        """
+        self._unlink(key)
+        deadline = Deadline(key, kind, tuple(entity_ids), owner, time.time() + delay, callback)
+        self._link(deadline, delay)
+        self._checkpoint(key, deadline)
+        return deadline
+
+    def cancel(self, key: str) -> bool:
+        """Disarm `key`; True if it was armed"""
+        if self._unlink(key) is None:
+            return False
+        self._checkpoint(key, None)
+        return True
+
+    def cancel_owned(self, owner: str, kind: str = "stop") -> List[str]:
+        """Disarm every `kind` deadline armed for `owner`; returns their keys"""
+        keys = [
+            key for key, deadline in self._deadlines.items()
+            if deadline.owner == owner and deadline.kind == kind
+        ]
+        for key in keys:
+            self.cancel(key)
+        return keys
+
+    def extend(self, key: str, seconds: float) -> bool:
+        """Move an armed deadline `seconds` later (earlier if negative)"""
+        deadline = self._unlink(key)
+        if deadline is None:
+            return False
+        deadline.due_at += seconds
+        self._link(deadline, deadline.due_at - time.time())
+        self._checkpoint(key, deadline)
+        return True
+
+    def _current_tick(self) -> float:
+        return (self._loop.time() - self._origin) / self.resolution
+
+    def _link(self, deadline: Deadline, delay: float) -> None:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        if self._origin is None:
+            self._origin = self._loop.time()
+        if not self._deadlines:
+            # Nothing armed: skip the idle ticks instead of replaying them
+            self._tick = max(self._tick, math.floor(self._current_tick()))
+        target = max(
+            self._tick + 1,
+            math.ceil(self._current_tick() + max(0.0, delay) / self.resolution)
+        )
+        deadline.rounds = (target - self._tick - 1) // self.size
+        deadline.bucket = target % self.size
+        self._buckets[deadline.bucket][deadline.key] = deadline
+        self._deadlines[deadline.key] = deadline
+        self._arm()
+
+    def _unlink(self, key: str) -> Optional[Deadline]:
+        deadline = self._deadlines.pop(key, None)
+        if deadline is not None:
+            self._buckets[deadline.bucket].pop(key, None)
+        return deadline
+
+    def _arm(self) -> None:
+        if self._handle is None and self._deadlines:
+            self._handle = self._loop.call_at(
+                self._origin + (self._tick + 1) * self.resolution, self._on_tick
+            )
+
+    def _on_tick(self) -> None:
+        self._handle = None
+        current = math.floor(self._current_tick())
+        while self._tick < current and self._deadlines:
+            self._tick += 1
+            bucket = self._buckets[self._tick % self.size]
+            due = []
+            for deadline in bucket.values():
+                if deadline.rounds:
+                    deadline.rounds -= 1
+                else:
+                    due.append(deadline)
+            for deadline in due:
+                self._unlink(deadline.key)
+                self._checkpoint(deadline.key, None)
+                self._expire(deadline)
+        if self._tick < current:
+            self._tick = current
+        self._arm()
+
+    def _expire(self, deadline: Deadline) -> None:
+        self.expired += 1
+        if deadline.kind == "cutoff":
+            self.cutoffs += 1
+            logger.warning(
+                f"Safety cut-off: {', '.join(deadline.entity_ids)} reached the maximum run time"
+            )
+        try:
+            if deadline.callback is not None:
+                result = deadline.callback()
+                if asyncio.iscoroutine(result):
+                    self._spawn(result)
+            elif self._ha_service is not None:
+                # A cut-off closes the zone whoever still holds it
+                self._spawn(switch_zones(
+                    self._ha_service, list(deadline.entity_ids), 'turn_off',
+                    owner=deadline.owner, force=deadline.kind == "cutoff"
+                ))
+            else:
+                logger.error(f"No Home Assistant service bound, cannot stop {deadline.key}")
+        except Exception as e:
+            logger.error(f"Deadline {deadline.key} handler failed: {str(e)}")
+        for listener in self._listeners:
+            try:
+                listener(deadline)
+            except Exception as e:
+                logger.error(f"Deadline expiry listener failed: {str(e)}")
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _checkpoint(self, key: str, deadline: Optional[Deadline]) -> None:
+        """Queue a row change; changes are written together shortly after"""
+        self._writes[key] = deadline
+        if self._flush_handle is None and self._loop is not None:
+            self._flush_handle = self._loop.call_later(CHECKPOINT_INTERVAL, self._flush)
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        writes, self._writes = self._writes, {}
+        if writes:
+            self._spawn(run_db(self._write, writes))
+
+    def _write(self, writes: Dict[str, Optional[Deadline]]) -> None:
+        try:
+            with self._session_factory() as db:
+                removed = [key for key, deadline in writes.items() if deadline is None]
+                if removed:
+                    db.execute(delete(ZoneDeadline).where(ZoneDeadline.key.in_(removed)))
+                for deadline in writes.values():
+                    if deadline is not None:
+                        db.merge(ZoneDeadline(
+                            key=deadline.key,
+                            kind=deadline.kind,
+                            entity_ids=",".join(deadline.entity_ids),
+                            owner=deadline.owner,
+                            due_at=deadline.due_at
+                        ))
+                db.commit()
+        except Exception as e:
+            logger.error(f"Failed to checkpoint zone deadlines: {str(e)}")
+
+    def start(self, ha_service) -> None:
+        """Bind the service used to stop zones and re-arm checkpointed deadlines"""
+        self._ha_service = ha_service
+        self._loop = asyncio.get_running_loop()
+        with self._session_factory() as db:
+            rows = db.execute(select(ZoneDeadline)).scalars().all()
+        now = time.time()
+        for row in rows:
+            if row.key in self._deadlines:
+                continue
+            deadline = Deadline(
+                row.key, row.kind, tuple(filter(None, row.entity_ids.split(","))),
+                row.owner, row.due_at
+            )
+            self._link(deadline, row.due_at - now)
+        if rows:
+            logger.info(f"Re-armed {len(rows)} zone deadline(s) from the last run")
+
+    async def stop(self) -> None:
+        """Write pending checkpoints and stop ticking; deadlines stay in SQLite"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        writes, self._writes = self._writes, {}
+        if writes:
+            await run_db(self._write, writes)
+
+    def snapshot(self) -> dict:
+        return {
+            "armed": len(self._deadlines),
+            "cutoffs_armed": sum(1 for d in self._deadlines.values() if d.kind == "cutoff"),
+            "expired": self.expired,
+            "cutoffs_fired": self.cutoffs
+        }
+
+# App-wide wheel owning every running zone's stop deadline and cut-off
+zone_deadlines = DeadlineWheel()
@@ -0,0 +1,167 @@
+import asyncio
+import bisect
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from .scheduler_service import dispatch_latency, run_slot_job
+from .timeline import MINUTES_PER_WEEK, ScheduleTimeline, format_minute, schedule_timeline
+
+logger = logging.getLogger(__name__)
+
+# Same grace as the cron jobs' misfire_grace_time
+MISFIRE_GRACE_MINUTES = 5
+# Re-check the wall clock at least this often (clock changes, DST)
+MAX_SLEEP_SECONDS = 3600
+
+class SlotDispatcher:
+    """
+    Fires every slot start and stop from one timer.
+
+    The compiled weekly timeline is flattened into a table of week minutes
+    that have events. A single loop timer is armed for the earliest upcoming
+    one; when it fires, every event between the previous wakeup and now is
+    dispatched and the timer is re-armed. Stops are the slot's start plus
+    its duration, so runs crossing midnight stop on the right day. The table
+    is rebuilt whenever the timeline changes.
+    """
+
+    def __init__(self, timeline: ScheduleTimeline):
+        self._timeline = timeline
+        self._minutes: List[int] = []  # sorted week minutes with events
+        self._events: Dict[int, List[Tuple[int, int, str]]] = {}  # (schedule_id, slot_id, action)
+        self._cursor: float = 0.0  # week minute up to which events were dispatched
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._rebuild_pending = False
+        self._tasks: Set[asyncio.Task] = set()
+        self.wakeups = 0
+        self.dispatched = 0
+        self.misfires = 0
+        self.clock_changes = 0
+        timeline.add_change_listener(self._on_timeline_changed)
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    def start(self) -> None:
+        """Build the event table and arm the timer on the running loop"""
+        self._loop = asyncio.get_running_loop()
+        self._cursor = self._now_minute()
+        self._rebuild()
+        logger.info(f"Slot dispatcher started with {len(self._minutes)} event minutes")
+
+    def stop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._loop = None
+
+    def _on_timeline_changed(self) -> None:
+        # Schedules change in bursts (rebuilds, group edits); rebuild once per burst
+        if self._loop is not None and not self._rebuild_pending:
+            self._rebuild_pending = True
+            self._loop.call_soon(self._rebuild)
+
+    def _rebuild(self) -> None:
+        self._rebuild_pending = False
+        events: Dict[int, List[Tuple[int, int, str]]] = defaultdict(list)
+        for occurrence in self._timeline.occurrences():
+            key = (occurrence.schedule_id, occurrence.slot_id)
+            events[occurrence.start % MINUTES_PER_WEEK].append(key + ('start',))
+            events[occurrence.end % MINUTES_PER_WEEK].append(key + ('stop',))
+        # Stops first so back-to-back slots hand their zones over cleanly
+        for minute_events in events.values():
+            minute_events.sort(key=lambda event: event[2] != 'stop')
+        self._events = dict(events)
+        self._minutes = sorted(events)
+        if self._loop is not None:
+            self._arm()
+
+    def _now_minute(self) -> float:
+        """Current fractional minute of the week in the scheduler's timezone"""
+        now = datetime.now(self._timeline.timezone)
+        return (
+            now.weekday() * 1440 + now.hour * 60 + now.minute
+            + (now.second + now.microsecond / 1e6) / 60
+        )
+
+    def _next_minute(self, after: float) -> Optional[int]:
+        """First event minute strictly after `after`, wrapping around the week"""
+        if not self._minutes:
+            return None
+        index = bisect.bisect_right(self._minutes, after)
+        return self._minutes[index % len(self._minutes)]
+
+    def _arm(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        minute = self._next_minute(self._cursor)
+        if minute is None:
+            return
+        delay = ((minute - self._now_minute()) % MINUTES_PER_WEEK) * 60
+        self._handle = self._loop.call_later(min(delay, MAX_SLEEP_SECONDS), self._wake)
+
+    def _wake(self) -> None:
+        self._handle = None
+        self.wakeups += 1
+        now = self._now_minute()
+        # Signed distance the shortest way round the week, so a wakeup early
+        # on Monday is just ahead of a cursor late on Sunday
+        half_week = MINUTES_PER_WEEK / 2
+        elapsed = (now - self._cursor + half_week) % MINUTES_PER_WEEK - half_week
+        if elapsed < 0:
+            # The clock was set back (or DST ended): the minutes up to the
+            # cursor are not a week of missed events; carry on from now
+            self.clock_changes += 1
+            logger.warning(
+                f"Clock went back {round(-elapsed, 1)} minutes to {format_minute(int(now))}, "
+                "not dispatching the minutes in between"
+            )
+            self._cursor = now
+            self._arm()
+            return
+        if self._minutes:
+            index = bisect.bisect_right(self._minutes, self._cursor)
+            for step in range(len(self._minutes)):
+                minute = self._minutes[(index + step) % len(self._minutes)]
+                if (minute - self._cursor) % MINUTES_PER_WEEK > elapsed:
+                    break
+                self._dispatch(minute, (now - minute) % MINUTES_PER_WEEK)
+        self._cursor = now
+        self._arm()
+
+    def _dispatch(self, minute: int, late_minutes: float) -> None:
+        events = self._events.get(minute, [])
+        if late_minutes > MISFIRE_GRACE_MINUTES:
+            self.misfires += len(events)
+            logger.warning(
+                f"Skipped {len(events)} slot event(s) at {format_minute(minute)}, "
+                f"{round(late_minutes, 1)} minutes late"
+            )
+            return
+        for schedule_id, slot_id, action in events:
+            dispatch_latency.record("slot_dispatch", late_minutes * 60)
+            self.dispatched += 1
+            task = asyncio.ensure_future(run_slot_job(schedule_id, slot_id, action))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def snapshot(self) -> dict:
+        next_minute = self._next_minute(self._cursor) if self.running else None
+        return {
+            "enabled": self.running,
+            "event_minutes": len(self._minutes),
+            "events": sum(len(events) for events in self._events.values()),
+            "next_event": format_minute(next_minute) if next_minute is not None else None,
+            "wakeups": self.wakeups,
+            "dispatched": self.dispatched,
+            "misfires": self.misfires,
+            "clock_changes": self.clock_changes
+        }
+
+# App-wide dispatcher, started when SLOT_DISPATCHER_ENABLED is set
+slot_dispatcher = SlotDispatcher(schedule_timeline)
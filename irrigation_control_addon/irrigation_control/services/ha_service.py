@@ -1,13 +1,73 @@
-import requests
-from typing import List, Dict, Any
+import asyncio
+import httpx
+import time
+from typing import List, Dict, Any, Optional
 import logging
 from ..core.config import settings
+from ..core.metrics import LatencyRegistry
+from .ha_state_mirror import get_state_mirror
+from .rate_limit import switch_rate_limiter
 
 logger = logging.getLogger(__name__)
 
+# Per-endpoint latency of calls made to Home Assistant core
+endpoint_latency = LatencyRegistry()
+
+# Shared pooled client, created lazily and reused by every service instance
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the app-wide keep-alive HTTP client for Home Assistant core"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=settings.CORE_URL,
+            limits=httpx.Limits(
+                max_connections=settings.HA_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HA_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HA_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(
+                connect=settings.HA_CONNECT_TIMEOUT,
+                read=settings.HA_READ_TIMEOUT,
+                write=settings.HA_READ_TIMEOUT,
+                pool=settings.HA_CONNECT_TIMEOUT
+            )
+        )
+    return _http_client
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client and its pooled connections"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# Caps in-flight per-entity commands across the whole app; created lazily on
+# the running loop, like the HTTP client
+_command_semaphore: Optional[asyncio.Semaphore] = None
+_command_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_command_semaphore() -> asyncio.Semaphore:
+    """Return the app-wide semaphore bounding per-entity switch calls"""
+    global _command_semaphore, _command_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _command_semaphore is None or _command_semaphore_loop is not loop:
+        _command_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_ZONES)
+        _command_semaphore_loop = loop
+    return _command_semaphore
+
 class HomeAssistantAPIError(Exception):
     """Custom exception for Home Assistant API errors"""
-    pass
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code  # None if no response was received
+
+    @property
+    def retryable(self) -> bool:
+        """True for errors that go away by themselves, as while HA core restarts"""
+        return self.status_code is None or self.status_code in (408, 429) or self.status_code >= 500
 
 class HomeAssistantService:
     def __init__(self, supervisor_token: str):
@@ -17,11 +77,12 @@ class HomeAssistantService:
             "Content-Type": "application/json"
         }
     
-    def _make_request(
+    async def _make_request(
         self,
         method: str,
         endpoint: str,
-        json_data: Dict[str, Any] = None
+        json_data: Dict[str, Any] = None,
+        metric: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Make a request to the Home Assistant API
@@ -30,6 +91,7 @@ class HomeAssistantService:
             method: HTTP method (GET, POST, etc.)
             endpoint: API endpoint (e.g., '/api/states')
             json_data: Optional JSON data for POST requests
+            metric: Name to record latency under (defaults to method and endpoint)
             
         Returns:
             Dict containing the API response
@@ -37,24 +99,27 @@ class HomeAssistantService:
         Raises:
             HomeAssistantAPIError: If the API request fails
         """
-        url = f"{settings.CORE_URL}{endpoint}"
+        metric = metric or f"{method} {endpoint}"
+        start = time.perf_counter()
         
         try:
-            response = requests.request(
+            response = await get_http_client().request(
                 method=method,
-                url=url,
+                url=endpoint,
                 headers=self.headers,
-                json=json_data,
-                timeout=10
+                json=json_data
             )
             response.raise_for_status()
+            endpoint_latency.record(metric, time.perf_counter() - start)
             return response.json() if response.content else {}
             
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
+            endpoint_latency.record(metric, time.perf_counter() - start, error=True)
             logger.error(f"Home Assistant API error: {str(e)}")
-            raise HomeAssistantAPIError(f"Failed to {method} {endpoint}: {str(e)}")
+            status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            raise HomeAssistantAPIError(f"Failed to {method} {endpoint}: {str(e)}", status_code)
     
-    def get_switches(self) -> List[Dict[str, str]]:
+    async def get_switches(self) -> List[Dict[str, str]]:
         """
         Get all switch entities from Home Assistant
         
@@ -62,7 +127,11 @@ class HomeAssistantService:
             List of dicts containing entity_id and friendly_name for each switch
         """
         try:
-            states = self._make_request("GET", "/api/states")
+            mirror = get_state_mirror()
+            if mirror is not None and mirror.is_synced:
+                states = mirror.get_domain("switch")
+            else:
+                states = await self._make_request("GET", "/api/states")
             switches = []
             
             for state in states:
@@ -81,7 +150,7 @@ class HomeAssistantService:
             logger.error(f"Failed to get switches: {str(e)}")
             raise
     
-    def control_switch(self, entity_id: str, action: str) -> bool:
+    async def control_switch(self, entity_id: str, action: str) -> bool:
         """
         Control a switch entity in Home Assistant
         
@@ -100,7 +169,8 @@ class HomeAssistantService:
             raise ValueError("Action must be either 'turn_on' or 'turn_off'")
         
         try:
-            self._make_request(
+            await switch_rate_limiter.acquire(entity_id)
+            await self._make_request(
                 method="POST",
                 endpoint=f"/api/services/switch/{action}",
                 json_data={"entity_id": entity_id}
@@ -111,7 +181,137 @@ class HomeAssistantService:
             logger.error(f"Failed to {action} switch {entity_id}: {str(e)}")
             return False
     
-    def get_switch_state(self, entity_id: str) -> bool:
+    async def control_switches(self, entity_ids: List[str], action: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Control several switch entities with as few calls as possible
+        
+        Home Assistant's switch services accept a list of entity_ids, so the
+        entities are switched in one batched request. Entities matching
+        settings.HA_UNBATCHED_PREFIXES or a rate limit, and every entity of
+        a batch that fails, are sent one call per entity with bounded
+        concurrency.
+        
+        Args:
+            entity_ids: The entity_ids of the switches to control
+            action: Either 'turn_on' or 'turn_off'
+            
+        Returns:
+            Dict mapping each entity_id to {"success": bool, "latency_ms": float},
+            plus "retryable" for failed calls worth retrying
+            
+        Raises:
+            ValueError: If action is invalid
+        """
+        if action not in ["turn_on", "turn_off"]:
+            raise ValueError("Action must be either 'turn_on' or 'turn_off'")
+        
+        unbatched = [
+            entity_id for entity_id in entity_ids
+            if entity_id.startswith(tuple(settings.HA_UNBATCHED_PREFIXES))
+            or switch_rate_limiter.is_limited(entity_id)
+        ]
+        batched = [entity_id for entity_id in entity_ids if entity_id not in unbatched]
+        results: Dict[str, Dict[str, Any]] = {}
+        
+        if batched:
+            start = time.perf_counter()
+            try:
+                await self._make_request(
+                    method="POST",
+                    endpoint=f"/api/services/switch/{action}",
+                    json_data={"entity_id": batched},
+                    metric=f"POST /api/services/switch/{action} (batch)"
+                )
+                latency_ms = round((time.perf_counter() - start) * 1000, 3)
+                for entity_id in batched:
+                    results[entity_id] = {"success": True, "latency_ms": latency_ms}
+                
+            except HomeAssistantAPIError as e:
+                logger.warning(
+                    f"Batched {action} of {len(batched)} switches failed, "
+                    f"falling back to per-entity calls: {str(e)}"
+                )
+                unbatched.extend(batched)
+        
+        if unbatched:
+            results.update(await self.fan_out_switches(unbatched, action))
+        return results
+    
+    async def fan_out_switches(self, entity_ids: List[str], action: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Control switch entities with one call each, issued concurrently
+        
+        The number of calls in flight is capped app-wide by
+        settings.MAX_CONCURRENT_ZONES. Rate-limited entities first wait for
+        a token, in the order they were given, without holding a slot.
+        
+        Args:
+            entity_ids: The entity_ids of the switches to control
+            action: Either 'turn_on' or 'turn_off'
+            
+        Returns:
+            Dict mapping each entity_id to {"success": bool, "latency_ms": float},
+            plus "retryable" for failed calls worth retrying
+        """
+        async def control(entity_id: str) -> Dict[str, Any]:
+            await switch_rate_limiter.acquire(entity_id)
+            async with get_command_semaphore():
+                start = time.perf_counter()
+                result: Dict[str, Any] = {"success": True}
+                try:
+                    await self._make_request(
+                        method="POST",
+                        endpoint=f"/api/services/switch/{action}",
+                        json_data={"entity_id": entity_id}
+                    )
+                except HomeAssistantAPIError as e:
+                    logger.error(f"Failed to {action} switch {entity_id}: {str(e)}")
+                    result = {"success": False, "retryable": e.retryable}
+                result["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                return result
+        
+        outcomes = await asyncio.gather(*(control(entity_id) for entity_id in entity_ids))
+        return dict(zip(entity_ids, outcomes))
+    
+    async def get_entity(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the full state object of an entity
+        
+        Served from the WebSocket state mirror when it is in sync, otherwise
+        fetched from the REST API.
+        
+        Args:
+            entity_id: The entity_id to look up
+            
+        Returns:
+            The state object, or None if the mirror does not know the entity
+            
+        Raises:
+            HomeAssistantAPIError: If the API request fails
+        """
+        mirror = get_state_mirror()
+        if mirror is not None and mirror.is_synced:
+            return mirror.get(entity_id)
+        return await self._make_request(
+            "GET",
+            f"/api/states/{entity_id}",
+            metric="GET /api/states/{entity_id}"
+        )
+    
+    async def get_entity_state(self, entity_id: str) -> Optional[str]:
+        """
+        Get the state value of any entity (used by schedule conditions)
+        
+        Args:
+            entity_id: The entity_id to look up
+            
+        Returns:
+            The state string, or None if the entity is unknown
+        """
+        state = await self.get_entity(entity_id)
+        return state.get("state") if state else None
+    
+    async def get_switch_state(self, entity_id: str) -> bool:
         """
         Get the current state of a switch
         
@@ -122,8 +322,8 @@ class HomeAssistantService:
             bool: True if the switch is on, False if off
         """
         try:
-            state = self._make_request("GET", f"/api/states/{entity_id}")
-            return state.get("state") == "on"
+            state = await self.get_entity(entity_id)
+            return bool(state) and state.get("state") == "on"
             
         except HomeAssistantAPIError as e:
             logger.error(f"Failed to get state for {entity_id}: {str(e)}")
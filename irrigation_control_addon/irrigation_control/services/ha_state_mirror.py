@@ -0,0 +1,189 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+import websockets
+
+from ..core.config import settings
+
+if TYPE_CHECKING:
+    from .ha_service import HomeAssistantService
+
+logger = logging.getLogger(__name__)
+
+class HAStateMirror:
+    """
+    In-memory mirror of Home Assistant entity states.
+
+    Authenticates to the WebSocket API once, subscribes to `state_changed`
+    and keeps an entity_id -> state index up to date. Whenever the socket is
+    (re)connected the index is rebuilt from a single REST `/api/states` call,
+    so lookups never need a round trip to Home Assistant. The entity
+    registry is read once per connection to know each entity's integration.
+    """
+
+    def __init__(self, ha_service: "HomeAssistantService", ws_url: Optional[str] = None):
+        self.ha_service = ha_service
+        self.ws_url = ws_url or settings.CORE_WS_URL
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._by_domain: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        self._platforms: Dict[str, str] = {}  # entity_id -> integration
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._synced = False
+        self._task: Optional[asyncio.Task] = None
+        self._message_id = 0
+
+    @property
+    def is_synced(self) -> bool:
+        """True while the socket is up and the index reflects Home Assistant"""
+        return self._synced
+
+    def get(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        """Get the mirrored state object for an entity"""
+        return self._states.get(entity_id)
+
+    def get_domain(self, domain: str) -> List[Dict[str, Any]]:
+        """Get all mirrored state objects for a domain (e.g. 'switch')"""
+        return list(self._by_domain.get(domain, {}).values())
+
+    def get_integration(self, entity_id: str) -> Optional[str]:
+        """Get the integration providing an entity (e.g. 'zwave_js')"""
+        return self._platforms.get(entity_id)
+
+    def add_state_listener(self, listener: Callable[[str, Dict[str, Any]], None]) -> None:
+        """Call `listener(entity_id, new_state)` for every state_changed event"""
+        self._listeners.append(listener)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._synced = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _set_state(self, state: Dict[str, Any]) -> None:
+        entity_id = state["entity_id"]
+        current = self._states.get(entity_id)
+        # Events buffered while resyncing may be older than the REST snapshot
+        if current and state.get("last_updated", "") < current.get("last_updated", ""):
+            return
+        self._states[entity_id] = state
+        self._by_domain[entity_id.split(".", 1)[0]][entity_id] = state
+
+    def _remove_state(self, entity_id: str) -> None:
+        self._states.pop(entity_id, None)
+        self._by_domain[entity_id.split(".", 1)[0]].pop(entity_id, None)
+
+    def _apply_event(self, event: Dict[str, Any]) -> None:
+        data = event.get("data", {})
+        entity_id = data.get("entity_id")
+        if not entity_id:
+            return
+        new_state = data.get("new_state")
+        if new_state is None:
+            self._remove_state(entity_id)
+            return
+        self._set_state(new_state)
+        for listener in self._listeners:
+            try:
+                listener(entity_id, new_state)
+            except Exception as e:
+                logger.error(f"State listener failed: {str(e)}")
+
+    async def _resync(self) -> None:
+        """Rebuild the whole index from the REST API"""
+        states = await self.ha_service._make_request("GET", "/api/states")
+        self._states = {}
+        self._by_domain = defaultdict(dict)
+        for state in states:
+            if state.get("entity_id"):
+                self._set_state(state)
+        logger.info(f"State mirror resynced {len(self._states)} entities")
+
+    async def _send(self, ws, payload: Dict[str, Any]) -> int:
+        self._message_id += 1
+        payload["id"] = self._message_id
+        await ws.send(json.dumps(payload))
+        return self._message_id
+
+    async def _authenticate(self, ws) -> None:
+        message = json.loads(await ws.recv())
+        if message.get("type") != "auth_required":
+            raise ConnectionError(f"Unexpected handshake message: {message.get('type')}")
+        await ws.send(json.dumps({
+            "type": "auth",
+            "access_token": self.ha_service.supervisor_token
+        }))
+        message = json.loads(await ws.recv())
+        if message.get("type") != "auth_ok":
+            raise ConnectionError(f"WebSocket authentication failed: {message.get('message')}")
+
+    async def _session(self) -> None:
+        async with websockets.connect(self.ws_url, max_size=None) as ws:
+            await self._authenticate(ws)
+            subscription_id = await self._send(ws, {
+                "type": "subscribe_events",
+                "event_type": "state_changed"
+            })
+            registry_id = await self._send(ws, {"type": "config/entity_registry/list"})
+            # Subscribe before resyncing so no change falls into the gap
+            await self._resync()
+            self._synced = True
+
+            async for raw in ws:
+                message = json.loads(raw)
+                if message.get("type") == "event" and message.get("id") == subscription_id:
+                    self._apply_event(message["event"])
+                elif message.get("id") == registry_id:
+                    if message.get("success"):
+                        self._platforms = {
+                            entry["entity_id"]: entry["platform"] for entry in message["result"]
+                        }
+                    else:
+                        logger.warning(f"Entity registry unavailable: {message.get('error')}")
+                elif message.get("type") == "result" and not message.get("success", True):
+                    raise ConnectionError(f"Subscription failed: {message.get('error')}")
+
+    async def _run(self) -> None:
+        delay = settings.HA_WS_RECONNECT_MIN
+        while True:
+            try:
+                self._message_id = 0
+                await self._session()
+                delay = settings.HA_WS_RECONNECT_MIN
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"State mirror connection lost: {str(e)}")
+            self._synced = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, settings.HA_WS_RECONNECT_MAX)
+
+# App-wide mirror, started with the application
+_state_mirror: Optional[HAStateMirror] = None
+
+def get_state_mirror() -> Optional[HAStateMirror]:
+    """Return the running state mirror, if any"""
+    return _state_mirror
+
+def start_state_mirror(ha_service: "HomeAssistantService") -> HAStateMirror:
+    global _state_mirror
+    if _state_mirror is None:
+        _state_mirror = HAStateMirror(ha_service)
+    _state_mirror.start()
+    return _state_mirror
+
+async def stop_state_mirror() -> None:
+    global _state_mirror
+    if _state_mirror is not None:
+        await _state_mirror.stop()
+        _state_mirror = None
@@ -0,0 +1,88 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, select
+
+from ..core.database import SessionLocal
+from ..models.database_models import ScheduleJob
+
+logger = logging.getLogger(__name__)
+
+class ScheduleJobIndex:
+    """
+    Schedule id -> APScheduler job ids.
+
+    Kept in memory and persisted in the schedule_jobs table so that removing
+    or replacing a schedule's jobs touches only those jobs instead of
+    scanning the whole jobstore. Ids are written before their jobs are added
+    and dropped after their jobs are removed, so the index may name a job
+    that no longer exists (removal ignores it) but never misses one.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._jobs: Optional[Dict[int, Set[str]]] = None
+
+    def _load(self) -> Dict[int, Set[str]]:
+        if self._jobs is None:
+            jobs: Dict[int, Set[str]] = {}
+            with self._session_factory() as db:
+                for schedule_id, job_id in db.execute(
+                    select(ScheduleJob.schedule_id, ScheduleJob.job_id)
+                ):
+                    jobs.setdefault(schedule_id, set()).add(job_id)
+            self._jobs = jobs
+        return self._jobs
+
+    def get(self, schedule_id: int) -> Set[str]:
+        """Job ids recorded for a schedule"""
+        return set(self._load().get(schedule_id, ()))
+
+    def add(self, schedule_id: int, job_ids: Iterable[str]) -> None:
+        """Record job ids for a schedule before the jobs are added"""
+        jobs = self._load()
+        new_ids = set(job_ids) - jobs.get(schedule_id, set())
+        if not new_ids:
+            return
+        with self._session_factory() as db:
+            db.add_all(ScheduleJob(job_id=job_id, schedule_id=schedule_id) for job_id in new_ids)
+            db.commit()
+        jobs.setdefault(schedule_id, set()).update(new_ids)
+
+    def discard(self, schedule_id: int, job_ids: Optional[Iterable[str]] = None) -> None:
+        """Forget job ids (all of the schedule's if None) after the jobs are removed"""
+        jobs = self._load()
+        known = jobs.get(schedule_id)
+        if not known:
+            return
+        ids = set(known) if job_ids is None else known & set(job_ids)
+        if not ids:
+            return
+        with self._session_factory() as db:
+            db.execute(delete(ScheduleJob).where(ScheduleJob.job_id.in_(ids)))
+            db.commit()
+        known -= ids
+        if not known:
+            del jobs[schedule_id]
+
+    def rebuild(self, jobs_by_schedule: Dict[int, List[str]]) -> None:
+        """Replace the whole index, e.g. from a one-off scan of the jobstore"""
+        with self._session_factory() as db:
+            db.execute(delete(ScheduleJob))
+            db.add_all(
+                ScheduleJob(job_id=job_id, schedule_id=schedule_id)
+                for schedule_id, job_ids in jobs_by_schedule.items()
+                for job_id in job_ids
+            )
+            db.commit()
+        self._jobs = {
+            schedule_id: set(job_ids)
+            for schedule_id, job_ids in jobs_by_schedule.items() if job_ids
+        }
+        logger.info(f"Rebuilt job index for {len(self._jobs)} schedules")
+
+    def is_empty(self) -> bool:
+        return not self._load()
+
+# App-wide index shared by every SchedulerService
+schedule_job_index = ScheduleJobIndex()
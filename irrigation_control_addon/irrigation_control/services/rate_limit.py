@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from ..core.config import settings
+from ..core.metrics import LatencyRegistry
+from .ha_state_mirror import get_state_mirror
+
+logger = logging.getLogger(__name__)
+
+INTEGRATION_PREFIX = "integration:"
+
+class TokenBucket:
+    """
+    Token bucket with a FIFO queue of waiting commands.
+
+    Holds up to `burst` tokens and refills `rate` tokens per second. A
+    command takes one token; when none is left it joins the queue and is
+    woken by a single timer in arrival order as tokens come back, so a
+    large group command drains at `rate` without overtaking earlier ones.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int):
+        if rate <= 0:
+            raise ValueError(f"Rate limit {name!r} needs a rate above 0, got {rate}")
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self._updated: Optional[float] = None
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self.acquired = 0
+        self.delayed = 0
+        self.max_waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def _refill(self, now: float) -> None:
+        if self._updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """Wait for a token; returns the seconds spent waiting"""
+        loop = asyncio.get_running_loop()
+        self._refill(loop.time())
+        self.acquired += 1
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+
+        started = loop.time()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        self.delayed += 1
+        self.max_waiting = max(self.max_waiting, len(self._waiters))
+        self._arm(loop)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Woken and cancelled at once: hand the token back
+                self.tokens = min(self.burst, self.tokens + 1)
+            raise
+        return loop.time() - started
+
+    def _arm(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._handle is None and self._waiters:
+            delay = max(0.0, (1 - self.tokens) / self.rate)
+            self._handle = loop.call_later(delay, self._release, loop)
+
+    def _release(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._handle = None
+        self._refill(loop.time())
+        while self._waiters and self.tokens >= 1:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue  # cancelled while waiting
+            self.tokens -= 1
+            waiter.set_result(None)
+        while self._waiters and self._waiters[0].done():
+            self._waiters.popleft()
+        self._arm(loop)
+
+    def snapshot(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(self.tokens, 2),
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "acquired": self.acquired,
+            "delayed": self.delayed
+        }
+
+class SwitchRateLimiter:
+    """
+    Per-integration limits on outgoing switch commands.
+
+    Each limit matches entities by entity_id prefix ("switch.zwave_") or by
+    the integration that provides them ("integration:zwave_js", looked up
+    in the state mirror's copy of the entity registry). The first matching
+    limit applies; entities matching none are not limited.
+    """
+
+    def __init__(self, limits: List[Dict[str, Any]]):
+        self._limits: List[tuple] = []
+        for limit in limits:
+            match = limit["match"]
+            bucket = TokenBucket(match, float(limit["rate"]), int(limit.get("burst", 1)))
+            self._limits.append((match, bucket))
+        self.wait_latency = LatencyRegistry()
+
+    def bucket_for(self, entity_id: str) -> Optional[TokenBucket]:
+        integration = None
+        for match, bucket in self._limits:
+            if match.startswith(INTEGRATION_PREFIX):
+                if integration is None:
+                    mirror = get_state_mirror()
+                    integration = (mirror.get_integration(entity_id) if mirror else None) or ""
+                if integration == match[len(INTEGRATION_PREFIX):]:
+                    return bucket
+            elif entity_id.startswith(match):
+                return bucket
+        return None
+
+    def is_limited(self, entity_id: str) -> bool:
+        return self.bucket_for(entity_id) is not None
+
+    async def acquire(self, entity_id: str) -> None:
+        """Wait until a command may be sent to `entity_id`"""
+        bucket = self.bucket_for(entity_id)
+        if bucket is not None:
+            waited = await bucket.acquire()
+            self.wait_latency.record(bucket.name, waited)
+
+    def snapshot(self) -> dict:
+        wait = self.wait_latency.snapshot()
+        return {
+            match: dict(bucket.snapshot(), wait=wait.get(match))
+            for match, bucket in self._limits
+        }
+
+# App-wide limits from the rate_limits option, applied before every switch call
+switch_rate_limiter = SwitchRateLimiter(settings.HA_RATE_LIMITS)
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from ..core.metrics import LatencyRegistry
+from .admission import admission_controller, cutoff_key
+from .commands import switch_zone, switch_zones
+from .deadlines import zone_deadlines
+from .run_registry import ZoneRun, run_registry
+from .sequential_engine import sequential_engine
+
+logger = logging.getLogger(__name__)
+
+# Appended records are written and fsynced together at most this often
+FLUSH_INTERVAL = 0.2  # seconds
+# Rewrite the journal as a snapshot of the open zones past this many records
+COMPACT_AFTER = 1000
+
+class RunJournal:
+    """
+    Append-only journal of zones turned on and off.
+
+    Each run registry change is appended as one JSON line. Appending only
+    formats the record into an in-memory buffer; a single writer thread
+    writes the buffer and fsyncs it every FLUSH_INTERVAL, and rewrites the
+    file as a snapshot of the open zones once it grows past COMPACT_AFTER
+    records. After a crash or restart, replaying the journal tells which
+    zones were left open, on whose behalf and until when.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._buffer: List[str] = []
+        self._open: Dict[Tuple[str, str], dict] = {}  # (entity_id, owner) -> "on" record
+        self._records = 0  # records in the file
+        self._file = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="run-journal")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.latency = LatencyRegistry()
+        self.flushes = 0
+        self.compactions = 0
+
+    def append(self, record: dict) -> None:
+        """Fast path: buffer a record for the next batched write"""
+        started = time.perf_counter()
+        line = json.dumps(record, separators=(",", ":"))
+        key = (record["entity_id"], record.get("owner"))
+        with self._lock:
+            self._buffer.append(line)
+            if record["op"] == "on":
+                self._open[key] = record
+            elif key[1] is None:
+                for open_key in [k for k in self._open if k[0] == key[0]]:
+                    del self._open[open_key]
+            else:
+                self._open.pop(key, None)
+        if self._flush_handle is None and self._loop is not None:
+            self._flush_handle = self._loop.call_later(FLUSH_INTERVAL, self._flush)
+        self.latency.record("append", time.perf_counter() - started)
+
+    def on_registry_change(self, event: str, run: ZoneRun) -> None:
+        if event == "started":
+            self.append({
+                "op": "on",
+                "t": time.time(),
+                "entity_id": run.entity_id,
+                "owner": run.owner,
+                "source": run.source,
+                "schedule_id": run.schedule_id,
+                "started_at": run.started_at,
+                "deadline": run.deadline,
+                "next_zones": run.next_zones
+            })
+        else:
+            self.append({"op": "off", "t": time.time(), "entity_id": run.entity_id, "owner": run.owner})
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        task = asyncio.ensure_future(self._loop.run_in_executor(self._writer, self._write))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _write(self) -> None:
+        """Writer thread: append the buffer, fsync, compact when large"""
+        if self._file is None:
+            return
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        try:
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._records += len(lines)
+            self.flushes += 1
+            if self._records > COMPACT_AFTER:
+                self._compact()
+        except OSError as e:
+            logger.error(f"Failed to write run journal: {str(e)}")
+
+    def _compact(self) -> None:
+        """Writer thread: replace the journal with the records of open zones"""
+        with self._lock:
+            lines = [json.dumps(record, separators=(",", ":")) for record in self._open.values()]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as tmp:
+            if lines:
+                tmp.write("\n".join(lines) + "\n")
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a")
+        self._records = len(lines)
+        self.compactions += 1
+
+    def _replay(self) -> Dict[Tuple[str, str], dict]:
+        """Open zones according to the journal on disk"""
+        open_runs: Dict[Tuple[str, str], dict] = {}
+        if not os.path.exists(self.path):
+            return open_runs
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn write at the moment of the crash
+                key = (record["entity_id"], record.get("owner"))
+                if record["op"] == "on":
+                    open_runs[key] = record
+                elif key[1] is None:
+                    for open_key in [k for k in open_runs if k[0] == key[0]]:
+                        del open_runs[open_key]
+                else:
+                    open_runs.pop(key, None)
+        return open_runs
+
+    async def recover(self, ha_service) -> dict:
+        """
+        Replay the journal and deal with zones left open by the last run
+
+        With RUN_JOURNAL_RECOVERY set to 'resume', zones with time left are
+        turned back on (usually a no-op), re-admitted and given a stop
+        deadline for the remainder, and a sequential run carries on with the
+        zones it had yet to water once its zone closes; every other orphaned
+        zone is turned off. Stops checkpointed for the owners of these zones
+        are taken over, so each zone is stopped once, releasing its hold.
+        The journal is first compacted to the replayed state, so a crash
+        during recovery loses nothing.
+
+        Returns:
+            Dict with the zones resumed and closed
+        """
+        self._loop = asyncio.get_running_loop()
+        open_runs = await self._loop.run_in_executor(self._writer, self._replay)
+        with self._lock:
+            self._open = dict(open_runs)
+        await self._loop.run_in_executor(self._writer, self._compact)
+
+        for owner in {owner for _, owner in open_runs}:
+            zone_deadlines.cancel_owned(owner)
+
+        now = time.time()
+        resume = settings.RUN_JOURNAL_RECOVERY == "resume"
+        resumed: Dict[str, List[dict]] = {}
+        for (entity_id, owner), record in open_runs.items():
+            deadline = record.get("deadline")
+            if (
+                resume
+                and deadline is not None and deadline > now
+                and admission_controller.try_acquire(entity_id, owner)
+            ):
+                resumed.setdefault(entity_id, []).append(record)
+        closed = sorted({entity_id for entity_id, _ in open_runs} - resumed.keys())
+
+        if closed:
+            for entity_id in closed:
+                zone_deadlines.cancel(cutoff_key(entity_id))
+            await switch_zones(ha_service, closed, 'turn_off', force=True)
+            for entity_id in closed:
+                self.append({"op": "off", "t": time.time(), "entity_id": entity_id, "owner": None})
+            logger.warning(f"Closed zones left open by the last run: {', '.join(closed)}")
+            for (entity_id, owner), record in open_runs.items():
+                if entity_id in closed and record.get("next_zones"):
+                    if resume:
+                        _continue_sequence(ha_service, record)
+                    else:
+                        logger.warning(
+                            f"Dropped {len(record['next_zones'])} zone(s) {owner} had yet to water"
+                        )
+        if resumed:
+            results = await switch_zones(ha_service, list(resumed), 'turn_on', force=True)
+            for entity_id, records in resumed.items():
+                for record in records:
+                    owner = record["owner"]
+                    if not results.get(entity_id, {}).get("success"):
+                        admission_controller.release(entity_id, owner)
+                        self.append({"op": "off", "t": time.time(), "entity_id": entity_id, "owner": owner})
+                        _continue_sequence(ha_service, record)
+                        continue
+                    run_registry.started(
+                        entity_id, owner, record.get("source", "manual"),
+                        record.get("schedule_id"), record["deadline"], record.get("started_at"),
+                        record.get("next_zones")
+                    )
+                    zone_deadlines.schedule(
+                        f"stop:recovered_{owner}_{entity_id}",
+                        record["deadline"] - now,
+                        [entity_id],
+                        owner=owner,
+                        callback=partial(_close_recovered, ha_service, record)
+                    )
+            logger.warning(f"Resumed zones left open by the last run: {', '.join(resumed)}")
+        return {"resumed": sorted(resumed), "closed": closed}
+
+    async def stop(self) -> None:
+        """Write everything still buffered and close the journal"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._loop is not None:
+            await self._loop.run_in_executor(self._writer, self._write)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            pending = len(self._buffer)
+            open_zones = len(self._open)
+        return {
+            "records": self._records,
+            "pending": pending,
+            "open_zones": open_zones,
+            "flushes": self.flushes,
+            "compactions": self.compactions,
+            "append": self.latency.snapshot().get("append")
+        }
+
+def _continue_sequence(ha_service, record: dict) -> None:
+    """Start the zones a sequential run had yet to water after a zone"""
+    next_zones = record.get("next_zones")
+    if next_zones:
+        sequential_engine.start_run(
+            ha_service, record.get("schedule_id"),
+            [(entity_id, minutes) for entity_id, minutes in next_zones]
+        )
+
+async def _close_recovered(ha_service, record: dict) -> None:
+    """Stop a resumed zone unless another owner took it over since"""
+    entity_id, owner = record["entity_id"], record["owner"]
+    admission_controller.release(entity_id, owner)
+    await switch_zone(ha_service, entity_id, 'turn_off', owner=owner)
+    _continue_sequence(ha_service, record)
+
+# App-wide journal of every run registry change
+run_journal = RunJournal(settings.RUN_JOURNAL_PATH)
+run_registry.add_listener(run_journal.on_registry_change)
@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ZoneRun:
+    """One open zone on behalf of one owner"""
+
+    __slots__ = (
+        "entity_id", "owner", "schedule_id", "source", "started_at", "deadline", "next_zones", "fault"
+    )
+
+    def __init__(
+        self,
+        entity_id: str,
+        owner: str,
+        source: str,
+        schedule_id: Optional[int] = None,
+        deadline: Optional[float] = None,
+        started_at: Optional[float] = None,
+        next_zones: Optional[List[Tuple[str, int]]] = None
+    ):
+        self.entity_id = entity_id
+        self.owner = owner  # admission owner, e.g. "schedule_4", "run_7", "manual"
+        self.source = source  # 'schedule', 'sequential', 'manual' or 'group'
+        self.schedule_id = schedule_id
+        self.started_at = started_at if started_at is not None else time.time()
+        self.deadline = deadline  # Unix time the zone is due to close, if known
+        self.next_zones = next_zones  # (entity_id, minutes) a sequential run opens after this one
+        self.fault: Optional[str] = None  # why the zone is not known to be on
+
+    def to_dict(self) -> dict:
+        return {
+            "entity_id": self.entity_id,
+            "owner": self.owner,
+            "source": self.source,
+            "schedule_id": self.schedule_id,
+            "started_at": self.started_at,
+            "deadline": self.deadline,
+            "fault": self.fault,
+            "remaining_seconds": (
+                round(max(0.0, self.deadline - time.time()), 1)
+                if self.deadline is not None else None
+            )
+        }
+
+class RunRegistry:
+    """
+    App-wide record of which zones are open, for whom and until when.
+
+    Every path that turns a zone on records it here; closing goes through
+    the admission controller's release, which clears the matching records.
+    Reads never touch the database or Home Assistant. A lock guards the
+    tables so worker threads can read them as well as the event loop.
+
+    Zones whose switch did not confirm a command are kept as faults until
+    a later command on them confirms, whether or not they are still open.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_zone: Dict[str, Dict[str, ZoneRun]] = {}
+        self._faults: Dict[str, dict] = {}
+        self._listeners: List[Callable[[str, ZoneRun], None]] = []
+
+    def add_listener(self, listener: Callable[[str, ZoneRun], None]) -> None:
+        """Call `listener(event, run)` with "started" or "stopped" for every change"""
+        self._listeners.append(listener)
+
+    def _notify(self, event: str, runs: List[ZoneRun]) -> None:
+        for run in runs:
+            for listener in self._listeners:
+                try:
+                    listener(event, run)
+                except Exception as e:
+                    logger.error(f"Run registry listener failed: {str(e)}")
+
+    def started(
+        self,
+        entity_id: str,
+        owner: str,
+        source: str,
+        schedule_id: Optional[int] = None,
+        deadline: Optional[float] = None,
+        started_at: Optional[float] = None,
+        next_zones: Optional[List[Tuple[str, int]]] = None
+    ) -> ZoneRun:
+        run = ZoneRun(entity_id, owner, source, schedule_id, deadline, started_at, next_zones)
+        with self._lock:
+            fault = self._faults.get(entity_id)
+            if fault is not None:
+                run.fault = fault["reason"]
+            self._by_zone.setdefault(entity_id, {})[owner] = run
+        self._notify("started", [run])
+        return run
+
+    def stopped(self, entity_id: str, owner: Optional[str] = None) -> None:
+        """Forget an owner's run on a zone (every owner's if None)"""
+        with self._lock:
+            runs = self._by_zone.get(entity_id)
+            if runs is None:
+                return
+            if owner is None:
+                stopped = list(runs.values())
+                runs.clear()
+            else:
+                run = runs.pop(owner, None)
+                stopped = [run] if run is not None else []
+            if not runs:
+                del self._by_zone[entity_id]
+        self._notify("stopped", stopped)
+
+    def get(self, entity_id: str, owner: str) -> Optional[ZoneRun]:
+        with self._lock:
+            return self._by_zone.get(entity_id, {}).get(owner)
+
+    def fault(self, entity_id: str, expected: str, reason: str) -> None:
+        """Mark a zone whose switch did not reach the `expected` state"""
+        with self._lock:
+            self._faults[entity_id] = {
+                "entity_id": entity_id,
+                "expected": expected,
+                "reason": reason,
+                "since": time.time()
+            }
+            for run in self._by_zone.get(entity_id, {}).values():
+                run.fault = reason
+
+    def clear_fault(self, entity_id: str) -> None:
+        with self._lock:
+            if self._faults.pop(entity_id, None) is not None:
+                for run in self._by_zone.get(entity_id, {}).values():
+                    run.fault = None
+
+    def faults(self) -> List[dict]:
+        with self._lock:
+            return [dict(fault) for fault in self._faults.values()]
+
+    def is_running(self, entity_id: str) -> bool:
+        with self._lock:
+            return entity_id in self._by_zone
+
+    def zone_count(self) -> int:
+        """Number of open zones"""
+        with self._lock:
+            return len(self._by_zone)
+
+    def active(self) -> List[dict]:
+        with self._lock:
+            runs = [run for runs in self._by_zone.values() for run in runs.values()]
+        return [run.to_dict() for run in sorted(runs, key=lambda r: r.started_at)]
+
+    def by_zone(self) -> Dict[str, List[str]]:
+        """Owners of every open zone"""
+        with self._lock:
+            return {entity_id: list(runs) for entity_id, runs in self._by_zone.items()}
+
+# App-wide registry of open zones
+run_registry = RunRegistry()
@@ -1,22 +1,94 @@
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import BaseScheduler
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.job import Job
+from apscheduler.util import obj_to_ref
+from apscheduler.events import JobSubmissionEvent
 from apscheduler.triggers.cron import CronTrigger
-from apscheduler.triggers.date import DateTrigger
 from datetime import datetime, timedelta
+import asyncio
 import logging
-from typing import List, Optional, Dict
+import threading
+import time
+from typing import Any, List, Optional, Dict, Set, Tuple
 from collections import defaultdict
+from functools import partial
 
 from ..models import database_models as models
 from ..services.ha_service import HomeAssistantService
+from ..services.sequential_engine import sequential_engine
+from ..services.admission import admission_controller, admit_and_turn_on
+from ..services.arbiter import ArbitratedRun, run_arbiter
+from ..services.commands import switch_zones
+from ..services.timeline import schedule_timeline
+from ..services.job_index import schedule_job_index
+from ..services.deadlines import zone_deadlines
+from ..services.run_registry import run_registry
+from ..services.slot_plans import is_sequential_schedule, schedule_entity_ids, slot_plans
 from ..core.config import settings
+from ..core.database import run_db
+from ..core.metrics import LatencyRegistry
 
 logger = logging.getLogger(__name__)
 
+# Delay between a job's scheduled run time and its dispatch onto the event loop
+dispatch_latency = LatencyRegistry()
+
+def record_dispatch_latency(event: JobSubmissionEvent) -> None:
+    """Scheduler listener recording how late each job was dispatched"""
+    now = datetime.now(tz=event.scheduled_run_times[-1].tzinfo)
+    for run_time in event.scheduled_run_times:
+        dispatch_latency.record("job_dispatch", (now - run_time).total_seconds())
+
+def _schedule_id_of(job_id: str) -> Optional[int]:
+    """Schedule id encoded in a schedule job id, None for other jobs"""
+    parts = job_id.split('_')
+    if len(parts) > 1 and parts[0] == 'schedule' and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+# Service that scheduler jobs run through; bound once at startup
+_job_runner: Optional["SchedulerService"] = None
+
+def set_job_runner(service: "SchedulerService") -> None:
+    """Bind the service used by jobs fired from the jobstore"""
+    global _job_runner
+    _job_runner = service
+
+async def run_slot_job(schedule_id: int, slot_id: int, action: str) -> None:
+    """
+    Job entry point stored in the jobstore
+
+    Jobs carry only a reference to this function and (schedule_id, slot_id,
+    action); the zones, duration and precedence are read from the slot plan
+    cache when the job fires.
+    """
+    if _job_runner is None:
+        logger.error(f"No job runner bound, dropping {action} for schedule {schedule_id}")
+        return
+    plan = slot_plans.get(schedule_id, slot_id)
+    if plan is None:
+        logger.warning(f"Slot {slot_id} of schedule {schedule_id} no longer exists, skipping {action}")
+        return
+    if action == 'start':
+        await _job_runner.execute_watering_action(
+            'turn_on', list(plan.entity_ids), schedule_id, plan.is_sequential,
+            plan.duration_minutes, priority=plan.priority, event_type=plan.event_type.value
+        )
+    elif action == 'stop':
+        if plan.is_sequential:
+            return  # The sequential engine closes its own zones
+        await _job_runner.execute_watering_action(
+            'turn_off', list(plan.entity_ids), schedule_id, False
+        )
+    else:
+        logger.error(f"Invalid slot job action: {action}")
+
 class SchedulerService:
-    def __init__(self, scheduler: BackgroundScheduler, ha_service: HomeAssistantService):
+    def __init__(self, scheduler: BaseScheduler, ha_service: HomeAssistantService):
         self.scheduler = scheduler
         self.ha_service = ha_service
-        self.running_jobs: Dict[str, List[str]] = defaultdict(list)  # solenoid_id -> [job_ids]
+        self._tasks: Set[asyncio.Task] = set()  # manual runs still starting
+        self._jobs_lock = threading.Lock()
 
     def _get_job_id(self, schedule_id: int, slot_id: int, action: str) -> str:
         """Generate a unique job ID"""
@@ -32,17 +104,7 @@ class SchedulerService:
 
     def _get_solenoid_entities(self, schedule: models.Schedule) -> List[str]:
         """Get list of entity_ids for a schedule (either single solenoid or group)"""
-        if schedule.target_type == 'solenoid' and schedule.solenoid:
-            return [schedule.solenoid.entity_id]
-        elif schedule.target_type == 'group' and schedule.group:
-            # If sequential watering is enabled for the group, maintain order
-            if schedule.group.sequential_watering:
-                return [s.entity_id for s in sorted(
-                    schedule.group.solenoids,
-                    key=lambda x: (x.sequence_order or float('inf'), x.id)
-                ) if s.is_active]
-            return [s.entity_id for s in schedule.group.solenoids if s.is_active]
-        return []
+        return schedule_entity_ids(schedule)
 
     async def _check_conditions(self, conditions: List[models.ScheduleCondition]) -> bool:
         """Check if all conditions are met for a schedule"""
@@ -86,147 +148,279 @@ class SchedulerService:
         action: str,
         entity_ids: List[str],
         schedule_id: int,
-        is_sequential: bool = False
+        is_sequential: bool = False,
+        duration_minutes: Optional[int] = None,
+        priority: int = 0,
+        event_type: str = models.EventType.MANUAL.value,
+        owner: Optional[str] = None
     ) -> None:
-        """Execute watering action on specified entities"""
+        """
+        Execute watering action on specified entities
+
+        `owner` keys the run with the arbiter and admission controller,
+        "schedule_{schedule_id}" by default.
+        """
         if action not in ['turn_on', 'turn_off']:
             logger.error(f"Invalid action: {action}")
             return
 
+        event_type = models.EventType(event_type)
+        run = ArbitratedRun(
+            schedule_id, event_type, priority, entity_ids, duration_minutes, self.ha_service,
+            sequential=is_sequential, key=owner
+        )
+
         if is_sequential and action == 'turn_on':
-            # For sequential watering, run one zone at a time
-            for entity_id in entity_ids:
-                try:
-                    await self.ha_service.control_switch(entity_id, 'turn_on')
-                    self.running_jobs[entity_id].append(str(schedule_id))
-                    logger.info(f"Started {entity_id} for schedule {schedule_id}")
-                    
-                    # Wait for this zone to finish before starting the next
-                    duration = self._get_zone_duration(schedule_id, entity_id)
-                    if duration:
-                        await asyncio.sleep(duration * 60)
-                    
-                    await self.ha_service.control_switch(entity_id, 'turn_off')
-                    self.running_jobs[entity_id].remove(str(schedule_id))
-                except Exception as e:
-                    logger.error(f"Failed to control {entity_id}: {str(e)}")
+            # For sequential watering, hand the zones to the timer-driven engine
+            zones = self._get_zone_durations(entity_ids, duration_minutes)
+            if not zones:
+                logger.error(f"No zone durations for sequential schedule {schedule_id}")
+                return
+            proceed = await run_arbiter.start_run(run)
+            sequential_run = sequential_engine.start_run(
+                self.ha_service, schedule_id, zones, priority, event_type,
+                suspended=not proceed
+            )
+            run.sequential_run_id = sequential_run.run_id
         else:
             # For parallel watering or turn_off actions
-            for entity_id in entity_ids:
-                try:
-                    await self.ha_service.control_switch(entity_id, action)
-                    if action == 'turn_on':
-                        self.running_jobs[entity_id].append(str(schedule_id))
-                    else:
-                        self.running_jobs[entity_id].remove(str(schedule_id))
-                    logger.info(f"Successfully executed {action} for {entity_id}")
-                except Exception as e:
-                    logger.error(f"Failed to {action} {entity_id}: {str(e)}")
-
-    def _get_zone_duration(self, schedule_id: int, entity_id: str) -> Optional[int]:
-        """Get the duration for a specific zone in a schedule"""
-        # Implement logic to get duration from schedule configuration
-        # This is a placeholder - actual implementation would fetch from database
-        return None
-
-    def add_or_update_schedule(self, schedule: models.Schedule) -> bool:
-        """Add or update jobs for a schedule"""
-        try:
-            # Remove existing jobs for this schedule
-            self.remove_schedule(schedule.id)
+            owner = run.key
+            if action == 'turn_on':
+                if not await run_arbiter.start_run(run):
+                    return
+                results = await admit_and_turn_on(
+                    self.ha_service, entity_ids, owner, priority, event_type,
+                    source="schedule", schedule_id=schedule_id,
+                    deadline=time.time() + duration_minutes * 60 if duration_minutes else None
+                )
+            else:
+                if run_arbiter.owns_stop(owner):
+                    logger.info(f"Stop for schedule {schedule_id} is handled by the arbiter")
+                    return
+                admission_controller.release_many(entity_ids, owner)
+                results = await switch_zones(self.ha_service, entity_ids, action, owner=owner)
+                run_arbiter.finish_run(owner)
+            for entity_id, result in results.items():
+                if result.get("admitted") is False:
+                    logger.info(f"{entity_id} was not admitted for schedule {schedule_id}")
+                    continue
+                if not result["success"]:
+                    logger.error(f"Failed to {action} {entity_id}")
+                    continue
+                if result.get("suppressed"):
+                    logger.info(f"Skipped {action} for {entity_id}: {result['suppressed']}")
+                    continue
+                logger.info(
+                    f"Successfully executed {action} for {entity_id} "
+                    f"in {result['latency_ms']}ms"
+                )
 
-            if not schedule.is_enabled:
-                logger.info(f"Schedule {schedule.id} is disabled, skipping job creation")
-                return True
+    def _get_zone_durations(
+        self,
+        entity_ids: List[str],
+        duration_minutes: Optional[int]
+    ) -> List[Tuple[str, int]]:
+        """Pair each zone with its run time; every zone gets the slot's duration"""
+        if not duration_minutes:
+            return []
+        return [(entity_id, duration_minutes) for entity_id in entity_ids]
 
-            entity_ids = self._get_solenoid_entities(schedule)
-            if not entity_ids:
-                logger.error(f"No valid entities found for schedule {schedule.id}")
-                return False
+    def _job_specs(self, schedule: models.Schedule) -> List[Dict[str, Any]]:
+        """add_job arguments for every job an enabled schedule should have"""
+        if settings.SLOT_DISPATCHER_ENABLED:
+            return []  # Slots are fired by the slot dispatcher instead
+        if not schedule.is_enabled or not self._get_solenoid_entities(schedule):
+            return []
 
-            is_sequential = (
-                schedule.target_type == 'group' and 
-                schedule.group and 
-                schedule.group.sequential_watering
-            )
+        is_sequential = is_sequential_schedule(schedule)
+        specs = []
 
-            # Sort time slots by priority (P1 > P2 > MANUAL)
-            for slot in sorted(schedule.time_slots, key=lambda x: schedule.priority):
-                start_job_id = self._get_job_id(schedule.id, slot.id, "start")
-                stop_job_id = self._get_job_id(schedule.id, slot.id, "stop")
-                
-                # Parse time and days
-                hour, minute = slot.start_time.hour, slot.start_time.minute
-                days_of_week = self._parse_days_of_week(slot.days_of_week)
-                
-                if not days_of_week:
-                    logger.error(f"No valid days found for slot {slot.id}")
-                    continue
+        # P1/P2 precedence is decided at run time by the run arbiter
+        for slot in sorted(schedule.time_slots, key=lambda x: x.start_time):
+            # Parse time and days
+            hour, minute = slot.start_time.hour, slot.start_time.minute
+            days_of_week = self._parse_days_of_week(slot.days_of_week)
+
+            if not days_of_week:
+                logger.error(f"No valid days found for slot {slot.id}")
+                continue
+
+            # Start job
+            specs.append(dict(
+                func=run_slot_job,
+                trigger=CronTrigger(
+                    day_of_week=','.join(days_of_week),
+                    hour=hour,
+                    minute=minute
+                ),
+                id=self._get_job_id(schedule.id, slot.id, "start"),
+                name=f"Start {schedule.name} - Slot {slot.id}",
+                args=[schedule.id, slot.id, 'start'],
+                replace_existing=True,
+                misfire_grace_time=300  # 5 minutes grace time
+            ))
+
+            if not is_sequential:
+                # For non-sequential, schedule stop time
+                start = datetime.combine(datetime.today(), slot.start_time)
+                stop = start + timedelta(minutes=slot.duration_minutes)
+                stop_time = stop.time()
+                # A run crossing midnight stops on the following day
+                stop_days = sorted(
+                    (int(day) + (stop.date() - start.date()).days) % 7
+                    for day in days_of_week
+                )
 
-                # Create start job
-                self.scheduler.add_job(
-                    func=self.execute_watering_action,
+                specs.append(dict(
+                    func=run_slot_job,
                     trigger=CronTrigger(
-                        day_of_week=','.join(days_of_week),
-                        hour=hour,
-                        minute=minute
+                        day_of_week=','.join(map(str, stop_days)),
+                        hour=stop_time.hour,
+                        minute=stop_time.minute
                     ),
-                    id=start_job_id,
-                    name=f"Start {schedule.name} - Slot {slot.id}",
-                    args=[
-                        'turn_on',
-                        entity_ids,
-                        schedule.id,
-                        is_sequential
-                    ],
+                    id=self._get_job_id(schedule.id, slot.id, "stop"),
+                    name=f"Stop {schedule.name} - Slot {slot.id}",
+                    args=[schedule.id, slot.id, 'stop'],
                     replace_existing=True,
-                    misfire_grace_time=300  # 5 minutes grace time
-                )
+                    misfire_grace_time=300
+                ))
 
-                if not is_sequential:
-                    # For non-sequential, schedule stop time
-                    stop_time = (
-                        datetime.combine(datetime.today(), slot.start_time) +
-                        timedelta(minutes=slot.duration_minutes)
-                    ).time()
-
-                    self.scheduler.add_job(
-                        func=self.execute_watering_action,
-                        trigger=CronTrigger(
-                            day_of_week=','.join(days_of_week),
-                            hour=stop_time.hour,
-                            minute=stop_time.minute
-                        ),
-                        id=stop_job_id,
-                        name=f"Stop {schedule.name} - Slot {slot.id}",
-                        args=['turn_off', entity_ids, schedule.id, False],
-                        replace_existing=True,
-                        misfire_grace_time=300
-                    )
+        return specs
 
-                logger.info(
-                    f"Created jobs for schedule {schedule.id} slot {slot.id}: "
-                    f"start at {slot.start_time}, duration {slot.duration_minutes}min"
-                )
+    def _job_matches(self, job: Job, spec: Dict[str, Any]) -> bool:
+        """True if a stored job already does what its spec asks for"""
+        return (
+            job.func_ref == obj_to_ref(spec['func'])
+            and list(job.args) == spec['args']
+            and str(job.trigger) == str(spec['trigger'])
+            and job.name == spec['name']
+            and job.misfire_grace_time == spec['misfire_grace_time']
+        )
+
+    async def add_or_update_schedule(self, schedule: models.Schedule) -> bool:
+        """Add or update jobs for a schedule"""
+        try:
+            schedule_timeline.update_schedule(schedule)
+            slot_plans.update_schedule(schedule)
 
+            if not schedule.is_enabled:
+                await run_db(self._replace_jobs, schedule.id, [])
+                logger.info(f"Schedule {schedule.id} is disabled, skipping job creation")
+                return True
+
+            if not self._get_solenoid_entities(schedule):
+                await run_db(self._replace_jobs, schedule.id, [])
+                logger.error(f"No valid entities found for schedule {schedule.id}")
+                return False
+
+            await run_db(self._replace_jobs, schedule.id, self._job_specs(schedule))
             return True
 
         except Exception as e:
             logger.error(f"Error creating schedule jobs: {str(e)}")
             return False
 
-    def remove_schedule(self, schedule_id: int) -> None:
+    async def reconcile(self, schedules: List[models.Schedule]) -> Dict[str, int]:
+        """
+        Bring the jobstore in line with the schedules in the database
+
+        Computes the jobs every schedule should have and diffs them against
+        the stored schedule jobs in one pass: missing jobs are added, changed
+        ones replaced and orphans removed, while jobs that already match are
+        left untouched. The timeline, slot plans and job index are rebuilt
+        from the same schedules.
+
+        Returns:
+            Dict with the number of jobs added, replaced, removed and unchanged
+        """
+        schedule_timeline.rebuild(schedules)
+        slot_plans.rebuild(schedules)
+
+        desired: Dict[str, Dict[str, Any]] = {}
+        desired_index: Dict[int, List[str]] = defaultdict(list)
+        for schedule in schedules:
+            for spec in self._job_specs(schedule):
+                desired[spec['id']] = spec
+                desired_index[schedule.id].append(spec['id'])
+        return await run_db(self._reconcile_jobs, desired, desired_index)
+
+    async def remove_schedule(self, schedule_id: int) -> None:
         """Remove all jobs for a schedule"""
         try:
-            jobs = self.scheduler.get_jobs()
-            for job in jobs:
-                if job.id.startswith(f"schedule_{schedule_id}_"):
-                    self.scheduler.remove_job(job.id)
+            schedule_timeline.remove_schedule(schedule_id)
+            slot_plans.remove_schedule(schedule_id)
+            await run_db(self._replace_jobs, schedule_id, [])
             logger.info(f"Removed all jobs for schedule {schedule_id}")
         except Exception as e:
             logger.error(f"Error removing schedule jobs: {str(e)}")
 
-    def run_schedule_now(self, schedule: models.Schedule) -> bool:
+    # Jobstore and job index writes below block on the database, so they
+    # run on the database thread pool, one at a time
+
+    def _replace_jobs(self, schedule_id: int, specs: List[Dict[str, Any]]) -> None:
+        """Swap a schedule's jobs for the ones in `specs`"""
+        with self._jobs_lock:
+            job_ids = schedule_job_index.get(schedule_id)
+            for job_id in job_ids:
+                try:
+                    self.scheduler.remove_job(job_id)
+                except JobLookupError:
+                    pass  # Indexed but never added, or already gone
+            schedule_job_index.discard(schedule_id, job_ids)
+
+            # Index the job ids before adding the jobs so the index never misses one
+            schedule_job_index.add(schedule_id, [spec['id'] for spec in specs])
+            for spec in specs:
+                self.scheduler.add_job(**spec)
+                logger.info(f"Created job {spec['id']}: {spec['trigger']}")
+
+    def _reconcile_jobs(
+        self,
+        desired: Dict[str, Dict[str, Any]],
+        desired_index: Dict[int, List[str]]
+    ) -> Dict[str, int]:
+        with self._jobs_lock:
+            existing = {
+                job.id: job for job in self.scheduler.get_jobs()
+                if _schedule_id_of(job.id) is not None
+            }
+            orphans = [job_id for job_id in existing if job_id not in desired]
+
+            # Index everything this pass touches, then only what remains
+            touched_index = {schedule_id: list(job_ids) for schedule_id, job_ids in desired_index.items()}
+            for job_id in orphans:
+                touched_index.setdefault(_schedule_id_of(job_id), []).append(job_id)
+            schedule_job_index.rebuild(touched_index)
+
+            summary = {"added": 0, "replaced": 0, "removed": 0, "unchanged": 0}
+            for job_id, spec in desired.items():
+                job = existing.get(job_id)
+                if job is None:
+                    self.scheduler.add_job(**spec)
+                    summary["added"] += 1
+                elif self._job_matches(job, spec):
+                    summary["unchanged"] += 1
+                else:
+                    self.scheduler.add_job(**spec)
+                    summary["replaced"] += 1
+
+            for job_id in orphans:
+                try:
+                    self.scheduler.remove_job(job_id)
+                except JobLookupError:
+                    pass
+                summary["removed"] += 1
+            if orphans:
+                schedule_job_index.rebuild(desired_index)
+
+            logger.info(
+                f"Reconciled scheduler jobs: {summary['added']} added, "
+                f"{summary['replaced']} replaced, {summary['removed']} removed, "
+                f"{summary['unchanged']} unchanged"
+            )
+            return summary
+
+    async def run_schedule_now(self, schedule: models.Schedule) -> bool:
         """Manually run a schedule immediately"""
         try:
             entity_ids = self._get_solenoid_entities(schedule)
@@ -234,27 +428,39 @@ class SchedulerService:
                 logger.error(f"No valid entities found for schedule {schedule.id}")
                 return False
 
-            is_sequential = (
-                schedule.target_type == 'group' and 
-                schedule.group and 
-                schedule.group.sequential_watering
-            )
+            is_sequential = is_sequential_schedule(schedule)
+            slot_plans.update_schedule(schedule)
 
-            # Execute for each time slot
+            # Execute for each time slot. The slots all start now, so each
+            # is a run of its own; one slot's stop must not end the others
             for slot in schedule.time_slots:
-                # Start watering
-                self.execute_watering_action('turn_on', entity_ids, schedule.id, is_sequential)
-                
+                owner = f"schedule_{schedule.id}_slot_{slot.id}"
                 if not is_sequential:
-                    # Schedule stop after duration
-                    self.scheduler.add_job(
-                        func=self.execute_watering_action,
-                        trigger='date',
-                        run_date=datetime.now() + timedelta(minutes=slot.duration_minutes),
-                        id=f"manual_stop_{schedule.id}_{slot.id}_{datetime.now().timestamp()}",
-                        args=['turn_off', entity_ids, schedule.id, False]
+                    # Stop after duration; checkpointed, so it survives a restart.
+                    # Armed before the zones wait for admission, so firing also
+                    # withdraws zones that were never admitted
+                    zone_deadlines.schedule(
+                        f"stop:manual_{schedule.id}_{slot.id}",
+                        slot.duration_minutes * 60,
+                        entity_ids,
+                        owner=owner,
+                        callback=partial(
+                            self.execute_watering_action, 'turn_off', entity_ids, schedule.id,
+                            owner=owner
+                        )
                     )
 
+                # Start watering without waiting for admission, as scheduled
+                # jobs do, so the request returns while zones are queued
+                task = asyncio.ensure_future(self.execute_watering_action(
+                    'turn_on', entity_ids, schedule.id, is_sequential, slot.duration_minutes,
+                    priority=schedule.priority or 0,
+                    event_type=models.EventType(schedule.event_type).value,
+                    owner=owner
+                ))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
             return True
 
         except Exception as e:
@@ -263,4 +469,4 @@ class SchedulerService:
 
     def get_active_jobs(self) -> dict:
         """Get currently active jobs"""
-        return dict(self.running_jobs)
+        return run_registry.by_zone()
@@ -0,0 +1,275 @@
+import asyncio
+import enum
+import itertools
+import logging
+import time
+from collections import deque
+from functools import partial
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from ..core.config import settings
+from ..models.database_models import EventType
+from .admission import admission_controller
+from .commands import switch_zone
+from .deadlines import zone_deadlines
+from .run_registry import run_registry
+
+logger = logging.getLogger(__name__)
+
+class RunState(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUSPENDED = "suspended"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+
+class SequentialRun:
+    """State of one sequential group run: which zone is open and until when"""
+
+    __slots__ = (
+        "run_id", "schedule_id", "priority", "event_type", "zones", "index", "state",
+        "started_at", "zone_started_at", "zone_deadline", "zone_remaining", "failed",
+        "ha_service"
+    )
+
+    def __init__(
+        self,
+        run_id: int,
+        schedule_id: int,
+        zones: List[Tuple[str, int]],
+        ha_service,
+        priority: int = 0,
+        event_type: EventType = EventType.MANUAL
+    ):
+        self.run_id = run_id
+        self.schedule_id = schedule_id
+        self.priority = priority
+        self.event_type = event_type
+        self.zones = zones  # [(entity_id, duration_minutes)] in watering order
+        self.index = 0
+        self.state = RunState.PENDING
+        self.started_at = time.time()
+        self.zone_started_at: Optional[float] = None
+        self.zone_deadline: Optional[float] = None
+        self.zone_remaining: Optional[float] = None  # seconds left in a suspended zone
+        self.failed: List[str] = []
+        self.ha_service = ha_service
+
+    @property
+    def owner(self) -> str:
+        """Owner name used with the zone admission controller"""
+        return f"run_{self.run_id}"
+
+    @property
+    def deadline_key(self) -> str:
+        """Key of the open zone's stop deadline in the deadline wheel"""
+        return f"stop:{self.owner}"
+
+    @property
+    def current_zone(self) -> Optional[str]:
+        if self.state == RunState.RUNNING and self.index < len(self.zones):
+            return self.zones[self.index][0]
+        return None
+
+    def progress(self) -> dict:
+        remaining_minutes = sum(minutes for _, minutes in self.zones[self.index + 1:])
+        if self.zone_deadline is not None and self.state == RunState.RUNNING:
+            remaining_seconds = max(0.0, self.zone_deadline - time.time()) + remaining_minutes * 60
+        elif self.state == RunState.SUSPENDED and self.index < len(self.zones):
+            current = self.zone_remaining
+            if current is None:
+                current = self.zones[self.index][1] * 60
+            remaining_seconds = current + remaining_minutes * 60
+        else:
+            remaining_seconds = 0.0
+        return {
+            "run_id": self.run_id,
+            "schedule_id": self.schedule_id,
+            "state": self.state.value,
+            "current_zone": self.current_zone,
+            "zone_index": self.index,
+            "zone_count": len(self.zones),
+            "zones": [entity_id for entity_id, _ in self.zones],
+            "failed_zones": list(self.failed),
+            "started_at": self.started_at,
+            "remaining_seconds": round(remaining_seconds, 1)
+        }
+
+class SequentialEngine:
+    """
+    Timer-driven engine for sequential group watering.
+
+    Each run is a small state machine. Opening a zone arms a stop deadline
+    in the deadline wheel for the zone's duration; when it expires a short
+    task closes the zone and opens the next one. Nothing waits on a sleeping
+    coroutine or thread between zones, so hundreds of concurrent runs cost
+    one deadline each.
+    """
+
+    def __init__(self, history_size: int = 100):
+        self._runs: Dict[int, SequentialRun] = {}
+        self._finished: Deque[SequentialRun] = deque(maxlen=history_size)
+        self._ids = itertools.count(1)
+        self._tasks: Set[asyncio.Task] = set()
+        self._finish_listeners: List[Callable[[SequentialRun], None]] = []
+
+    def add_finish_listener(self, listener: Callable[[SequentialRun], None]) -> None:
+        """Call `listener(run)` whenever a run completes or is cancelled"""
+        self._finish_listeners.append(listener)
+
+    def start_run(
+        self,
+        ha_service,
+        schedule_id: int,
+        zones: List[Tuple[str, int]],
+        priority: int = 0,
+        event_type: EventType = EventType.MANUAL,
+        suspended: bool = False
+    ) -> SequentialRun:
+        """Start watering `zones` one after another; returns immediately"""
+        run = SequentialRun(next(self._ids), schedule_id, zones, ha_service, priority, event_type)
+        self._runs[run.run_id] = run
+        if suspended:
+            run.state = RunState.SUSPENDED
+        else:
+            self._spawn(self._open_zone(run))
+        logger.info(f"Started sequential run {run.run_id} for schedule {schedule_id} ({len(zones)} zones)")
+        return run
+
+    def cancel_run(self, run_id: int) -> bool:
+        """Stop a run, closing the zone that is currently open"""
+        run = self._runs.get(run_id)
+        if run is None:
+            return False
+        zone_deadlines.cancel(run.deadline_key)
+        entity_id = run.current_zone
+        self._finish(run, RunState.CANCELLED)
+        if run.index < len(run.zones):
+            # Also withdraws a turn-on still waiting for admission
+            admission_controller.release(run.zones[run.index][0], run.owner)
+        if entity_id:
+            self._spawn(switch_zone(run.ha_service, entity_id, 'turn_off', owner=run.owner))
+        return True
+
+    def suspend_run(self, run_id: int) -> bool:
+        """Close the open zone and keep its remaining time for resume_run"""
+        run = self._runs.get(run_id)
+        if run is None or run.state == RunState.SUSPENDED:
+            return False
+        zone_deadlines.cancel(run.deadline_key)
+        entity_id = run.current_zone
+        if entity_id and run.zone_deadline is not None:
+            run.zone_remaining = max(0.0, run.zone_deadline - time.time())
+        run.state = RunState.SUSPENDED
+        run.zone_deadline = None
+        if run.index < len(run.zones):
+            admission_controller.release(run.zones[run.index][0], run.owner)
+        if entity_id:
+            self._spawn(switch_zone(run.ha_service, entity_id, 'turn_off', owner=run.owner))
+        logger.info(f"Suspended sequential run {run.run_id}")
+        return True
+
+    def resume_run(self, run_id: int) -> bool:
+        """Continue a suspended run where it left off"""
+        run = self._runs.get(run_id)
+        if run is None or run.state != RunState.SUSPENDED:
+            return False
+        run.state = RunState.PENDING
+        self._spawn(self._open_zone(run))
+        logger.info(f"Resumed sequential run {run.run_id}")
+        return True
+
+    def get_run(self, run_id: int) -> Optional[SequentialRun]:
+        run = self._runs.get(run_id)
+        if run is None:
+            run = next((r for r in self._finished if r.run_id == run_id), None)
+        return run
+
+    def get_progress(self) -> List[dict]:
+        """Progress of active runs followed by recently finished ones"""
+        return [run.progress() for run in self._runs.values()] + \
+            [run.progress() for run in reversed(self._finished)]
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _finish(self, run: SequentialRun, state: RunState) -> None:
+        run.state = state
+        zone_deadlines.cancel(run.deadline_key)
+        run.zone_deadline = None
+        if self._runs.pop(run.run_id, None) is not None:
+            self._finished.append(run)
+            for listener in self._finish_listeners:
+                try:
+                    listener(run)
+                except Exception as e:
+                    logger.error(f"Sequential run finish listener failed: {str(e)}")
+
+    async def _open_zone(self, run: SequentialRun) -> None:
+        """Open the next zone that accepts the command and arm its timer"""
+        while (
+            run.index < len(run.zones)
+            and run.run_id in self._runs
+            and run.state != RunState.SUSPENDED
+        ):
+            entity_id, minutes = run.zones[run.index]
+            if not await admission_controller.acquire(
+                entity_id, run.owner, run.priority, run.event_type
+            ):
+                return
+            if await switch_zone(run.ha_service, entity_id, 'turn_on', owner=run.owner):
+                if run.run_id not in self._runs or run.state == RunState.SUSPENDED:
+                    # Cancelled or suspended while the command was in flight
+                    await switch_zone(run.ha_service, entity_id, 'turn_off', owner=run.owner)
+                    return
+                minutes = max(settings.MIN_DURATION, min(minutes, settings.MAX_DURATION))
+                seconds = minutes * 60
+                if run.zone_remaining is not None:
+                    seconds, run.zone_remaining = run.zone_remaining, None
+                run.state = RunState.RUNNING
+                run.zone_started_at = time.time()
+                run.zone_deadline = run.zone_started_at + seconds
+                zone_deadlines.schedule(
+                    run.deadline_key, seconds, [entity_id], owner=run.owner,
+                    callback=partial(self._on_zone_elapsed, run.run_id)
+                )
+                run_registry.started(
+                    entity_id, run.owner, "sequential", run.schedule_id, run.zone_deadline,
+                    next_zones=run.zones[run.index + 1:]
+                )
+                logger.info(f"Run {run.run_id}: started {entity_id} for {round(seconds)}s")
+                return
+            logger.error(f"Run {run.run_id}: failed to start {entity_id}, skipping")
+            admission_controller.release(entity_id, run.owner)
+            run.failed.append(entity_id)
+            run.index += 1
+        if run.run_id in self._runs and run.index >= len(run.zones):
+            self._finish(run, RunState.COMPLETED)
+            logger.info(f"Sequential run {run.run_id} for schedule {run.schedule_id} completed")
+
+    def _on_zone_elapsed(self, run_id: int) -> None:
+        run = self._runs.get(run_id)
+        if run is not None and run.state == RunState.RUNNING:
+            self._spawn(self._advance(run))
+
+    async def _advance(self, run: SequentialRun) -> None:
+        entity_id = run.zones[run.index][0]
+        if not await switch_zone(run.ha_service, entity_id, 'turn_off', owner=run.owner):
+            logger.error(f"Run {run.run_id}: failed to stop {entity_id}")
+            run.failed.append(entity_id)
+        if run.run_id not in self._runs:
+            # Cancelled while closing this zone, which cancel_run released
+            return
+        admission_controller.release(entity_id, run.owner)
+        run.index += 1
+        if run.state == RunState.SUSPENDED:
+            # Suspended while closing this zone; resume from the next one
+            run.zone_remaining = None
+            return
+        run.state = RunState.PENDING
+        await self._open_zone(run)
+
+# App-wide engine shared by every SchedulerService
+sequential_engine = SequentialEngine()
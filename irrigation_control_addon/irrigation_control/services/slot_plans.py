@@ -0,0 +1,101 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..models import database_models as models
+
+logger = logging.getLogger(__name__)
+
+def schedule_entity_ids(schedule: models.Schedule) -> List[str]:
+    """Get list of entity_ids for a schedule (either single solenoid or group)"""
+    if schedule.target_type == 'solenoid' and schedule.solenoid:
+        return [schedule.solenoid.entity_id]
+    elif schedule.target_type == 'group' and schedule.group:
+        # If sequential watering is enabled for the group, maintain order
+        if schedule.group.sequential_watering:
+            return [s.entity_id for s in sorted(
+                schedule.group.solenoids,
+                key=lambda x: (x.sequence_order or float('inf'), x.id)
+            ) if s.is_active]
+        return [s.entity_id for s in schedule.group.solenoids if s.is_active]
+    return []
+
+def is_sequential_schedule(schedule: models.Schedule) -> bool:
+    return bool(
+        schedule.target_type == 'group' and
+        schedule.group and
+        schedule.group.sequential_watering
+    )
+
+class SlotPlan:
+    """Everything a slot's start or stop job needs, resolved from the DB"""
+
+    __slots__ = (
+        "schedule_id", "slot_id", "entity_ids", "is_sequential",
+        "duration_minutes", "priority", "event_type"
+    )
+
+    def __init__(
+        self,
+        schedule_id: int,
+        slot_id: int,
+        entity_ids: Tuple[str, ...],
+        is_sequential: bool,
+        duration_minutes: int,
+        priority: int,
+        event_type: models.EventType
+    ):
+        self.schedule_id = schedule_id
+        self.slot_id = slot_id
+        self.entity_ids = entity_ids
+        self.is_sequential = is_sequential
+        self.duration_minutes = duration_minutes
+        self.priority = priority
+        self.event_type = event_type
+
+class SlotPlanCache:
+    """
+    In-memory (schedule_id, slot_id) -> SlotPlan table.
+
+    Scheduler jobs only carry (schedule_id, slot_id, action); the zones,
+    duration and precedence are looked up here when the job fires. The cache
+    is refreshed wherever schedules, groups or solenoids change, so a job
+    always waters the schedule's current zones.
+    """
+
+    def __init__(self):
+        self._plans: Dict[Tuple[int, int], SlotPlan] = {}
+        self._by_schedule: Dict[int, List[Tuple[int, int]]] = {}
+
+    def get(self, schedule_id: int, slot_id: int) -> Optional[SlotPlan]:
+        return self._plans.get((schedule_id, slot_id))
+
+    def rebuild(self, schedules: Iterable[models.Schedule]) -> None:
+        """Resolve every schedule from scratch"""
+        self._plans.clear()
+        self._by_schedule.clear()
+        for schedule in schedules:
+            self.update_schedule(schedule)
+        logger.info(f"Cached {len(self._plans)} slot plans")
+
+    def update_schedule(self, schedule: models.Schedule) -> None:
+        """Re-resolve one schedule after it, its group or its solenoids changed"""
+        self.remove_schedule(schedule.id)
+        entity_ids = tuple(schedule_entity_ids(schedule))
+        is_sequential = is_sequential_schedule(schedule)
+        event_type = models.EventType(schedule.event_type or models.EventType.MANUAL)
+        keys = []
+        for slot in schedule.time_slots:
+            key = (schedule.id, slot.id)
+            self._plans[key] = SlotPlan(
+                schedule.id, slot.id, entity_ids, is_sequential,
+                slot.duration_minutes, schedule.priority or 0, event_type
+            )
+            keys.append(key)
+        self._by_schedule[schedule.id] = keys
+
+    def remove_schedule(self, schedule_id: int) -> None:
+        for key in self._by_schedule.pop(schedule_id, ()):
+            self._plans.pop(key, None)
+
+# App-wide cache read by scheduler jobs when they fire
+slot_plans = SlotPlanCache()
@@ -0,0 +1,368 @@
+import bisect
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from ..core.config import settings
+from ..models import database_models as models
+
+logger = logging.getLogger(__name__)
+
+DAYS = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+class SlotOccurrence:
+    """One weekly occurrence of a time slot, in minutes from Monday 00:00"""
+
+    __slots__ = (
+        "schedule_id", "slot_id", "schedule_name", "event_type", "priority",
+        "solenoid_ids", "start", "end"
+    )
+
+    def __init__(
+        self,
+        schedule: models.Schedule,
+        slot_id: int,
+        solenoid_ids: Tuple[int, ...],
+        start: int,
+        end: int
+    ):
+        self.schedule_id = schedule.id
+        self.slot_id = slot_id
+        self.schedule_name = schedule.name
+        self.event_type = models.EventType(schedule.event_type or models.EventType.MANUAL)
+        self.priority = schedule.priority or 0
+        self.solenoid_ids = solenoid_ids
+        self.start = start
+        self.end = end  # may exceed MINUTES_PER_WEEK when crossing Sunday night
+
+    def to_dict(self, week_start: Optional[datetime] = None) -> dict:
+        data = {
+            "schedule_id": self.schedule_id,
+            "slot_id": self.slot_id,
+            "schedule_name": self.schedule_name,
+            "event_type": self.event_type.value,
+            "priority": self.priority,
+            "solenoid_ids": list(self.solenoid_ids),
+            "start_minute": self.start,
+            "end_minute": self.end
+        }
+        if week_start is not None:
+            data["start"] = (week_start + timedelta(minutes=self.start)).isoformat()
+            data["end"] = (week_start + timedelta(minutes=self.end)).isoformat()
+        return data
+
+class _Interval:
+    __slots__ = ("start", "end", "occurrence")
+
+    def __init__(self, start: int, end: int, occurrence: SlotOccurrence):
+        self.start = start
+        self.end = end
+        self.occurrence = occurrence
+
+class IntervalTree:
+    """Static centered interval tree over half-open [start, end) intervals"""
+
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, intervals: List[_Interval]):
+        starts = sorted(interval.start for interval in intervals)
+        self.center = starts[len(starts) // 2] if starts else 0
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval.end <= self.center:
+                left.append(interval)
+            elif interval.start > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        self.by_start = sorted(here, key=lambda i: i.start)
+        self.by_end = sorted(here, key=lambda i: i.end, reverse=True)
+        self.left = IntervalTree(left) if left else None
+        self.right = IntervalTree(right) if right else None
+
+    def overlap(self, start: int, end: int, found: Optional[List[_Interval]] = None) -> List[_Interval]:
+        """All intervals overlapping [start, end)"""
+        if found is None:
+            found = []
+        if end <= self.center:
+            for interval in self.by_start:
+                if interval.start >= end:
+                    break
+                found.append(interval)
+            if self.left:
+                self.left.overlap(start, end, found)
+        elif start > self.center:
+            for interval in self.by_end:
+                if interval.end <= start:
+                    break
+                found.append(interval)
+            if self.right:
+                self.right.overlap(start, end, found)
+        else:
+            found.extend(self.by_start)
+            if self.left:
+                self.left.overlap(start, end, found)
+            if self.right:
+                self.right.overlap(start, end, found)
+        return found
+
+def parse_days(days_str: str) -> List[int]:
+    """Convert "MON,WED" to day indexes (0 is Monday)"""
+    return [DAYS.index(day) for day in days_str.split(',') if day in DAYS]
+
+def schedule_solenoid_ids(schedule: models.Schedule) -> Tuple[int, ...]:
+    """Solenoids a schedule drives, with groups expanded to their members"""
+    if schedule.target_type == 'solenoid' and schedule.solenoid:
+        return (schedule.solenoid.id,) if schedule.solenoid.is_active else ()
+    if schedule.target_type == 'group' and schedule.group:
+        return tuple(sorted(s.id for s in schedule.group.solenoids if s.is_active))
+    return ()
+
+def compile_slots(
+    schedule: models.Schedule,
+    slots: Iterable,
+    solenoid_ids: Tuple[int, ...]
+) -> List[SlotOccurrence]:
+    """Expand time slots (ORM rows or schemas) into weekly occurrences"""
+    occurrences = []
+    for slot in slots:
+        start_of_day = slot.start_time.hour * 60 + slot.start_time.minute
+        for day in parse_days(slot.days_of_week):
+            start = day * MINUTES_PER_DAY + start_of_day
+            occurrences.append(SlotOccurrence(
+                schedule, getattr(slot, "id", None), solenoid_ids, start,
+                start + slot.duration_minutes
+            ))
+    return occurrences
+
+def compile_schedule(schedule: models.Schedule) -> List[SlotOccurrence]:
+    """Expand an enabled schedule into its weekly slot occurrences"""
+    if not schedule.is_enabled:
+        return []
+    solenoid_ids = schedule_solenoid_ids(schedule)
+    if not solenoid_ids:
+        return []
+    return compile_slots(schedule, schedule.time_slots, solenoid_ids)
+
+def format_minute(minute: int) -> str:
+    """Render a minute of the week as e.g. "TUE 06:30" """
+    minute %= MINUTES_PER_WEEK
+    day, minute = divmod(minute, MINUTES_PER_DAY)
+    return f"{DAYS[day]} {minute // 60:02d}:{minute % 60:02d}"
+
+class ScheduleTimeline:
+    """
+    Weekly timeline compiled from all enabled schedules.
+
+    Occurrences are kept sorted by start minute for "what runs next?" and
+    indexed in one interval tree per solenoid (plus one across all
+    solenoids) for overlap queries. Changing a schedule only recompiles that
+    schedule; trees of the affected solenoids are rebuilt lazily on the next
+    query.
+    """
+
+    def __init__(self):
+        self._by_schedule: Dict[int, List[SlotOccurrence]] = {}
+        self._starts: List[Tuple[int, int, int]] = []  # (start, schedule_id, slot_id)
+        self._sorted: List[SlotOccurrence] = []
+        self._by_solenoid: Dict[int, List[SlotOccurrence]] = defaultdict(list)
+        self._trees: Dict[Optional[int], IntervalTree] = {}
+        self._dirty: Set[Optional[int]] = set()
+        self._listeners: List[Callable[[], None]] = []
+
+    @property
+    def timezone(self) -> ZoneInfo:
+        return ZoneInfo(settings.TIMEZONE)
+
+    def add_change_listener(self, listener: Callable[[], None]) -> None:
+        """Call `listener()` whenever a schedule is compiled or removed"""
+        self._listeners.append(listener)
+
+    def _changed(self) -> None:
+        for listener in self._listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"Timeline change listener failed: {str(e)}")
+
+    def occurrences(self) -> List[SlotOccurrence]:
+        """Every compiled occurrence, sorted by start minute"""
+        return list(self._sorted)
+
+    def rebuild(self, schedules: Iterable[models.Schedule]) -> None:
+        """Compile every schedule from scratch"""
+        self._by_schedule.clear()
+        self._starts.clear()
+        self._sorted.clear()
+        self._by_solenoid.clear()
+        self._trees.clear()
+        self._dirty.clear()
+        for schedule in schedules:
+            self.update_schedule(schedule)
+        self._changed()
+        logger.info(f"Compiled timeline with {len(self._sorted)} slot occurrences")
+
+    def update_schedule(self, schedule: models.Schedule) -> None:
+        """Recompile one schedule after it was created or changed"""
+        self.remove_schedule(schedule.id)
+        occurrences = compile_schedule(schedule)
+        if not occurrences:
+            return
+        self._by_schedule[schedule.id] = occurrences
+        for occurrence in occurrences:
+            key = (occurrence.start, occurrence.schedule_id, occurrence.slot_id)
+            index = bisect.bisect_right(self._starts, key)
+            self._starts.insert(index, key)
+            self._sorted.insert(index, occurrence)
+            for solenoid_id in occurrence.solenoid_ids:
+                self._by_solenoid[solenoid_id].append(occurrence)
+                self._dirty.add(solenoid_id)
+        self._dirty.add(None)
+        self._changed()
+
+    def remove_schedule(self, schedule_id: int) -> None:
+        occurrences = self._by_schedule.pop(schedule_id, None)
+        if not occurrences:
+            return
+        removed = set(map(id, occurrences))
+        keep = [
+            (key, occurrence) for key, occurrence in zip(self._starts, self._sorted)
+            if id(occurrence) not in removed
+        ]
+        self._starts = [key for key, _ in keep]
+        self._sorted = [occurrence for _, occurrence in keep]
+        for solenoid_id in occurrences[0].solenoid_ids:
+            self._by_solenoid[solenoid_id] = [
+                o for o in self._by_solenoid[solenoid_id] if o.schedule_id != schedule_id
+            ]
+            if not self._by_solenoid[solenoid_id]:
+                del self._by_solenoid[solenoid_id]
+            self._dirty.add(solenoid_id)
+        self._dirty.add(None)
+        self._changed()
+
+    def _tree(self, solenoid_id: Optional[int]) -> Optional[IntervalTree]:
+        if solenoid_id in self._dirty:
+            self._dirty.discard(solenoid_id)
+            occurrences = self._sorted if solenoid_id is None else self._by_solenoid.get(solenoid_id, [])
+            intervals = [
+                _Interval(occurrence.start, occurrence.end, occurrence)
+                for occurrence in occurrences
+            ]
+            if intervals:
+                self._trees[solenoid_id] = IntervalTree(intervals)
+            else:
+                self._trees.pop(solenoid_id, None)
+        return self._trees.get(solenoid_id)
+
+    def overlapping(
+        self,
+        start: int,
+        end: int,
+        solenoid_id: Optional[int] = None
+    ) -> List[SlotOccurrence]:
+        """
+        Occurrences overlapping the weekly range [start, end) in minutes
+
+        The week is treated as cyclic, so runs crossing Sunday midnight
+        overlap ranges early on Monday and vice versa.
+        """
+        tree = self._tree(solenoid_id)
+        if tree is None or end <= start:
+            return []
+        found: Dict[int, SlotOccurrence] = {}
+        for shift in (0, -MINUTES_PER_WEEK, MINUTES_PER_WEEK):
+            for interval in tree.overlap(start + shift, end + shift):
+                found[id(interval.occurrence)] = interval.occurrence
+        return sorted(found.values(), key=lambda o: (o.start, o.schedule_id, o.slot_id))
+
+    def find_conflicts(
+        self,
+        occurrences: List[SlotOccurrence],
+        exclude_schedule_id: Optional[int] = None
+    ) -> List[dict]:
+        """
+        Existing slots overlapping any of `occurrences` on a shared solenoid
+
+        Each conflicting pair is reported once, with every solenoid the two
+        slots share.
+        """
+        conflicts: Dict[Tuple[int, int, int], dict] = {}
+        for occurrence in occurrences:
+            for solenoid_id in occurrence.solenoid_ids:
+                for other in self.overlapping(occurrence.start, occurrence.end, solenoid_id):
+                    if other.schedule_id == exclude_schedule_id:
+                        continue
+                    key = (occurrence.start, id(occurrence), id(other))
+                    conflict = conflicts.get(key)
+                    if conflict is None:
+                        conflict = conflicts[key] = {
+                            "type": "priority" if {occurrence.event_type, other.event_type} == {
+                                models.EventType.P1, models.EventType.P2
+                            } else "overlap",
+                            "slot_start": format_minute(occurrence.start),
+                            "slot_end": format_minute(occurrence.end),
+                            "event_type": occurrence.event_type.value,
+                            "conflicting_schedule_id": other.schedule_id,
+                            "conflicting_schedule_name": other.schedule_name,
+                            "conflicting_slot_id": other.slot_id,
+                            "conflicting_event_type": other.event_type.value,
+                            "conflicting_start": format_minute(other.start),
+                            "conflicting_end": format_minute(other.end),
+                            "solenoid_ids": []
+                        }
+                    conflict["solenoid_ids"].append(solenoid_id)
+        return list(conflicts.values())
+
+    def localize(self, moment: datetime) -> datetime:
+        """Put `moment` in the timeline's timezone, taking naive times as local"""
+        if moment.tzinfo is None:
+            return moment.replace(tzinfo=self.timezone)
+        return moment.astimezone(self.timezone)
+
+    def _week_start(self, moment: datetime) -> datetime:
+        moment = self.localize(moment)
+        return (moment - timedelta(days=moment.weekday())).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+
+    def between(self, start: datetime, end: datetime, solenoid_id: Optional[int] = None) -> List[dict]:
+        """Occurrences overlapping [start, end) as absolute times"""
+        tree = self._tree(solenoid_id)
+        if tree is None:
+            return []
+        start, end = self.localize(start), self.localize(end)
+        results = []
+        # Start a week early to catch runs crossing Sunday midnight into `start`
+        week_start = self._week_start(start) - timedelta(weeks=1)
+        while week_start < end:
+            range_start = (start - week_start).total_seconds() / 60
+            range_end = (end - week_start).total_seconds() / 60
+            for interval in sorted(tree.overlap(range_start, range_end), key=lambda i: i.start):
+                results.append(interval.occurrence.to_dict(week_start))
+            week_start += timedelta(weeks=1)
+        return results
+
+    def next_occurrences(self, n: int, after: Optional[datetime] = None) -> List[dict]:
+        """The next `n` slot starts at or after `after` (default now)"""
+        if not self._sorted or n <= 0:
+            return []
+        after = after or datetime.now(self.timezone)
+        week_start = self._week_start(after)
+        minute = int((after.astimezone(self.timezone) - week_start).total_seconds() // 60)
+        index = bisect.bisect_left(self._starts, (minute,))
+        results = []
+        while len(results) < n:
+            if index == len(self._sorted):
+                index = 0
+                week_start += timedelta(weeks=1)
+            results.append(self._sorted[index].to_dict(week_start))
+            index += 1
+        return results
+
+# App-wide compiled timeline
+schedule_timeline = ScheduleTimeline()
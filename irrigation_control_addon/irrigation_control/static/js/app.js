@@ -52,6 +52,27 @@ const API = {
         });
     },
 
+    // Command endpoints
+    async getCommand(id) {
+        return this.request(`/api/commands/${id}`);
+    },
+
+    async waitForCommand(id, interval = 500) {
+        // Control endpoints queue the command; poll until it is sent or given up
+        while (true) {
+            const command = (await this.getCommand(id)).data;
+            if (!['queued', 'running', 'retrying'].includes(command.state)) {
+                if (command.state !== 'succeeded') {
+                    const error = new Error(command.error || `Command ${command.state}`);
+                    showAlert(error.message, 'danger');
+                    throw error;
+                }
+                return command;
+            }
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    },
+
     // Group endpoints
     async getGroups() {
         return this.request('/api/groups');
@@ -156,7 +177,8 @@ document.addEventListener('DOMContentLoaded', () => {
             const id = e.target.dataset.id;
             const action = e.target.dataset.action;
             try {
-                await API.controlSolenoid(id, action);
+                const queued = await API.controlSolenoid(id, action);
+                await API.waitForCommand(queued.data.command_id);
                 showAlert(`Solenoid ${action === 'turn_on' ? 'started' : 'stopped'} successfully`, 'success');
             } catch (error) {
                 // Error already handled by API.request
@@ -12,6 +12,16 @@ fi
 CONFIG_LOG_LEVEL=$(bashio::config 'log_level')
 export LOG_LEVEL="${CONFIG_LOG_LEVEL:-info}"
 
+# Zone concurrency limit
+CONFIG_MAX_CONCURRENT_ZONES=$(bashio::config 'max_concurrent_zones')
+export MAX_CONCURRENT_ZONES="${CONFIG_MAX_CONCURRENT_ZONES:-3}"
+
+# Per-integration switch command rate limits, as JSON
+export HA_RATE_LIMITS="$(jq -c '.rate_limits // []' /data/options.json)"
+
+# Entity prefixes whose switches need one call per entity, as JSON
+export HA_UNBATCHED_PREFIXES="$(jq -c '.unbatched_prefixes // []' /data/options.json)"
+
 bashio::log.info "Starting Irrigation Control with log level: ${LOG_LEVEL}"
 
 # Initialize the database schema
@@ -0,0 +1,136 @@
+"""
+Wakeup cost of per-slot cron jobs against the single-timer slot dispatcher
+
+Usage (from irrigation_control_addon/):
+
+    python scripts/bench_dispatcher.py [--slots 1000] [--rounds 20]
+
+Stores one start and one stop cron job per daily slot in a scratch SQLite
+jobstore, then times loading every job and an APScheduler processing pass
+with one job due. The same slots are compiled into the timeline and the
+dispatcher's minute table, and a dispatcher wakeup is timed the same way.
+"""
+import argparse
+import asyncio
+import datetime as dt
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+DATA_DIR = tempfile.mkdtemp(prefix="bench-dispatcher-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DATA_DIR}/irrigation_addon.db")
+os.environ.setdefault("RUN_JOURNAL_PATH", f"{DATA_DIR}/run_journal.jsonl")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore  # noqa: E402
+from apscheduler.schedulers.asyncio import AsyncIOScheduler  # noqa: E402
+from apscheduler.schedulers.base import STATE_RUNNING  # noqa: E402
+from apscheduler.triggers.cron import CronTrigger  # noqa: E402
+
+from irrigation_control.models import database_models as models  # noqa: E402
+from irrigation_control.services import dispatcher  # noqa: E402
+from irrigation_control.services.scheduler_service import run_slot_job  # noqa: E402
+from irrigation_control.services.timeline import ScheduleTimeline  # noqa: E402
+
+EVERY_DAY = "MON,TUE,WED,THU,FRI,SAT,SUN"
+DURATION = 15  # minutes
+
+def ms(seconds: float) -> str:
+    return f"{seconds * 1000:.3f} ms"
+
+def make_schedule(i: int) -> models.Schedule:
+    hour, minute = divmod((i * 7) % 1440, 60)
+    schedule = models.Schedule(
+        id=i, name=f"Schedule {i}", target_type="solenoid",
+        event_type=models.EventType.P2, priority=0, is_enabled=True
+    )
+    schedule.solenoid = models.SolenoidDevice(id=i, entity_id=f"switch.zone_{i}", is_active=True)
+    schedule.time_slots = [models.ScheduleTimeSlot(
+        id=i, start_time=dt.time(hour, minute), duration_minutes=DURATION, days_of_week=EVERY_DAY
+    )]
+    return schedule
+
+async def bench_cron(schedules, rounds: int) -> None:
+    jobstore = SQLAlchemyJobStore(url=f"sqlite:///{DATA_DIR}/apscheduler_jobs.sqlite")
+    scheduler = AsyncIOScheduler(jobstores={"default": jobstore}, timezone="UTC")
+    scheduler.start(paused=True)
+    for schedule in schedules:
+        slot = schedule.time_slots[0]
+        start = slot.start_time.hour * 60 + slot.start_time.minute
+        for action, minute in (("start", start), ("stop", (start + DURATION) % 1440)):
+            scheduler.add_job(
+                run_slot_job, CronTrigger(hour=minute // 60, minute=minute % 60),
+                id=f"schedule_{schedule.id}_slot_{slot.id}_{action}",
+                args=[schedule.id, slot.id, action], misfire_grace_time=300
+            )
+
+    loads = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        jobstore.get_all_jobs()
+        loads.append(time.perf_counter() - started)
+
+    # Make one job due and run the processing pass a wakeup would run
+    wakeups = []
+    scheduler.state = STATE_RUNNING
+    for k in range(rounds):
+        job = scheduler.get_job(f"schedule_{k}_slot_{k}_start")
+        job._modify(next_run_time=dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds=1))
+        jobstore.update_job(job)
+        started = time.perf_counter()
+        scheduler._process_jobs()
+        wakeups.append(time.perf_counter() - started)
+    scheduler.shutdown(wait=False)
+
+    print(f"cron:       {2 * len(schedules)} jobs in the SQLite jobstore")
+    print(f"  load all jobs         {ms(statistics.median(loads))}")
+    print(f"  wakeup, one job due   {ms(statistics.median(wakeups))}")
+
+async def bench_dispatcher(schedules, rounds: int) -> None:
+    async def dispatch(schedule_id, slot_id, action):
+        pass
+
+    dispatcher.run_slot_job = dispatch  # measure the dispatcher, not the runs
+    timeline = ScheduleTimeline()
+    slot_dispatcher = dispatcher.SlotDispatcher(timeline)
+
+    started = time.perf_counter()
+    timeline.rebuild(schedules)
+    compiled = time.perf_counter() - started
+    slot_dispatcher._loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    slot_dispatcher._rebuild()
+    table = time.perf_counter() - started
+
+    wakeups = []
+    for k in range(rounds):
+        # Wake half a minute past an event minute, as the armed timer would
+        cursor = slot_dispatcher._minutes[k * 10] - 0.5
+        slot_dispatcher._cursor = cursor
+        slot_dispatcher._now_minute = lambda: cursor + 0.6
+        started = time.perf_counter()
+        slot_dispatcher._wake()
+        wakeups.append(time.perf_counter() - started)
+    slot_dispatcher.stop()
+
+    print(f"dispatcher: {len(slot_dispatcher._minutes)} event minutes per week")
+    print(f"  compile timeline      {ms(compiled)}")
+    print(f"  build minute table    {ms(table)}")
+    print(f"  wakeup                {ms(statistics.median(wakeups))}")
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--slots", type=int, default=1000, help="daily slots, one schedule each")
+    parser.add_argument("--rounds", type=int, default=20, help="timed repetitions (median reported)")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    schedules = [make_schedule(i) for i in range(args.slots)]
+    await bench_cron(schedules, args.rounds)
+    await bench_dispatcher(schedules, args.rounds)
+
+if __name__ == "__main__":
+    asyncio.run(main())
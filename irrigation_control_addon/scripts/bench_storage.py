@@ -0,0 +1,168 @@
+"""
+SQLite read and write throughput under concurrent API and scheduler load
+
+Usage (from irrigation_control_addon/):
+
+    python scripts/bench_storage.py [--seconds 5] [--readers 4] [--writers 2]
+
+Runs the same load twice, each in a fresh process and scratch directory:
+once with SQLite's defaults (rollback journal, synchronous=FULL, no mmap,
+2 MiB cache), as the add-on had before its storage profile, and once with
+the profile from the SQLITE_* settings. Readers serialize every schedule
+as GET /api/schedules does, writers add history rows as runs do, and one
+thread replaces APScheduler jobs in the jobstore as schedule edits do.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# SQLite's own defaults, expressed as the add-on's settings
+SQLITE_DEFAULTS = {
+    "SQLITE_JOURNAL_MODE": "DELETE",
+    "SQLITE_SYNCHRONOUS": "FULL",
+    "SQLITE_BUSY_TIMEOUT": "5000",  # what Python's sqlite3 module waits by default
+    "SQLITE_MMAP_SIZE": "0",
+    "SQLITE_CACHE_SIZE": "2000",
+}
+
+SCHEDULES = 50
+ZONES = 20
+
+def seed() -> None:
+    from datetime import time as dtime
+
+    from irrigation_control.core.database import SessionLocal, engine
+    from irrigation_control.models import schemas
+    from irrigation_control.models.database_models import Base
+    from irrigation_control.services.db_service import DatabaseService
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        service = DatabaseService(db)
+        for n in range(ZONES):
+            service.create_solenoid(schemas.SolenoidCreate(entity_id=f"switch.zone_{n}", name=f"Zone {n}"))
+        for n in range(SCHEDULES):
+            service.create_schedule(schemas.ScheduleCreate(
+                name=f"Schedule {n}", target_type="solenoid", target_id=1 + n % ZONES,
+                event_type="p1", priority=1,
+                time_slots=[
+                    schemas.TimeSlotCreate(days_of_week="MON,TUE", start_time=dtime(6, m), duration_minutes=10)
+                    for m in range(4)
+                ]
+            ))
+
+def run_load(seconds: float, readers: int, writers: int) -> dict:
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    from irrigation_control.core.database import SessionLocal, scheduler_engine
+    from irrigation_control.models import schemas
+    from irrigation_control.models.database_models import EventType
+    from irrigation_control.services.db_service import DatabaseService
+
+    counts = {"reads": 0, "writes": 0, "jobs": 0, "errors": 0}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def count(key: str) -> None:
+        with lock:
+            counts[key] += 1
+
+    def reader() -> None:
+        while time.monotonic() < stop_at:
+            try:
+                with SessionLocal() as db:
+                    [schemas.Schedule.model_validate(s) for s in DatabaseService(db).get_schedules()]
+                count("reads")
+            except Exception:
+                count("errors")
+
+    def writer() -> None:
+        while time.monotonic() < stop_at:
+            try:
+                with SessionLocal() as db:
+                    DatabaseService(db).add_history_entries(None, ["switch.zone_0"], "on", EventType.MANUAL)
+                count("writes")
+            except Exception:
+                count("errors")
+
+    scheduler = BackgroundScheduler(jobstores={"default": SQLAlchemyJobStore(engine=scheduler_engine)})
+    scheduler.start(paused=True)
+
+    def jobs() -> None:
+        n = 0
+        while time.monotonic() < stop_at:
+            try:
+                scheduler.add_job(print, "interval", hours=1, id=f"job_{n % 200}", replace_existing=True)
+                n += 1
+                count("jobs")
+            except Exception:
+                count("errors")
+
+    threads = (
+        [threading.Thread(target=reader) for _ in range(readers)]
+        + [threading.Thread(target=writer) for _ in range(writers)]
+        + [threading.Thread(target=jobs)]
+    )
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler.shutdown(wait=False)
+    return counts
+
+def child(args) -> None:
+    """One measurement, in a process whose settings were set by the parent"""
+    sys.path.insert(0, ADDON_DIR)
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    from irrigation_control.core.database import engine
+    seed()
+    with engine.connect() as connection:
+        journal = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+    counts = run_load(args.seconds, args.readers, args.writers)
+    rate = {key: counts[key] / args.seconds for key in ("reads", "writes", "jobs")}
+    print(
+        f"{args.profile:<8} journal={journal:<7} "
+        f"reads {rate['reads']:8.1f}/s   history writes {rate['writes']:8.1f}/s   "
+        f"job writes {rate['jobs']:8.1f}/s   errors {counts['errors']}"
+    )
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5.0, help="length of each run")
+    parser.add_argument("--readers", type=int, default=4, help="API reader threads")
+    parser.add_argument("--writers", type=int, default=2, help="history writer threads")
+    parser.add_argument("--profile", choices=["defaults", "tuned"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        child(args)
+        return
+
+    for profile in ("defaults", "tuned"):
+        data_dir = tempfile.mkdtemp(prefix=f"bench-storage-{profile}-")
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{data_dir}/irrigation_addon.db",
+            SCHEDULER_DB_URL=f"sqlite:///{data_dir}/apscheduler_jobs.sqlite",
+            RUN_JOURNAL_PATH=f"{data_dir}/run_journal.jsonl",
+        )
+        if profile == "defaults":
+            env.update(SQLITE_DEFAULTS)
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--profile", profile,
+             "--seconds", str(args.seconds), "--readers", str(args.readers),
+             "--writers", str(args.writers)],
+            env=env, check=True
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ADDON_DIR, "irrigation_control")
+
+# Settings are read when the app is imported, so point every path the add-on
+# writes under /data at a scratch directory first
+_data_dir = tempfile.mkdtemp(prefix="irrigation-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_data_dir}/irrigation_addon.db",
+    "SCHEDULER_DB_URL": f"sqlite:///{_data_dir}/apscheduler_jobs.sqlite",
+    "RUN_JOURNAL_PATH": f"{_data_dir}/run_journal.jsonl",
+    "SUPERVISOR_TOKEN": "test-token",
+    "HA_STATE_MIRROR_ENABLED": "false",
+})
+sys.path.insert(0, ADDON_DIR)
+# main mounts static/ and templates/ relative to the working directory, as
+# in the add-on image
+os.chdir(APP_DIR)
+
+from irrigation_control.core.database import engine  # noqa: E402
+from irrigation_control.models.database_models import Base  # noqa: E402
+
+@pytest.fixture
+def db_engine():
+    """Fresh tables for every test"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def app(db_engine):
+    from irrigation_control.main import app
+    return app
+
+@pytest.fixture
+def count_queries(db_engine):
+    """
+    Context manager counting the SQL statements run on the app's engine
+
+        with count_queries() as queries:
+            client.get("/api/schedules")
+        assert queries.count == 6
+    """
+    from irrigation_control.core.database import count_queries
+
+    return lambda: count_queries(db_engine)
+
+@pytest.fixture
+def runtime(db_engine, monkeypatch):
+    """
+    A fresh deadline wheel, admission controller state and run registry
+
+    The app-wide wheel binds to the first event loop it runs on, and each
+    test runs its own loop.
+    """
+    from irrigation_control.services import (
+        admission, arbiter, deadlines, run_journal, scheduler_service, sequential_engine
+    )
+    from irrigation_control.services.run_registry import run_registry
+
+    wheel = deadlines.DeadlineWheel()
+    wheel.add_expiry_listener(admission._on_deadline_expired)
+    for module in (admission, arbiter, deadlines, run_journal, scheduler_service, sequential_engine):
+        monkeypatch.setattr(module, "zone_deadlines", wheel)
+    admission.admission_controller._holders.clear()
+    admission.admission_controller._queue.clear()
+    with run_registry._lock:
+        run_registry._by_zone.clear()
+        run_registry._faults.clear()
+    yield wheel
+    admission.admission_controller._holders.clear()
+    admission.admission_controller._queue.clear()
+    with run_registry._lock:
+        run_registry._by_zone.clear()
@@ -0,0 +1,80 @@
+"""P1 runs pre-empting P2 runs on shared zones"""
+import asyncio
+from datetime import time
+
+from irrigation_control.models import database_models as models
+from irrigation_control.services.admission import admission_controller
+from irrigation_control.services.arbiter import run_arbiter
+from irrigation_control.services.scheduler_service import SchedulerService
+
+class FakeHomeAssistant:
+    def __init__(self):
+        self.calls = []
+
+    async def control_switches(self, entity_ids, action):
+        self.calls.extend((entity_id, action) for entity_id in entity_ids)
+        return {entity_id: {"success": True, "latency_ms": 0.0} for entity_id in entity_ids}
+
+def test_shared_zone_is_handed_to_p1_run_without_cycling(db_engine):
+    ha = FakeHomeAssistant()
+    service = SchedulerService(None, ha)
+
+    async def scenario():
+        await service.execute_watering_action(
+            "turn_on", ["switch.arb_a", "switch.arb_b"], 901, duration_minutes=10, event_type="p2"
+        )
+        ha.calls.clear()
+
+        await service.execute_watering_action(
+            "turn_on", ["switch.arb_b"], 902, duration_minutes=5, event_type="p1"
+        )
+        # Only the zone the P1 run does not water is closed; the shared zone
+        # stays open under the P1 run
+        assert ha.calls == [("switch.arb_a", "turn_off")]
+        assert admission_controller.holds("switch.arb_b", "schedule_902")
+        assert not admission_controller.holds("switch.arb_b", "schedule_901")
+
+        await service.execute_watering_action("turn_off", ["switch.arb_b"], 902)
+        await asyncio.sleep(0.05)  # the P2 run resumes in the background
+        assert admission_controller.holds("switch.arb_a", "schedule_901")
+        assert admission_controller.holds("switch.arb_b", "schedule_901")
+
+        run_arbiter.finish_run("schedule_901")
+        admission_controller.release_many(["switch.arb_a", "switch.arb_b"])
+
+    asyncio.run(scenario())
+
+def test_slots_run_now_stop_separately(runtime):
+    ha = FakeHomeAssistant()
+    service = SchedulerService(None, ha)
+    schedule = models.Schedule(
+        id=903, name="Lawn", target_type="solenoid", is_enabled=True,
+        event_type=models.EventType.P2, priority=0,
+        solenoid=models.SolenoidDevice(id=1, entity_id="switch.arb_m", is_active=True),
+        time_slots=[
+            models.ScheduleTimeSlot(id=1, start_time=time(6), duration_minutes=10, days_of_week="MON"),
+            models.ScheduleTimeSlot(id=2, start_time=time(18), duration_minutes=20, days_of_week="MON"),
+        ]
+    )
+
+    async def scenario():
+        assert await service.run_schedule_now(schedule)
+        await asyncio.sleep(0.05)
+        # Each slot is a run of its own holding the zone
+        assert admission_controller.holds("switch.arb_m", "schedule_903_slot_1")
+        assert admission_controller.holds("switch.arb_m", "schedule_903_slot_2")
+        assert round(runtime.remaining("stop:manual_903_1")) == 600
+        assert round(runtime.remaining("stop:manual_903_2")) == 1200
+
+        # The shorter slot ending leaves the zone open for the longer one
+        await runtime.get("stop:manual_903_1").callback()
+        assert ("switch.arb_m", "turn_off") not in ha.calls
+        assert admission_controller.holds("switch.arb_m", "schedule_903_slot_2")
+        assert run_arbiter.snapshot()["active_runs"] == 1
+
+        await runtime.get("stop:manual_903_2").callback()
+        assert ha.calls[-1] == ("switch.arb_m", "turn_off")
+        assert admission_controller.open_zones == 0
+        assert run_arbiter.snapshot()["active_runs"] == 0
+
+    asyncio.run(scenario())
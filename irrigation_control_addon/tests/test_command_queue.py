@@ -0,0 +1,211 @@
+"""Command queue workers, gates, retries and the circuit breaker"""
+import asyncio
+import time
+
+from irrigation_control.services.command_queue import CircuitBreaker, CommandQueue, CommandState
+
+class FakeSwitches:
+    """Attempt callable answering with queued outcomes, success by default"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    async def __call__(self, entity_ids):
+        self.calls.append(list(entity_ids))
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if outcome == "ok":
+            return {entity_id: {"success": True, "latency_ms": 0.0} for entity_id in entity_ids}
+        return {
+            entity_id: {"success": False, "latency_ms": None, "retryable": outcome == "retry"}
+            for entity_id in entity_ids
+        }
+
+async def wait_for(queue, command, timeout=1.0):
+    async def done():
+        while not command.done:
+            await asyncio.sleep(0.005)
+    await asyncio.wait_for(done(), timeout)
+    return command
+
+def make_queue(workers=2, max_retries=3, backoff=0.01, timeout=30.0, breaker=None):
+    return CommandQueue(
+        workers, max_retries, backoff, backoff, timeout, breaker or CircuitBreaker(5, 1.0)
+    )
+
+def test_waiting_gates_do_not_hold_workers():
+    queue = make_queue(workers=2)
+
+    async def scenario():
+        slot = asyncio.Event()
+
+        async def gate(entity_id):
+            await slot.wait()
+            return True
+
+        queue.start()
+        try:
+            switches = FakeSwitches()
+            # More turn-ons waiting for a slot than there are workers
+            waiting = [
+                queue.submit([f"switch.cq_{n}"], "turn_on", switches, gate) for n in range(4)
+            ]
+            await asyncio.sleep(0.02)
+            stop = queue.submit(["switch.cq_0"], "turn_off", switches)
+            await wait_for(queue, stop)
+            assert stop.state == CommandState.SUCCEEDED
+            assert switches.calls == [["switch.cq_0"]]
+
+            slot.set()
+            for command in waiting:
+                await wait_for(queue, command)
+            # The stop took over the zone; its turn-on is never sent
+            assert waiting[0].results["switch.cq_0"]["superseded"]
+            assert sorted(call[0] for call in switches.calls[1:]) == [
+                "switch.cq_1", "switch.cq_2", "switch.cq_3"
+            ]
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+def test_gates_opening_together_are_sent_together():
+    queue = make_queue()
+
+    async def scenario():
+        async def gate(entity_id):
+            return entity_id != "switch.cq_refused"
+
+        queue.start()
+        try:
+            switches = FakeSwitches()
+            command = queue.submit(
+                ["switch.cq_a", "switch.cq_refused", "switch.cq_b"], "turn_on", switches, gate
+            )
+            await wait_for(queue, command)
+            assert switches.calls == [["switch.cq_a", "switch.cq_b"]]
+            assert command.state == CommandState.FAILED
+            assert command.results["switch.cq_refused"]["admitted"] is False
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+def test_retryable_failures_are_retried():
+    queue = make_queue(max_retries=3)
+
+    async def scenario():
+        queue.start()
+        try:
+            switches = FakeSwitches("retry", "retry", "ok")
+            command = await wait_for(queue, queue.submit(["switch.cq_r"], "turn_on", switches))
+            assert command.state == CommandState.SUCCEEDED
+            assert command.attempts == 3
+            assert queue.retries == 2
+
+            switches = FakeSwitches("retry", "retry", "retry")
+            queue.max_retries = 1
+            command = await wait_for(queue, queue.submit(["switch.cq_r"], "turn_on", switches))
+            assert command.state == CommandState.FAILED
+            assert command.attempts == 2
+
+            # Not retried: the switch answered and refused
+            switches = FakeSwitches("fail")
+            command = await wait_for(queue, queue.submit(["switch.cq_r"], "turn_on", switches))
+            assert command.state == CommandState.FAILED
+            assert command.attempts == 1
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+def test_retry_past_timeout_expires():
+    queue = make_queue(backoff=0.1, timeout=0.05)
+
+    async def scenario():
+        queue.start()
+        try:
+            switches = FakeSwitches("retry")
+            command = await wait_for(queue, queue.submit(["switch.cq_e"], "turn_on", switches))
+            assert command.state == CommandState.EXPIRED
+            assert switches.calls == [["switch.cq_e"]]
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+def test_expired_command_gives_back_unsent_gates():
+    breaker = CircuitBreaker(1, 10.0)
+    queue = make_queue(timeout=0.05, breaker=breaker)
+    ungated = []
+
+    async def scenario():
+        async def gate(entity_id):
+            return True
+
+        breaker.record_failure()  # HA down: admitted zones are held back
+        queue.start()
+        try:
+            command = queue.submit(
+                ["switch.cq_g"], "turn_on", FakeSwitches(), gate, ungated.append
+            )
+            await asyncio.sleep(0.1)
+            breaker.record_success()
+            queue._queue.put_nowait(command)  # as the breaker's retry would
+            await wait_for(queue, command)
+            assert command.state == CommandState.EXPIRED
+            assert ungated == ["switch.cq_g"]
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
+
+def test_breaker_opens_and_closes():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 1
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    # One trial command after the reset timeout
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+def test_open_breaker_holds_commands():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.1)
+    queue = make_queue(max_retries=5, breaker=breaker)
+
+    async def scenario():
+        queue.start()
+        try:
+            switches = FakeSwitches("retry")
+            failing = queue.submit(["switch.cq_b1"], "turn_on", switches)
+            await asyncio.sleep(0.03)
+            assert breaker.state == "open"
+
+            held = queue.submit(["switch.cq_b2"], "turn_on", switches)
+            await asyncio.sleep(0.03)
+            assert not held.done and held.error == "Waiting for Home Assistant"
+            assert switches.calls == [["switch.cq_b1"]]
+
+            # The trial after the reset timeout succeeds and closes the breaker
+            await wait_for(queue, failing)
+            await wait_for(queue, held)
+            assert failing.state == held.state == CommandState.SUCCEEDED
+            assert breaker.state == "closed"
+        finally:
+            await queue.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,140 @@
+"""Command layer sending only the switch transitions zones need"""
+import asyncio
+
+import pytest
+
+from irrigation_control.services import commands
+from irrigation_control.services.admission import admission_controller
+from irrigation_control.services.commands import CommandLayer
+
+class FakeHomeAssistant:
+    def __init__(self, success=True):
+        self.calls = []
+        self.success = success
+        self.gate = None  # set to an asyncio.Event to hold commands in flight
+
+    async def control_switches(self, entity_ids, action):
+        self.calls.append((list(entity_ids), action))
+        if self.gate is not None:
+            await self.gate.wait()
+        return {entity_id: {"success": self.success, "latency_ms": 1.0} for entity_id in entity_ids}
+
+class FakeMirror:
+    def __init__(self, states):
+        self.states = states
+        self.is_synced = True
+
+    def get(self, entity_id):
+        return {"entity_id": entity_id, "state": self.states[entity_id]}
+
+@pytest.fixture(autouse=True)
+def no_mirror(monkeypatch):
+    monkeypatch.setattr(commands, "get_state_mirror", lambda: None)
+
+def test_repeats_within_the_window_are_coalesced(monkeypatch):
+    layer = CommandLayer(window=0.05)
+    ha = FakeHomeAssistant()
+
+    async def scenario():
+        await layer.switch(ha, ["switch.cl_a", "switch.cl_b"], "turn_on")
+        results = await layer.switch(ha, ["switch.cl_a", "switch.cl_a"], "turn_on")
+        assert results == {"switch.cl_a": {"success": True, "latency_ms": 0.0, "suppressed": "coalesced"}}
+        # A different action is a real transition
+        await layer.switch(ha, ["switch.cl_b"], "turn_off")
+        assert ha.calls == [(["switch.cl_a", "switch.cl_b"], "turn_on"), (["switch.cl_b"], "turn_off")]
+
+        # Past the window, only the mirrored state can show a repeat is redundant
+        await asyncio.sleep(0.06)
+        await layer.switch(ha, ["switch.cl_a"], "turn_on")
+        assert ha.calls[-1] == (["switch.cl_a"], "turn_on")
+
+        await asyncio.sleep(0.06)
+        mirror = FakeMirror({"switch.cl_a": "on"})
+        monkeypatch.setattr(commands, "get_state_mirror", lambda: mirror)
+        results = await layer.switch(ha, ["switch.cl_a"], "turn_on")
+        assert results["switch.cl_a"]["suppressed"] == "redundant"
+        # Switched off behind our back: sent again
+        mirror.states["switch.cl_a"] = "off"
+        await layer.switch(ha, ["switch.cl_a"], "turn_on")
+        assert len(ha.calls) == 4
+
+        assert layer.snapshot() == {
+            "sent": 5, "suppressed": {"coalesced": 1, "redundant": 1}, "suppressed_total": 2
+        }
+
+    asyncio.run(scenario())
+
+def test_identical_commands_share_the_call_in_flight():
+    layer = CommandLayer()
+    ha = FakeHomeAssistant()
+
+    async def scenario():
+        ha.gate = asyncio.Event()
+        first = asyncio.ensure_future(layer.switch(ha, ["switch.cl_c"], "turn_on"))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(layer.switch(ha, ["switch.cl_c", "switch.cl_d"], "turn_on"))
+        await asyncio.sleep(0)
+        ha.gate.set()
+        first, second = await first, await second
+
+        assert ha.calls == [(["switch.cl_c"], "turn_on"), (["switch.cl_d"], "turn_on")]
+        assert first["switch.cl_c"] == {"success": True, "latency_ms": 1.0, "suppressed": None}
+        assert second["switch.cl_c"] == {"success": True, "latency_ms": 1.0, "suppressed": "coalesced"}
+        assert second["switch.cl_d"]["suppressed"] is None
+
+    asyncio.run(scenario())
+
+def test_failed_or_cancelled_call_fails_its_waiters_and_is_not_remembered():
+    layer = CommandLayer()
+    ha = FakeHomeAssistant(success=False)
+
+    async def scenario():
+        ha.gate = asyncio.Event()
+        first = asyncio.ensure_future(layer.switch(ha, ["switch.cl_e"], "turn_on"))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(layer.switch(ha, ["switch.cl_e"], "turn_on"))
+        await asyncio.sleep(0)
+        ha.gate.set()
+        assert not (await first)["switch.cl_e"]["success"]
+        assert not (await waiter)["switch.cl_e"]["success"]
+
+        # Nothing was switched, so the next attempt is sent
+        ha.success, ha.gate = True, asyncio.Event()
+        first = asyncio.ensure_future(layer.switch(ha, ["switch.cl_e"], "turn_on"))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(layer.switch(ha, ["switch.cl_e"], "turn_on"))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert not (await waiter)["switch.cl_e"]["success"]
+        assert ("switch.cl_e", "turn_on") not in layer._inflight
+        assert len(ha.calls) == 2
+
+    asyncio.run(scenario())
+
+def test_turn_off_is_held_back_while_another_owner_needs_the_zone(runtime):
+    layer = CommandLayer()
+    layer.set_demand_source(admission_controller.demand)
+    ha = FakeHomeAssistant()
+
+    async def scenario():
+        assert admission_controller.try_acquire("switch.cl_f", "schedule_1")
+        assert admission_controller.try_acquire("switch.cl_f", "schedule_2")
+        await layer.switch(ha, ["switch.cl_f"], "turn_on", owner="schedule_1")
+
+        # schedule_1 ends while schedule_2 still holds the zone
+        admission_controller.release("switch.cl_f", "schedule_1")
+        results = await layer.switch(ha, ["switch.cl_f"], "turn_off", owner="schedule_1")
+        assert results["switch.cl_f"]["suppressed"] == "in_use"
+
+        # The owner's own hold does not keep the zone on
+        results = await layer.switch(ha, ["switch.cl_f"], "turn_off", owner="schedule_2")
+        assert results["switch.cl_f"]["suppressed"] is None
+        assert ha.calls == [(["switch.cl_f"], "turn_on"), (["switch.cl_f"], "turn_off")]
+
+        # A cut-off is forced through whoever holds the zone
+        await layer.switch(ha, ["switch.cl_f"], "turn_off", force=True)
+        assert len(ha.calls) == 3
+        assert layer.suppressed["in_use"] == 1
+        admission_controller.release("switch.cl_f")
+
+    asyncio.run(scenario())
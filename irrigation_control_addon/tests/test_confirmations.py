@@ -0,0 +1,125 @@
+"""Confirming switch commands from state_changed events"""
+import asyncio
+
+from sqlalchemy import select
+
+from irrigation_control.core.database import SessionLocal
+from irrigation_control.core.metrics import LatencyHistogram
+from irrigation_control.models import database_models as models
+from irrigation_control.services import confirmations
+from irrigation_control.services.confirmations import SwitchConfirmations
+from irrigation_control.services.run_registry import run_registry
+
+class FakeMirror:
+    def __init__(self, states=None, synced=True):
+        self.states = states or {}
+        self.is_synced = synced
+
+    def get(self, entity_id):
+        state = self.states.get(entity_id)
+        return {"entity_id": entity_id, "state": state} if state is not None else None
+
+def test_state_change_confirms_the_command(runtime, monkeypatch):
+    mirror = FakeMirror({"switch.cf_a": "off"})
+    monkeypatch.setattr(confirmations, "get_state_mirror", lambda: mirror)
+    tracker = SwitchConfirmations(timeout=1.0)
+
+    async def scenario():
+        run_registry.fault("switch.cf_a", "on", "Switch did not report 'on'")
+        future = tracker.expect("switch.cf_a", "on", owner="manual")
+        tracker.on_state_changed("switch.cf_a", {"state": "off"})
+        assert not future.done()
+        tracker.on_state_changed("switch.cf_a", {"state": "on"})
+        assert await future is True
+        assert tracker.confirmed == 1 and tracker.latency.count == 1
+        assert run_registry.faults() == []
+
+        # Already in the expected state: confirmed without an event
+        mirror.states["switch.cf_a"] = "on"
+        assert await tracker.expect("switch.cf_a", "on") is True
+        assert tracker.snapshot()["pending"] == 0
+
+    asyncio.run(scenario())
+
+def test_withdrawn_and_replaced_expectations_resolve_false(runtime, monkeypatch):
+    mirror = FakeMirror({"switch.cf_b": "off"})
+    monkeypatch.setattr(confirmations, "get_state_mirror", lambda: mirror)
+    tracker = SwitchConfirmations(timeout=0.05)
+
+    async def scenario():
+        withdrawn = tracker.expect("switch.cf_b", "on")
+        tracker.withdraw("switch.cf_b")
+        assert await withdrawn is False
+
+        replaced = tracker.expect("switch.cf_b", "on")
+        latest = tracker.expect("switch.cf_b", "on")
+        assert await replaced is False
+        tracker.on_state_changed("switch.cf_b", {"state": "on"})
+        assert await latest is True
+
+        await asyncio.sleep(0.1)
+        # Neither old expectation times out later
+        assert tracker.timeouts == 0 and tracker.confirmed == 1
+
+    asyncio.run(scenario())
+
+def test_unconfirmed_command_is_a_fault_with_a_history_row(runtime, monkeypatch):
+    mirror = FakeMirror({"switch.cf_c": "off", "switch.cf_d": "off"})
+    monkeypatch.setattr(confirmations, "get_state_mirror", lambda: mirror)
+    tracker = SwitchConfirmations(timeout=0.05)
+    with SessionLocal() as db:
+        solenoid = models.SolenoidDevice(entity_id="switch.cf_c", name="Beds")
+        db.add(solenoid)
+        db.flush()
+        schedule = models.Schedule(
+            name="Beds", target_type="solenoid", solenoid_id=solenoid.id,
+            event_type=models.EventType.P1
+        )
+        db.add(schedule)
+        db.commit()
+        schedule_id, solenoid_id = schedule.id, solenoid.id
+
+    async def scenario():
+        run_registry.started("switch.cf_c", f"schedule_{schedule_id}", "schedule", schedule_id)
+        stuck = tracker.expect("switch.cf_c", "on", owner=f"schedule_{schedule_id}")
+        # A resync brings the expected state without an event
+        resynced = tracker.expect("switch.cf_d", "on")
+        mirror.states["switch.cf_d"] = "on"
+
+        assert await stuck is False
+        assert await resynced is True
+        await asyncio.gather(*tracker._tasks)
+
+        assert tracker.timeouts == 1 and tracker.confirmed == 1
+        assert [fault["entity_id"] for fault in run_registry.faults()] == ["switch.cf_c"]
+        assert run_registry.active()[0]["fault"].startswith("Switch did not report 'on'")
+        with SessionLocal() as db:
+            row = db.execute(select(models.ScheduleHistory)).scalar_one()
+        assert (row.schedule_id, row.solenoid_id, row.status) == (schedule_id, solenoid_id, "error")
+        assert row.event_type == models.EventType.P1
+
+    asyncio.run(scenario())
+
+def test_nothing_is_expected_without_a_synced_mirror(monkeypatch):
+    monkeypatch.setattr(confirmations, "get_state_mirror", lambda: FakeMirror(synced=False))
+    tracker = SwitchConfirmations(timeout=1.0)
+    assert tracker.expect("switch.cf_e", "on") is None
+    assert tracker.unverified == 1
+
+def test_histogram_buckets_and_percentiles():
+    histogram = LatencyHistogram(bounds=(0.1, 0.5, 1.0))
+    assert histogram.percentile(0.5) is None
+    for seconds in (0.05, 0.1, 0.2, 0.3, 0.4, 0.6, 0.7, 0.8, 0.9, 3.0):
+        histogram.record(seconds)
+
+    # Bounds are inclusive upper limits
+    assert histogram.counts == [2, 3, 4, 1]
+    assert histogram.percentile(0.2) == 0.1
+    assert histogram.percentile(0.5) == 0.5
+    assert histogram.percentile(0.9) == 1.0
+    assert histogram.percentile(0.99) == float("inf")
+
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == {"le_100ms": 2, "le_500ms": 3, "le_1000ms": 4, "inf": 1}
+    assert snapshot["count"] == 10 and snapshot["avg_ms"] == 705.0
+    assert snapshot["p50_ms"] == 500.0 and snapshot["p99_ms"] is None
@@ -0,0 +1,151 @@
+"""Hashed timing wheel for zone stops and safety cut-offs"""
+import asyncio
+import time
+
+from sqlalchemy import select
+
+from irrigation_control.core.database import SessionLocal
+from irrigation_control.models.database_models import ZoneDeadline
+from irrigation_control.services import deadlines
+from irrigation_control.services.admission import admission_controller
+from irrigation_control.services.deadlines import DeadlineWheel
+
+class FakeHomeAssistant:
+    def __init__(self):
+        self.calls = []
+
+    async def control_switches(self, entity_ids, action):
+        self.calls.extend((entity_id, action) for entity_id in entity_ids)
+        return {entity_id: {"success": True, "latency_ms": 0.0} for entity_id in entity_ids}
+
+def checkpointed():
+    with SessionLocal() as db:
+        return {row.key: row for row in db.execute(select(ZoneDeadline)).scalars()}
+
+def test_deadlines_past_a_full_turn_carry_rounds(db_engine):
+    wheel = DeadlineWheel(resolution=1.0, size=512)
+
+    async def scenario():
+        soon = wheel.schedule("stop:soon", 10, ["switch.dl_a"])
+        late = wheel.schedule("stop:late", 600, ["switch.dl_a"])
+        later = wheel.schedule("stop:later", 1100, ["switch.dl_a"])
+        assert soon.rounds == 0
+        assert late.rounds == 1
+        assert later.rounds == 2
+        # Expires on the first tick at or after 600 s from now
+        assert late.bucket in ((wheel._tick + 600) % 512, (wheel._tick + 601) % 512)
+        assert round(wheel.remaining("stop:late")) == 600
+        await wheel.stop()
+
+    asyncio.run(scenario())
+
+def test_deadlines_fire_in_order_across_rounds(db_engine):
+    # 8 buckets of 10 ms: 150 ms and 300 ms go round the wheel 1 and 3 times
+    wheel = DeadlineWheel(resolution=0.01, size=8)
+    fired = []
+
+    async def scenario():
+        started = time.time()
+        for key, delay in (("stop:c", 0.3), ("stop:a", 0.03), ("stop:b", 0.15)):
+            wheel.schedule(
+                key, delay, ["switch.dl_b"],
+                callback=lambda key=key: fired.append((key, time.time() - started))
+            )
+        await asyncio.sleep(0.4)
+        assert [key for key, _ in fired] == ["stop:a", "stop:b", "stop:c"]
+        for (_, at), due in zip(fired, (0.03, 0.15, 0.3)):
+            assert due - 0.005 <= at <= due + 0.05
+        assert len(wheel) == 0 and wheel.expired == 3
+        await wheel.stop()
+
+    asyncio.run(scenario())
+
+def test_cancel_and_extend(db_engine):
+    wheel = DeadlineWheel(resolution=0.01, size=8)
+    fired = []
+
+    async def scenario():
+        wheel.schedule("stop:cancelled", 0.05, ["switch.dl_c"], callback=lambda: fired.append("cancelled"))
+        wheel.schedule("stop:extended", 0.05, ["switch.dl_c"], callback=lambda: fired.append("extended"))
+        assert wheel.cancel("stop:cancelled")
+        assert not wheel.cancel("stop:cancelled")
+        assert wheel.extend("stop:extended", 0.1)
+        assert "stop:cancelled" not in wheel
+
+        await asyncio.sleep(0.1)
+        assert fired == []
+        await asyncio.sleep(0.1)
+        assert fired == ["extended"]
+        await wheel.stop()
+
+    asyncio.run(scenario())
+
+def test_changes_are_checkpointed_in_one_batch(db_engine, monkeypatch):
+    monkeypatch.setattr(deadlines, "CHECKPOINT_INTERVAL", 0.02)
+    wheel = DeadlineWheel()
+    writes = []
+    write = wheel._write
+    monkeypatch.setattr(wheel, "_write", lambda batch: (writes.append(dict(batch)), write(batch)))
+
+    async def scenario():
+        wheel.schedule("stop:kept", 600, ["switch.dl_d", "switch.dl_e"], owner="schedule_1")
+        wheel.schedule("stop:dropped", 600, ["switch.dl_d"], owner="schedule_2")
+        wheel.cancel("stop:dropped")
+        assert checkpointed() == {}
+
+        await asyncio.sleep(0.1)
+        assert len(writes) == 1
+        rows = checkpointed()
+        assert list(rows) == ["stop:kept"]
+        assert rows["stop:kept"].entity_ids == "switch.dl_d,switch.dl_e"
+        assert rows["stop:kept"].owner == "schedule_1"
+
+        # Pending changes are written on shutdown
+        wheel.cancel("stop:kept")
+        await wheel.stop()
+        assert checkpointed() == {}
+
+    asyncio.run(scenario())
+
+def test_restored_cutoff_closes_the_zone_for_every_owner(runtime):
+    now = time.time()
+    with SessionLocal() as db:
+        db.add_all([
+            ZoneDeadline(
+                key="stop:schedule_1", kind="stop", entity_ids="switch.dl_f",
+                owner="schedule_1", due_at=now - 5
+            ),
+            ZoneDeadline(
+                key="cutoff:switch.dl_g", kind="cutoff", entity_ids="switch.dl_g",
+                owner=None, due_at=now - 5
+            ),
+            ZoneDeadline(
+                key="stop:schedule_9", kind="stop", entity_ids="switch.dl_h",
+                owner="schedule_9", due_at=now + 600
+            ),
+        ])
+        db.commit()
+    ha = FakeHomeAssistant()
+
+    async def scenario():
+        runtime.start(ha)
+        assert round(runtime.remaining("stop:schedule_9")) == 600
+        # Zones re-admitted after the restart keep the restored cut-off
+        for entity_id, owner in (
+            ("switch.dl_f", "schedule_1"), ("switch.dl_f", "schedule_2"),
+            ("switch.dl_g", "schedule_3"), ("switch.dl_g", "schedule_4"),
+        ):
+            assert admission_controller.try_acquire(entity_id, owner)
+        assert runtime.get("cutoff:switch.dl_g").due_at == now - 5
+
+        await asyncio.sleep(1.2)
+        # The stop leaves a zone another owner still holds on; the cut-off
+        # closes its zone whoever holds it
+        assert ha.calls == [("switch.dl_g", "turn_off")]
+        assert admission_controller.holds("switch.dl_f", "schedule_2")
+        assert not admission_controller.holds("switch.dl_f", "schedule_1")
+        assert admission_controller.demand("switch.dl_g") == 0
+        assert runtime.cutoffs == 1
+        await runtime.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,70 @@
+"""One timer dispatching every slot start and stop"""
+import asyncio
+
+from irrigation_control.services import dispatcher
+from irrigation_control.services.dispatcher import SlotDispatcher
+from irrigation_control.services.timeline import MINUTES_PER_WEEK, ScheduleTimeline
+
+def make_dispatcher(monkeypatch, events):
+    """A dispatcher on a fixed event table, with a clock the test sets"""
+    fired = []
+
+    async def run_slot_job(schedule_id, slot_id, action):
+        fired.append((schedule_id, slot_id, action))
+
+    monkeypatch.setattr(dispatcher, "run_slot_job", run_slot_job)
+    slots = SlotDispatcher(ScheduleTimeline())
+    clock = [0.0]
+    slots._now_minute = lambda: clock[0]
+    slots._rebuild = lambda: None
+    slots._events = events
+    slots._minutes = sorted(events)
+    return slots, clock, fired
+
+def test_wakeup_dispatches_events_since_the_last(monkeypatch):
+    slots, clock, fired = make_dispatcher(monkeypatch, {
+        100: [(1, 10, "start")], 130: [(1, 10, "stop")],
+        MINUTES_PER_WEEK - 1: [(2, 20, "start")], 2: [(2, 20, "stop")],
+    })
+
+    async def scenario():
+        clock[0] = 99.5
+        slots.start()
+        clock[0] = 100.2
+        slots._wake()
+        # Sunday night into Monday morning is a minute or two, not a week
+        clock[0] = MINUTES_PER_WEEK - 1.5
+        slots._cursor = clock[0]
+        clock[0] = 2.5
+        slots._wake()
+        await asyncio.sleep(0)
+        assert fired == [(1, 10, "start"), (2, 20, "start"), (2, 20, "stop")]
+        assert slots.misfires == 0
+        slots.stop()
+
+    asyncio.run(scenario())
+
+def test_clock_going_back_is_not_a_week_of_misfires(monkeypatch):
+    slots, clock, fired = make_dispatcher(monkeypatch, {
+        100: [(1, 10, "start")], 160: [(1, 10, "stop")], 5000: [(2, 20, "start")],
+    })
+
+    async def scenario():
+        clock[0] = 130.0
+        slots.start()
+        # Set back an hour, e.g. at the end of summer time
+        clock[0] = 70.0
+        slots._wake()
+        assert slots.clock_changes == 1
+        assert slots.misfires == 0 and fired == []
+        assert slots._cursor == 70.0
+
+        # Events are dispatched from the new time on
+        clock[0] = 100.5
+        slots._wake()
+        await asyncio.sleep(0)
+        assert fired == [(1, 10, "start")]
+        assert slots.misfires == 0
+        slots.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+"""Request handlers keep serving while a Home Assistant call is stalled"""
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from irrigation_control.core.config import settings
+from irrigation_control.core.container import container
+from irrigation_control.core.database import SessionLocal
+from irrigation_control.models import schemas
+from irrigation_control.services.db_service import DatabaseService
+from irrigation_control.services import ha_service
+from irrigation_control.services.ha_service import HomeAssistantService
+
+class StalledHomeAssistant:
+    """Local fake of HA core whose GET /api/states hangs until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.stalled = threading.Event()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.stalled.set()
+                fake.release.wait(10)
+                body = b'[{"entity_id": "switch.zone_1", "attributes": {"friendly_name": "Zone 1"}}]'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stalled_ha(monkeypatch):
+    with StalledHomeAssistant() as fake:
+        monkeypatch.setattr(settings, "CORE_URL", fake.url)
+        monkeypatch.setattr(ha_service, "_http_client", None)
+        monkeypatch.setattr(container, "ha_service", HomeAssistantService("test-token"))
+        yield fake
+
+def test_requests_served_while_ha_call_stalled(app, stalled_ha):
+    with SessionLocal() as db:
+        DatabaseService(db).create_solenoid(
+            schemas.SolenoidCreate(entity_id="switch.zone_1", name="Zone 1")
+        )
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            stalled = asyncio.ensure_future(client.get("/api/ha-switches"))
+            while not stalled_ha.stalled.is_set():
+                await asyncio.sleep(0.01)
+
+            created = await client.post(
+                "/api/groups", json={"name": "Front lawn", "solenoid_ids": [1]}
+            )
+            assert created.status_code == 200
+            responses = await asyncio.wait_for(asyncio.gather(*(
+                client.get(path)
+                for path in ["/api/solenoids", "/api/groups", "/api/schedules"] * 5
+            )), timeout=5)
+            assert all(response.status_code == 200 for response in responses)
+            assert not stalled.done()
+
+            stalled_ha.release.set()
+            response = await asyncio.wait_for(stalled, timeout=5)
+            assert response.json() == [{"entity_id": "switch.zone_1", "name": "Zone 1"}]
+        await ha_service.close_http_client()
+
+    asyncio.run(scenario())
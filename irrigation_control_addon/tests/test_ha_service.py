@@ -0,0 +1,82 @@
+"""Batched switch commands and the per-entity fallback"""
+import asyncio
+
+from irrigation_control.core.config import settings
+from irrigation_control.services import ha_service
+from irrigation_control.services.ha_service import HomeAssistantAPIError, HomeAssistantService
+
+class FakeCore:
+    """Stands in for _make_request, failing the calls it is told to"""
+
+    def __init__(self, fail=None, delay=0.0):
+        self.calls = []
+        self.fail = fail or {}  # entity_id, or "batch", -> HTTP status
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, method, endpoint, json_data=None, metric=None):
+        entity_ids = json_data["entity_id"]
+        self.calls.append((endpoint, entity_ids))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        status = self.fail.get("batch" if isinstance(entity_ids, list) else entity_ids)
+        if status is not None:
+            raise HomeAssistantAPIError(f"Failed to {method} {endpoint}", status)
+        return {}
+
+def make_service(monkeypatch, core):
+    service = HomeAssistantService("test-token")
+    monkeypatch.setattr(service, "_make_request", core)
+    return service
+
+def test_switches_go_in_one_batch_except_unbatched_prefixes(monkeypatch):
+    monkeypatch.setattr(settings, "HA_UNBATCHED_PREFIXES", ["switch.legacy_"])
+    core = FakeCore()
+    service = make_service(monkeypatch, core)
+
+    results = asyncio.run(service.control_switches(
+        ["switch.ha_a", "switch.legacy_1", "switch.ha_b"], "turn_on"
+    ))
+    assert core.calls == [
+        ("/api/services/switch/turn_on", ["switch.ha_a", "switch.ha_b"]),
+        ("/api/services/switch/turn_on", "switch.legacy_1"),
+    ]
+    assert all(result["success"] for result in results.values())
+    assert set(results) == {"switch.ha_a", "switch.legacy_1", "switch.ha_b"}
+
+def test_failed_batch_falls_back_to_one_call_per_entity(monkeypatch):
+    monkeypatch.setattr(settings, "HA_UNBATCHED_PREFIXES", [])
+    core = FakeCore(fail={"batch": 500, "switch.ha_gone": 404, "switch.ha_busy": 503})
+    service = make_service(monkeypatch, core)
+
+    results = asyncio.run(service.control_switches(
+        ["switch.ha_a", "switch.ha_gone", "switch.ha_busy"], "turn_off"
+    ))
+    assert [entity_ids for _, entity_ids in core.calls] == [
+        ["switch.ha_a", "switch.ha_gone", "switch.ha_busy"],
+        "switch.ha_a", "switch.ha_gone", "switch.ha_busy",
+    ]
+    assert results["switch.ha_a"]["success"]
+    assert results["switch.ha_gone"] == {
+        "success": False, "retryable": False, "latency_ms": results["switch.ha_gone"]["latency_ms"]
+    }
+    assert results["switch.ha_busy"]["retryable"] is True
+
+def test_per_entity_calls_are_bounded_on_each_loop(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONCURRENT_ZONES", 2)
+    monkeypatch.setattr(ha_service, "_command_semaphore", None)
+    entity_ids = [f"switch.ha_{n}" for n in range(5)]
+
+    # The semaphore is made on the loop that uses it, so a second loop
+    # gets one of its own
+    for _ in range(2):
+        core = FakeCore(delay=0.01)
+        service = make_service(monkeypatch, core)
+        results = asyncio.run(service.fan_out_switches(entity_ids, "turn_on"))
+        assert len(core.calls) == 5 and all(r["success"] for r in results.values())
+        assert core.max_in_flight == 2
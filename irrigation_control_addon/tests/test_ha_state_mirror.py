@@ -0,0 +1,216 @@
+"""State mirror against a local fake Home Assistant WebSocket API"""
+import asyncio
+import json
+
+import httpx
+import pytest
+import websockets
+
+from irrigation_control.core.config import settings
+from irrigation_control.services import ha_service
+from irrigation_control.services.ha_service import HomeAssistantService
+from irrigation_control.services.ha_state_mirror import HAStateMirror
+
+TOKEN = "test-token"
+
+def state(entity_id, value, updated="2024-01-01T00:00:00+00:00"):
+    return {"entity_id": entity_id, "state": value, "last_updated": updated, "attributes": {}}
+
+class FakeHomeAssistant:
+    """WebSocket API plus REST /api/states, with connections that can be dropped"""
+
+    def __init__(self):
+        self.states = [state("switch.zone_1", "off"), state("switch.zone_2", "off")]
+        self.registry = [{"entity_id": "switch.zone_1", "platform": "zwave_js"}]
+        self.tokens = []
+        self.attempts = []  # loop time of every connection
+        self.accepting = True
+        self.rest_failures = 0  # REST calls to fail before answering
+        self.rest_calls = 0
+        self.connections = []
+        self.subscriptions = {}  # connection -> state_changed subscription id
+        self.subscribed = asyncio.Event()
+
+    def rest(self, request: httpx.Request) -> httpx.Response:
+        assert request.url.path.endswith("/api/states")
+        self.rest_calls += 1
+        if self.rest_failures:
+            self.rest_failures -= 1
+            return httpx.Response(502)
+        return httpx.Response(200, json=self.states)
+
+    async def handler(self, ws) -> None:
+        self.attempts.append(asyncio.get_running_loop().time())
+        await ws.send(json.dumps({"type": "auth_required"}))
+        auth = json.loads(await ws.recv())
+        self.tokens.append(auth.get("access_token"))
+        if auth.get("access_token") != TOKEN or not self.accepting:
+            await ws.send(json.dumps({"type": "auth_invalid", "message": "Invalid access token"}))
+            return
+        await ws.send(json.dumps({"type": "auth_ok"}))
+        self.connections.append(ws)
+        async for raw in ws:
+            message = json.loads(raw)
+            if message["type"] == "subscribe_events":
+                assert message["event_type"] == "state_changed"
+                self.subscriptions[ws] = message["id"]
+                await ws.send(json.dumps({"id": message["id"], "type": "result", "success": True}))
+                self.subscribed.set()
+            elif message["type"] == "config/entity_registry/list":
+                await ws.send(json.dumps({
+                    "id": message["id"], "type": "result", "success": True, "result": self.registry
+                }))
+
+    async def state_changed(self, entity_id, new_state) -> None:
+        ws = self.connections[-1]
+        await ws.send(json.dumps({
+            "id": self.subscriptions[ws],
+            "type": "event",
+            "event": {"event_type": "state_changed", "data": {"entity_id": entity_id, "new_state": new_state}},
+        }))
+
+    async def drop(self) -> None:
+        self.subscribed.clear()
+        await self.connections[-1].close()
+
+async def wait_until(predicate, timeout=2.0) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+@pytest.fixture(autouse=True)
+def fast_reconnect(monkeypatch):
+    monkeypatch.setattr(settings, "HA_WS_RECONNECT_MIN", 0.01)
+    monkeypatch.setattr(settings, "HA_WS_RECONNECT_MAX", 0.05)
+
+def run_mirror(scenario, token=TOKEN):
+    """Run `scenario(fake, mirror)` with a mirror connected to a fresh fake"""
+    async def main():
+        fake = FakeHomeAssistant()
+        ha_service._http_client = httpx.AsyncClient(
+            base_url="http://fake/core", transport=httpx.MockTransport(fake.rest)
+        )
+        async with websockets.serve(fake.handler, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            mirror = HAStateMirror(HomeAssistantService(token), ws_url=f"ws://127.0.0.1:{port}")
+            mirror.start()
+            try:
+                await scenario(fake, mirror)
+            finally:
+                await mirror.stop()
+                await ha_service.close_http_client()
+
+    asyncio.run(main())
+
+def test_authenticates_and_syncs_from_rest():
+    async def scenario(fake, mirror):
+        await wait_until(lambda: mirror.is_synced)
+        assert fake.tokens == [TOKEN]
+        assert fake.rest_calls == 1
+        assert mirror.get("switch.zone_1")["state"] == "off"
+        assert len(mirror.get_domain("switch")) == 2
+        await wait_until(lambda: mirror.get_integration("switch.zone_1") == "zwave_js")
+
+    run_mirror(scenario)
+
+def test_rejected_token_never_syncs():
+    async def scenario(fake, mirror):
+        await wait_until(lambda: len(fake.tokens) >= 2)  # keeps retrying
+        assert not mirror.is_synced
+        assert fake.rest_calls == 0
+        assert mirror.get("switch.zone_1") is None
+
+    run_mirror(scenario, token="wrong")
+
+def test_reconnects_back_off_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(settings, "HA_WS_RECONNECT_MIN", 0.02)
+    monkeypatch.setattr(settings, "HA_WS_RECONNECT_MAX", 0.08)
+
+    async def scenario(fake, mirror):
+        await wait_until(lambda: len(fake.attempts) >= 6)
+        gaps = [later - earlier for earlier, later in zip(fake.attempts, fake.attempts[1:])]
+        # 0.02, 0.04, 0.08, then capped at 0.08
+        assert 0.02 <= gaps[0] < 0.04
+        assert 0.04 <= gaps[1] < 0.08
+        for gap in gaps[2:5]:
+            assert 0.08 <= gap < 0.12
+
+    run_mirror(scenario, token="wrong")
+
+def test_state_changed_events_update_index_and_listeners():
+    async def scenario(fake, mirror):
+        seen = []
+        mirror.add_state_listener(lambda entity_id, new_state: seen.append((entity_id, new_state["state"])))
+        await fake.subscribed.wait()
+        await wait_until(lambda: mirror.is_synced)
+
+        await fake.state_changed("switch.zone_1", state("switch.zone_1", "on", "2024-01-01T00:00:05+00:00"))
+        await wait_until(lambda: mirror.get("switch.zone_1")["state"] == "on")
+        assert seen == [("switch.zone_1", "on")]
+
+        # An event older than the mirrored state does not roll it back
+        await fake.state_changed("switch.zone_1", state("switch.zone_1", "off", "2024-01-01T00:00:01+00:00"))
+        await fake.state_changed("switch.zone_3", state("switch.zone_3", "on"))
+        await wait_until(lambda: mirror.get("switch.zone_3") is not None)
+        assert mirror.get("switch.zone_1")["state"] == "on"
+
+        # Removed entities leave the index
+        await fake.state_changed("switch.zone_2", None)
+        await wait_until(lambda: mirror.get("switch.zone_2") is None)
+        assert {s["entity_id"] for s in mirror.get_domain("switch")} == {"switch.zone_1", "switch.zone_3"}
+
+    run_mirror(scenario)
+
+def test_reconnect_resyncs_from_rest():
+    async def scenario(fake, mirror):
+        await fake.subscribed.wait()
+        await wait_until(lambda: mirror.is_synced)
+
+        # Changes made while the socket is down reach the mirror only through
+        # the REST resync on reconnect
+        fake.states = [state("switch.zone_1", "on", "2024-01-01T00:01:00+00:00"), state("switch.zone_4", "off")]
+        await fake.drop()
+        await wait_until(lambda: len(fake.connections) == 2 and mirror.is_synced)
+
+        assert fake.tokens == [TOKEN, TOKEN]
+        assert fake.rest_calls == 2
+        assert mirror.get("switch.zone_1")["state"] == "on"
+        assert mirror.get("switch.zone_2") is None
+        assert mirror.get("switch.zone_4")["state"] == "off"
+
+        # The new connection's subscription delivers events again
+        await fake.subscribed.wait()
+        await fake.state_changed("switch.zone_4", state("switch.zone_4", "on", "2024-01-01T00:02:00+00:00"))
+        await wait_until(lambda: mirror.get("switch.zone_4")["state"] == "on")
+
+    run_mirror(scenario)
+
+def test_failed_resync_is_retried_on_a_new_connection():
+    async def scenario(fake, mirror):
+        fake.rest_failures = 1
+        await wait_until(lambda: mirror.is_synced)
+        # The first connection gave up when the REST snapshot failed
+        assert fake.rest_calls == 2
+        assert len(fake.tokens) == 2
+        assert mirror.get("switch.zone_1")["state"] == "off"
+
+    run_mirror(scenario)
+
+def test_mirror_is_not_synced_while_disconnected():
+    async def scenario(fake, mirror):
+        await fake.subscribed.wait()
+        await wait_until(lambda: mirror.is_synced)
+
+        fake.accepting = False
+        await fake.drop()
+        await wait_until(lambda: len(fake.tokens) >= 3)
+        # Readers fall back to the REST API meanwhile
+        assert not mirror.is_synced
+
+        fake.accepting = True
+        await wait_until(lambda: mirror.is_synced)
+        assert fake.rest_calls == 2
+
+    run_mirror(scenario)
@@ -0,0 +1,103 @@
+"""Persisted schedule-to-job index"""
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import select
+
+from irrigation_control.core.database import SessionLocal
+from irrigation_control.models.database_models import ScheduleJob
+from irrigation_control.services.job_index import ScheduleJobIndex, schedule_job_index
+from irrigation_control.services.scheduler_service import SchedulerService, run_slot_job
+
+def stored():
+    with SessionLocal() as db:
+        return sorted(db.execute(select(ScheduleJob.schedule_id, ScheduleJob.job_id)).all())
+
+def job_spec(schedule_id, slot_id, action):
+    return {
+        "id": f"schedule_{schedule_id}_slot_{slot_id}_{action}",
+        "func": run_slot_job,
+        "args": [schedule_id, slot_id, action],
+        "trigger": "interval",
+        "hours": 1,
+    }
+
+def test_index_is_loaded_once_on_first_use(count_queries):
+    with SessionLocal() as db:
+        db.add_all([
+            ScheduleJob(job_id="schedule_1_slot_1_start", schedule_id=1),
+            ScheduleJob(job_id="schedule_1_slot_1_stop", schedule_id=1),
+            ScheduleJob(job_id="schedule_2_slot_3_start", schedule_id=2),
+        ])
+        db.commit()
+    index = ScheduleJobIndex()
+
+    with count_queries() as queries:
+        assert index._jobs is None
+        assert index.get(1) == {"schedule_1_slot_1_start", "schedule_1_slot_1_stop"}
+        assert index.get(2) == {"schedule_2_slot_3_start"}
+        assert index.get(3) == set()
+        assert not index.is_empty()
+    assert queries.count == 1
+
+def test_dropped_cache_is_reloaded_from_the_table(db_engine):
+    index = ScheduleJobIndex()
+    index.add(4, ["schedule_4_slot_1_start", "schedule_4_slot_1_stop"])
+    index.rebuild({5: ["schedule_5_slot_2_start"], 6: []})
+    index.add(5, ["schedule_5_slot_2_stop"])
+    index.discard(5, ["schedule_5_slot_2_start"])
+
+    expected = {5: {"schedule_5_slot_2_stop"}}
+    assert index._jobs == expected
+    index._jobs = None
+    assert index.get(5) == {"schedule_5_slot_2_stop"}
+    assert index._jobs == expected
+    assert ScheduleJobIndex().get(5) == {"schedule_5_slot_2_stop"}
+    assert stored() == [(5, "schedule_5_slot_2_stop")]
+
+    index.discard(5)
+    assert index.is_empty() and stored() == []
+
+@pytest.fixture
+def service(db_engine, monkeypatch):
+    scheduler = BackgroundScheduler()
+    scheduler.start(paused=True)
+    monkeypatch.setattr(schedule_job_index, "_jobs", None)
+    yield SchedulerService(scheduler, None)
+    scheduler.shutdown(wait=False)
+
+def job_ids(service):
+    return sorted(job.id for job in service.scheduler.get_jobs())
+
+def test_replacing_jobs_keeps_jobstore_and_index_in_step(service):
+    service._replace_jobs(7, [job_spec(7, 1, "start"), job_spec(7, 1, "stop")])
+    service._replace_jobs(8, [job_spec(8, 2, "start")])
+    assert job_ids(service) == sorted(schedule_job_index.get(7) | schedule_job_index.get(8))
+
+    service._replace_jobs(7, [job_spec(7, 3, "start")])
+    assert job_ids(service) == ["schedule_7_slot_3_start", "schedule_8_slot_2_start"]
+    assert stored() == [(7, "schedule_7_slot_3_start"), (8, "schedule_8_slot_2_start")]
+
+    service._replace_jobs(7, [])
+    assert job_ids(service) == ["schedule_8_slot_2_start"]
+    assert schedule_job_index.get(7) == set()
+    assert stored() == [(8, "schedule_8_slot_2_start")]
+
+def test_index_names_jobs_that_failed_to_add_until_removal(service, monkeypatch):
+    add_job = service.scheduler.add_job
+
+    def fail_second(**spec):
+        if spec["id"].endswith("_stop"):
+            raise RuntimeError("jobstore unavailable")
+        return add_job(**spec)
+
+    monkeypatch.setattr(service.scheduler, "add_job", fail_second)
+    with pytest.raises(RuntimeError):
+        service._replace_jobs(9, [job_spec(9, 1, "start"), job_spec(9, 1, "stop")])
+    # Indexed first, so the job that was added is never missed
+    assert job_ids(service) == ["schedule_9_slot_1_start"]
+    assert schedule_job_index.get(9) == {"schedule_9_slot_1_start", "schedule_9_slot_1_stop"}
+
+    # Removal skips the job that never made it into the jobstore
+    service._replace_jobs(9, [])
+    assert job_ids(service) == []
+    assert schedule_job_index.is_empty() and stored() == []
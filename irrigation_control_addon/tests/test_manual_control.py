@@ -0,0 +1,113 @@
+"""Manual stops through the control endpoints"""
+import asyncio
+
+import pytest
+
+from irrigation_control.api import entities_api, groups_api
+from irrigation_control.api.entities_api import control_solenoid
+from irrigation_control.api.groups_api import control_group
+from irrigation_control.services.admission import admission_controller
+from irrigation_control.services.command_queue import CircuitBreaker, CommandQueue
+
+class FakeHomeAssistant:
+    def __init__(self):
+        self.calls = []
+
+    async def control_switches(self, entity_ids, action):
+        self.calls.extend((entity_id, action) for entity_id in entity_ids)
+        return {entity_id: {"success": True, "latency_ms": 0.0} for entity_id in entity_ids}
+
+class FakeSolenoid:
+    id = 1
+    entity_id = "switch.manual_a"
+
+class FakeGroupSolenoid:
+    def __init__(self, entity_id):
+        self.entity_id = entity_id
+
+class FakeGroup:
+    id = 1
+    solenoids = [FakeGroupSolenoid("switch.manual_a"), FakeGroupSolenoid("switch.manual_b")]
+
+class FakeDatabaseService:
+    def get_solenoid(self, solenoid_id):
+        return FakeSolenoid() if solenoid_id == FakeSolenoid.id else None
+
+    def get_group(self, group_id):
+        return FakeGroup() if group_id == FakeGroup.id else None
+
+@pytest.fixture
+def command_queue(monkeypatch):
+    """A queue of its own, as asyncio.Queue binds to the loop first using it"""
+    queue = CommandQueue(2, 0, 0.01, 0.01, 30, CircuitBreaker(5, 1))
+    monkeypatch.setattr(entities_api, "command_queue", queue)
+    monkeypatch.setattr(groups_api, "command_queue", queue)
+    return queue
+
+async def wait_for_command(queue, command_id):
+    while not queue.get(command_id).done:
+        await asyncio.sleep(0.01)
+    return queue.get(command_id)
+
+def test_manual_stop_leaves_scheduled_hold(command_queue):
+    ha = FakeHomeAssistant()
+    entity_id = FakeSolenoid.entity_id
+
+    async def scenario():
+        command_queue.start()
+        try:
+            assert admission_controller.try_acquire(entity_id, "schedule_7")
+            assert admission_controller.try_acquire(entity_id, "manual")
+
+            response = await control_solenoid(1, "turn_off", FakeDatabaseService(), ha)
+            command = await wait_for_command(command_queue, response.data["command_id"])
+
+            # The schedule still needs the zone, so it stays on
+            assert admission_controller.holds(entity_id, "schedule_7")
+            assert not admission_controller.holds(entity_id, "manual")
+            assert command.results[entity_id]["suppressed"] == "in_use"
+            assert ha.calls == []
+
+            admission_controller.release(entity_id, "schedule_7")
+            response = await control_solenoid(1, "turn_off", FakeDatabaseService(), ha)
+            await wait_for_command(command_queue, response.data["command_id"])
+            assert ha.calls == [(entity_id, "turn_off")]
+        finally:
+            await command_queue.stop()
+
+    asyncio.run(scenario())
+
+def test_stop_not_held_behind_turn_on_waiting_for_admission(command_queue, monkeypatch):
+    ha = FakeHomeAssistant()
+    # Both slots taken: zone a is already open for a schedule, so the manual
+    # turn-on admits it at once while zone b waits
+    monkeypatch.setattr(admission_controller, "capacity", 2)
+
+    async def scenario():
+        command_queue.start()
+        try:
+            assert admission_controller.try_acquire("switch.manual_busy", "schedule_8")
+            assert admission_controller.try_acquire("switch.manual_a", "schedule_9")
+            response = await control_group(1, "turn_on", FakeDatabaseService(), ha)
+            turn_on = response.data["command_id"]
+            await asyncio.sleep(0.05)
+            assert ha.calls == [("switch.manual_a", "turn_on")]
+
+            # The stop for zone a is handled while zone b is still queued
+            response = await control_solenoid(1, "turn_off", FakeDatabaseService(), ha)
+            stop = response.data["command_id"]
+            command = await asyncio.wait_for(wait_for_command(command_queue, stop), 1)
+            assert command.results["switch.manual_a"]["suppressed"] == "in_use"
+            assert not command_queue.get(turn_on).done
+
+            # Zone b is admitted once the other run lets go
+            admission_controller.release("switch.manual_busy", "schedule_8")
+            command = await asyncio.wait_for(wait_for_command(command_queue, turn_on), 1)
+            assert ha.calls[-1] == ("switch.manual_b", "turn_on")
+            assert command.results["switch.manual_b"]["success"]
+
+            admission_controller.release_many(["switch.manual_a", "switch.manual_b"])
+        finally:
+            await command_queue.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+"""List endpoints run a fixed number of statements however many rows they return"""
+import pytest
+from fastapi.testclient import TestClient
+
+from irrigation_control.core.database import SessionLocal
+from irrigation_control.models import schemas
+from irrigation_control.services.db_service import DatabaseService
+
+@pytest.fixture
+def client(app):
+    return TestClient(app)
+
+def seed(groups: int, schedules_per_group: int) -> None:
+    """Groups of two zones, each with schedules of two slots"""
+    with SessionLocal() as db:
+        service = DatabaseService(db)
+        offset = len(service.get_groups())
+        for g in range(offset, offset + groups):
+            ids = [
+                service.create_solenoid(schemas.SolenoidCreate(
+                    entity_id=f"switch.zone_{2 * g + n}", name=f"Zone {2 * g + n}"
+                )).id
+                for n in range(2)
+            ]
+            group = service.create_group(schemas.ZoneGroupCreate(name=f"Group {g}", solenoid_ids=ids))
+            for s in range(schedules_per_group):
+                service.create_schedule(schemas.ScheduleCreate(
+                    name=f"Schedule {g}.{s}",
+                    target_type="group" if s % 2 else "solenoid",
+                    target_id=group.id if s % 2 else ids[0],
+                    time_slots=[
+                        schemas.TimeSlotCreate(start_time=f"0{n + 5}:00", duration_minutes=10, days_of_week="MON")
+                        for n in range(2)
+                    ],
+                ))
+
+def statements_for(client, count_queries, path: str) -> int:
+    with count_queries() as queries:
+        response = client.get(path)
+    assert response.status_code == 200
+    return queries.count
+
+@pytest.mark.parametrize("path, expected", [
+    ("/api/schedules", 6),  # schedules, time slots, conditions, solenoid, group, group members
+    ("/api/groups", 2),  # groups, members
+])
+def test_list_endpoint_query_count_is_constant(client, count_queries, path, expected):
+    seed(groups=2, schedules_per_group=2)
+    small = statements_for(client, count_queries, path)
+    seed(groups=10, schedules_per_group=4)
+    large = statements_for(client, count_queries, path)
+
+    assert len(client.get(path).json()["data"]) > 10
+    assert small == large == expected
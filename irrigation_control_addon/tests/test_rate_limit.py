@@ -0,0 +1,105 @@
+"""Token buckets and per-integration switch rate limits"""
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from irrigation_control.core.config import Settings
+from irrigation_control.services import rate_limit
+from irrigation_control.services.rate_limit import SwitchRateLimiter, TokenBucket
+
+def test_rate_must_be_positive():
+    for rate in (0, -1):
+        with pytest.raises(ValueError):
+            TokenBucket("switch.zwave_", rate, 1)
+        with pytest.raises(ValidationError):
+            Settings(HA_RATE_LIMITS=[{"match": "switch.zwave_", "rate": rate}])
+
+def test_burst_then_rate():
+    bucket = TokenBucket("switch.zwave_", rate=20, burst=3)
+
+    async def scenario():
+        waits = [await bucket.acquire() for _ in range(3)]
+        assert waits == [0.0, 0.0, 0.0]
+        # Out of tokens: the next one waits for a refill at 20 per second
+        waited = await bucket.acquire()
+        assert 0.03 <= waited <= 0.2
+        assert bucket.delayed == 1 and bucket.acquired == 4
+
+    asyncio.run(scenario())
+
+def test_refill_is_capped_at_burst():
+    bucket = TokenBucket("switch.zwave_", rate=100, burst=2)
+
+    async def scenario():
+        await bucket.acquire()
+        await bucket.acquire()
+        await asyncio.sleep(0.1)  # long enough for ten tokens
+        bucket._refill(asyncio.get_running_loop().time())
+        assert bucket.tokens == 2
+
+    asyncio.run(scenario())
+
+def test_waiters_are_served_in_order():
+    bucket = TokenBucket("switch.zwave_", rate=50, burst=1)
+    order = []
+
+    async def scenario():
+        async def take(n):
+            await bucket.acquire()
+            order.append(n)
+
+        await asyncio.gather(*(take(n) for n in range(5)))
+        assert order == [0, 1, 2, 3, 4]
+        assert bucket.max_waiting == 4
+
+    asyncio.run(scenario())
+
+def test_cancelled_waiter_hands_back_token_up_to_burst():
+    bucket = TokenBucket("switch.zwave_", rate=1, burst=1)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        await bucket.acquire()
+        task = asyncio.ensure_future(bucket.acquire())
+        await asyncio.sleep(0)
+        assert bucket.waiting == 1
+
+        # Woken with a token, then cancelled before it runs, while the
+        # bucket has refilled meanwhile
+        bucket.tokens = 1
+        bucket._release(loop)
+        bucket.tokens = 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert bucket.tokens == 1
+
+    asyncio.run(scenario())
+
+class FakeMirror:
+    def __init__(self, integrations):
+        self.integrations = integrations
+
+    def get_integration(self, entity_id):
+        return self.integrations.get(entity_id)
+
+def test_limits_match_prefix_then_integration(monkeypatch):
+    mirror = FakeMirror({"switch.garden_1": "esphome", "switch.zwave_2": "esphome"})
+    monkeypatch.setattr(rate_limit, "get_state_mirror", lambda: mirror)
+    limiter = SwitchRateLimiter([
+        {"match": "switch.zwave_", "rate": 2, "burst": 4},
+        {"match": "integration:esphome", "rate": 10},
+    ])
+
+    assert limiter.bucket_for("switch.zwave_1").name == "switch.zwave_"
+    # The first matching limit applies
+    assert limiter.bucket_for("switch.zwave_2").name == "switch.zwave_"
+    assert limiter.bucket_for("switch.garden_1").name == "integration:esphome"
+    assert limiter.bucket_for("switch.garden_1").burst == 1
+    assert not limiter.is_limited("switch.other")
+
+def test_integration_limits_need_the_mirror(monkeypatch):
+    monkeypatch.setattr(rate_limit, "get_state_mirror", lambda: None)
+    limiter = SwitchRateLimiter([{"match": "integration:esphome", "rate": 10}])
+    assert not limiter.is_limited("switch.garden_1")
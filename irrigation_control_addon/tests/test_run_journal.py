@@ -0,0 +1,102 @@
+"""Recovering zones left open across a restart"""
+import asyncio
+import json
+import time
+
+from irrigation_control.core.database import SessionLocal
+from irrigation_control.models.database_models import ZoneDeadline
+from irrigation_control.services.admission import admission_controller
+from irrigation_control.services.run_journal import RunJournal
+from irrigation_control.services.run_registry import run_registry
+from irrigation_control.services.sequential_engine import sequential_engine
+
+class FakeHomeAssistant:
+    def __init__(self):
+        self.calls = []
+
+    async def control_switches(self, entity_ids, action):
+        self.calls.extend((entity_id, action) for entity_id in entity_ids)
+        return {entity_id: {"success": True, "latency_ms": 0.0} for entity_id in entity_ids}
+
+def on_record(entity_id, owner, source, deadline, schedule_id=None, next_zones=None):
+    return {
+        "op": "on", "t": time.time(), "entity_id": entity_id, "owner": owner, "source": source,
+        "schedule_id": schedule_id, "started_at": time.time() - 60, "deadline": deadline,
+        "next_zones": next_zones
+    }
+
+def checkpoint(key, entity_id, owner, due_at):
+    with SessionLocal() as db:
+        db.add(ZoneDeadline(key=key, kind="stop", entity_ids=entity_id, owner=owner, due_at=due_at))
+        db.commit()
+
+def test_recovery_takes_over_checkpointed_stops(runtime, tmp_path):
+    now = time.time()
+    path = tmp_path / "run_journal.jsonl"
+    records = [
+        on_record("switch.rj_a", "schedule_5", "schedule", now + 600, 5),
+        on_record("switch.rj_b", "run_3", "sequential", now + 300, 6, [["switch.rj_c", 5]]),
+        on_record("switch.rj_d", "schedule_7", "schedule", now - 10, 7),
+    ]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    # Stops checkpointed by the runs before the restart, and one for an
+    # owner the journal knows nothing about
+    checkpoint("stop:schedule_5", "switch.rj_a", "schedule_5", now + 600)
+    checkpoint("stop:run_3", "switch.rj_b", "run_3", now + 300)
+    checkpoint("stop:manual_9_1", "switch.rj_e", "schedule_9", now + 900)
+    ha = FakeHomeAssistant()
+    journal = RunJournal(str(path))
+
+    async def scenario():
+        runtime.start(ha)
+        summary = await journal.recover(ha)
+        assert summary == {"resumed": ["switch.rj_a", "switch.rj_b"], "closed": ["switch.rj_d"]}
+        assert ha.calls == [
+            ("switch.rj_d", "turn_off"), ("switch.rj_a", "turn_on"), ("switch.rj_b", "turn_on")
+        ]
+
+        # One stop per resumed zone; the journal's owners' checkpoints are gone
+        stops = sorted(key for key in runtime._deadlines if key.startswith("stop:"))
+        assert stops == [
+            "stop:manual_9_1",
+            "stop:recovered_run_3_switch.rj_b",
+            "stop:recovered_schedule_5_switch.rj_a",
+        ]
+        assert admission_controller.open_zones == 2
+        assert admission_controller.holds("switch.rj_a", "schedule_5")
+        assert admission_controller.holds("switch.rj_b", "run_3")
+        assert sorted(run_registry.by_zone()) == ["switch.rj_a", "switch.rj_b"]
+
+        # The resumed sequential zone closes through the one stop path and
+        # its run carries on with the zone it had yet to water
+        await runtime.get("stop:recovered_run_3_switch.rj_b").callback()
+        await asyncio.sleep(0.05)
+        assert not admission_controller.holds("switch.rj_b", "run_3")
+        assert "switch.rj_b" not in run_registry.by_zone()
+        assert ha.calls[-2:] == [("switch.rj_b", "turn_off"), ("switch.rj_c", "turn_on")]
+        run = sequential_engine.get_progress()[-1]
+        assert run["schedule_id"] == 6
+        sequential_engine.cancel_run(run["run_id"])
+
+        await runtime.stop()
+        await journal.stop()
+
+    asyncio.run(scenario())
+
+def test_restored_stop_releases_its_owner(runtime):
+    checkpoint("stop:schedule_4", "switch.rj_f", "schedule_4", time.time() - 5)
+    ha = FakeHomeAssistant()
+
+    async def scenario():
+        assert admission_controller.try_acquire("switch.rj_f", "schedule_4")
+        run_registry.started("switch.rj_f", "schedule_4", "schedule", 4)
+        # Re-armed without its handler; it passed while down, so it fires
+        # on the first tick
+        runtime.start(ha)
+        await asyncio.sleep(1.2)
+        assert ha.calls == [("switch.rj_f", "turn_off")]
+        assert admission_controller.open_zones == 0
+        assert run_registry.zone_count() == 0
+        await runtime.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,76 @@
+"""Registry of open zones and the endpoints reading it"""
+import time
+
+from fastapi.testclient import TestClient
+
+from irrigation_control.services.run_registry import RunRegistry, run_registry
+
+def test_zone_is_open_while_any_owner_holds_it():
+    registry = RunRegistry()
+    events = []
+    registry.add_listener(lambda event, run: events.append((event, run.entity_id, run.owner)))
+
+    registry.started("switch.rr_a", "schedule_1", "schedule", 1, deadline=time.time() + 600)
+    registry.started("switch.rr_a", "manual", "manual")
+    registry.started("switch.rr_b", "run_2", "sequential", 2, next_zones=[("switch.rr_c", 5)])
+    assert registry.zone_count() == 2
+    assert registry.by_zone() == {"switch.rr_a": ["schedule_1", "manual"], "switch.rr_b": ["run_2"]}
+    assert registry.get("switch.rr_b", "run_2").next_zones == [("switch.rr_c", 5)]
+
+    registry.stopped("switch.rr_a", "manual")
+    assert registry.is_running("switch.rr_a") and registry.zone_count() == 2
+    registry.stopped("switch.rr_a", "manual")  # already stopped: nothing to do
+    registry.stopped("switch.rr_a", "schedule_1")
+    assert not registry.is_running("switch.rr_a") and registry.zone_count() == 1
+
+    assert events == [
+        ("started", "switch.rr_a", "schedule_1"), ("started", "switch.rr_a", "manual"),
+        ("started", "switch.rr_b", "run_2"),
+        ("stopped", "switch.rr_a", "manual"), ("stopped", "switch.rr_a", "schedule_1"),
+    ]
+
+def test_stopping_without_an_owner_closes_the_zone_for_all():
+    registry = RunRegistry()
+    registry.started("switch.rr_d", "schedule_3", "schedule", 3)
+    registry.started("switch.rr_d", "schedule_4", "schedule", 4)
+    registry.started("switch.rr_e", "manual", "manual")
+
+    registry.stopped("switch.rr_d")
+    assert registry.by_zone() == {"switch.rr_e": ["manual"]}
+    registry.stopped("switch.rr_x")  # never open
+    assert registry.zone_count() == 1
+
+def test_faults_outlive_runs_until_cleared():
+    registry = RunRegistry()
+    registry.fault("switch.rr_f", "on", "Switch did not report 'on'")
+    # A zone opened while faulted carries the fault
+    run = registry.started("switch.rr_f", "manual", "manual")
+    assert run.fault == "Switch did not report 'on'"
+    registry.stopped("switch.rr_f")
+    assert [fault["entity_id"] for fault in registry.faults()] == ["switch.rr_f"]
+
+    run = registry.started("switch.rr_f", "manual", "manual")
+    registry.clear_fault("switch.rr_f")
+    assert run.fault is None and registry.faults() == []
+
+def test_endpoints_report_the_registry(app, runtime):
+    client = TestClient(app)
+    run_registry.started("switch.rr_g", "schedule_5", "schedule", 5, deadline=time.time() + 300)
+    run_registry.started("switch.rr_g", "manual", "manual")
+    run_registry.started("switch.rr_h", "run_6", "sequential", 6)
+    run_registry.fault("switch.rr_h", "on", "Switch did not report 'on'")
+
+    active = client.get("/api/runs/active").json()["data"]
+    assert active["zones"] == run_registry.zone_count() == 2
+    assert sorted((run["entity_id"], run["owner"]) for run in active["runs"]) == [
+        ("switch.rr_g", "manual"), ("switch.rr_g", "schedule_5"), ("switch.rr_h", "run_6"),
+    ]
+    assert [fault["entity_id"] for fault in active["faults"]] == ["switch.rr_h"]
+    assert 295 <= next(
+        run["remaining_seconds"] for run in active["runs"] if run["owner"] == "schedule_5"
+    ) <= 300
+
+    assert client.get("/api/settings/status").json()["data"]["running_jobs"] == 2
+    run_registry.stopped("switch.rr_g")
+    assert client.get("/api/settings/status").json()["data"]["running_jobs"] == 1
+    assert client.get("/api/runs/active").json()["data"]["zones"] == 1
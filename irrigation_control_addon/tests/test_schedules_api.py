@@ -0,0 +1,99 @@
+"""Schedule routes keep the jobstore, job index and timeline in step"""
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+from fastapi.testclient import TestClient
+
+from irrigation_control.core.container import container
+from irrigation_control.services.job_index import schedule_job_index
+from irrigation_control.services.scheduler_service import SchedulerService
+from irrigation_control.services.timeline import schedule_timeline
+
+@pytest.fixture
+def scheduler(app, monkeypatch):
+    scheduler = BackgroundScheduler()
+    scheduler.start(paused=True)
+    monkeypatch.setattr(container, "scheduler_service", SchedulerService(scheduler, None))
+    monkeypatch.setattr(schedule_job_index, "_jobs", None)
+    yield scheduler
+    scheduler.shutdown(wait=False)
+
+@pytest.fixture
+def client(app, scheduler):
+    return TestClient(app)
+
+def create_group(client, zones):
+    from irrigation_control.core.database import SessionLocal
+    from irrigation_control.models import schemas
+    from irrigation_control.services.db_service import DatabaseService
+
+    with SessionLocal() as db:
+        service = DatabaseService(db)
+        ids = [
+            service.create_solenoid(schemas.SolenoidCreate(entity_id=f"switch.zone_{n}", name=f"Zone {n}")).id
+            for n in range(zones)
+        ]
+    response = client.post("/api/groups", json={"name": "Lawn", "solenoid_ids": ids})
+    return response.json()["data"]["id"], ids
+
+def schedule_body(group_id, slots=1):
+    return {
+        "name": "Morning",
+        "target_type": "group",
+        "target_id": group_id,
+        "event_type": "p1",
+        "time_slots": [
+            {"start_time": f"06:{n:02d}", "duration_minutes": 1, "days_of_week": "MON,THU"}
+            for n in range(slots)
+        ],
+    }
+
+def test_schedule_jobs_follow_create_update_delete(client, scheduler):
+    group_id, _ = create_group(client, 2)
+
+    created = client.post("/api/schedules", json=schedule_body(group_id, slots=2)).json()
+    schedule_id = created["data"]["id"]
+    assert len(created["data"]["time_slots"]) == 2
+    assert len(scheduler.get_jobs()) == 4  # a start and a stop per slot
+    assert len(schedule_job_index.get(schedule_id)) == 4
+
+    client.put(f"/api/schedules/{schedule_id}", json={"is_enabled": False})
+    assert scheduler.get_jobs() == []
+    assert schedule_timeline.next_occurrences(5) == []
+
+    client.put(f"/api/schedules/{schedule_id}", json={"is_enabled": True})
+    assert len(scheduler.get_jobs()) == 4
+
+    summary = client.post("/api/scheduler/reconcile").json()["data"]
+    assert summary == {"added": 0, "replaced": 0, "removed": 0, "unchanged": 4}
+
+    assert client.delete(f"/api/schedules/{schedule_id}").status_code == 200
+    assert scheduler.get_jobs() == []
+    assert schedule_job_index.get(schedule_id) == set()
+
+def test_group_membership_recompiles_its_schedules(client):
+    group_id, ids = create_group(client, 3)
+    client.post("/api/schedules", json=schedule_body(group_id))
+
+    client.put(f"/api/groups/{group_id}", json={"name": "Lawn", "solenoid_ids": ids[:1]})
+    upcoming = schedule_timeline.next_occurrences(1)
+    assert upcoming and upcoming[0]["solenoid_ids"] == [ids[0]]
+
+    assert client.delete(f"/api/groups/{group_id}").status_code == 200
+    assert schedule_timeline.next_occurrences(1) == []
+
+def test_timeline_accepts_times_with_and_without_offset(client):
+    group_id, _ = create_group(client, 1)
+    client.post("/api/schedules", json=schedule_body(group_id))
+
+    # Monday 05:00 local (UTC) to 09:00 at +02:00, i.e. 07:00 UTC
+    response = client.get(
+        "/api/timeline", params={"from": "2026-10-12T05:00:00", "to": "2026-10-12T09:00:00+02:00"}
+    )
+    assert response.status_code == 200
+    occurrences = response.json()["data"]["occurrences"]
+    assert [o["start"] for o in occurrences] == ["2026-10-12T06:00:00+00:00"]
+
+    response = client.get(
+        "/api/timeline", params={"from": "2026-10-12T09:00:00+02:00", "to": "2026-10-12T07:00:00"}
+    )
+    assert response.status_code == 400
@@ -0,0 +1,137 @@
+"""Sequential runs opening zones one after another"""
+import asyncio
+
+from irrigation_control.services.admission import admission_controller
+from irrigation_control.services.sequential_engine import RunState, SequentialEngine
+
+class FakeHomeAssistant:
+    def __init__(self):
+        self.calls = []
+        self.gate = None  # set to an asyncio.Event to hold commands in flight
+
+    async def control_switches(self, entity_ids, action):
+        self.calls.extend((entity_id, action) for entity_id in entity_ids)
+        if self.gate is not None:
+            await self.gate.wait()
+        return {entity_id: {"success": True, "latency_ms": 0.0} for entity_id in entity_ids}
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+
+async def elapse(wheel, run):
+    """Fire the open zone's stop deadline now"""
+    wheel.get(run.deadline_key).callback()
+    await settle()
+
+def test_run_advances_through_zones(runtime):
+    ha = FakeHomeAssistant()
+    engine = SequentialEngine()
+    finished = []
+    engine.add_finish_listener(finished.append)
+    zones = [("switch.seq_a", 5), ("switch.seq_b", 10), ("switch.seq_c", 5)]
+
+    async def scenario():
+        run = engine.start_run(ha, 11, zones)
+        await settle()
+        assert run.state == RunState.RUNNING and run.current_zone == "switch.seq_a"
+        assert round(runtime.remaining(run.deadline_key)) == 300
+        assert admission_controller.holds("switch.seq_a", run.owner)
+
+        await elapse(runtime, run)
+        assert ha.calls[-2:] == [("switch.seq_a", "turn_off"), ("switch.seq_b", "turn_on")]
+        assert round(runtime.remaining(run.deadline_key)) == 600
+        assert not admission_controller.holds("switch.seq_a", run.owner)
+
+        await elapse(runtime, run)
+        await elapse(runtime, run)
+        assert run.state == RunState.COMPLETED
+        assert finished == [run]
+        assert ha.calls == [
+            ("switch.seq_a", "turn_on"), ("switch.seq_a", "turn_off"),
+            ("switch.seq_b", "turn_on"), ("switch.seq_b", "turn_off"),
+            ("switch.seq_c", "turn_on"), ("switch.seq_c", "turn_off"),
+        ]
+        assert admission_controller.open_zones == 0
+        assert run.deadline_key not in runtime
+
+    asyncio.run(scenario())
+
+def test_cancel_part_way(runtime):
+    ha = FakeHomeAssistant()
+    engine = SequentialEngine()
+    zones = [("switch.seq_d", 5), ("switch.seq_e", 5), ("switch.seq_f", 5)]
+
+    async def scenario():
+        run = engine.start_run(ha, 12, zones)
+        await settle()
+        await elapse(runtime, run)
+        assert run.current_zone == "switch.seq_e"
+
+        assert engine.cancel_run(run.run_id)
+        await settle()
+        assert run.state == RunState.CANCELLED
+        assert ha.calls[-1] == ("switch.seq_e", "turn_off")
+        assert admission_controller.open_zones == 0
+        assert run.deadline_key not in runtime
+        assert not engine.cancel_run(run.run_id)
+        assert engine.get_run(run.run_id) is run
+
+    asyncio.run(scenario())
+
+def test_cancel_while_closing_a_zone_does_not_open_the_next(runtime):
+    ha = FakeHomeAssistant()
+    engine = SequentialEngine()
+    zones = [("switch.seq_g", 5), ("switch.seq_h", 5)]
+
+    async def scenario():
+        run = engine.start_run(ha, 13, zones)
+        await settle()
+
+        # The zone's time is up and its turn-off is in flight...
+        ha.gate = asyncio.Event()
+        await elapse(runtime, run)
+        assert ha.calls[-1] == ("switch.seq_g", "turn_off")
+        # ...when the run is cancelled
+        engine.cancel_run(run.run_id)
+        ha.gate.set()
+        await settle()
+
+        assert run.state == RunState.CANCELLED
+        assert ("switch.seq_h", "turn_on") not in ha.calls
+        assert run.index == 0
+        assert admission_controller.open_zones == 0
+
+    asyncio.run(scenario())
+
+def test_suspend_and_resume_keep_the_time_left(runtime):
+    ha = FakeHomeAssistant()
+    engine = SequentialEngine()
+    zones = [("switch.seq_i", 10), ("switch.seq_j", 5)]
+
+    async def scenario():
+        run = engine.start_run(ha, 14, zones)
+        await settle()
+
+        assert engine.suspend_run(run.run_id)
+        await settle()
+        assert run.state == RunState.SUSPENDED
+        assert ha.calls[-1] == ("switch.seq_i", "turn_off")
+        assert round(run.zone_remaining) == 600
+        assert run.deadline_key not in runtime
+        assert admission_controller.open_zones == 0
+        assert not engine.suspend_run(run.run_id)
+
+        assert engine.resume_run(run.run_id)
+        await settle()
+        assert run.state == RunState.RUNNING and run.current_zone == "switch.seq_i"
+        assert ha.calls[-1] == ("switch.seq_i", "turn_on")
+        assert round(runtime.remaining(run.deadline_key)) == 600
+        assert run.zone_remaining is None
+
+        await elapse(runtime, run)
+        assert run.current_zone == "switch.seq_j"
+        engine.cancel_run(run.run_id)
+        await settle()
+
+    asyncio.run(scenario())
@@ -0,0 +1,105 @@
+"""Weekly slot timeline and its interval trees"""
+import random
+from datetime import datetime, time, timedelta, timezone
+
+from irrigation_control.core.config import settings
+from irrigation_control.models import database_models as models
+from irrigation_control.services.timeline import (
+    IntervalTree, ScheduleTimeline, _Interval, compile_slots
+)
+
+MONDAY = datetime(2026, 10, 12)
+
+def make_schedule(schedule_id, solenoid_id, *slots, event_type="p1"):
+    """An unsaved schedule on one solenoid; slots are (day, "HH:MM", minutes)"""
+    return models.Schedule(
+        id=schedule_id, name=f"Schedule {schedule_id}", target_type="solenoid",
+        is_enabled=True, event_type=models.EventType(event_type), priority=0,
+        solenoid=models.SolenoidDevice(id=solenoid_id, is_active=True),
+        time_slots=[
+            models.ScheduleTimeSlot(
+                id=schedule_id * 10 + n, days_of_week=day, duration_minutes=minutes,
+                start_time=time(*map(int, start.split(":")))
+            )
+            for n, (day, start, minutes) in enumerate(slots)
+        ]
+    )
+
+def test_interval_tree_matches_a_scan():
+    rng = random.Random(7)
+    intervals = []
+    for _ in range(300):
+        start = rng.randrange(0, 10000)
+        intervals.append(_Interval(start, start + rng.randrange(1, 500), None))
+    tree = IntervalTree(intervals)
+
+    for _ in range(200):
+        start = rng.randrange(-100, 10500)
+        end = start + rng.randrange(1, 800)
+        expected = {id(i) for i in intervals if i.start < end and start < i.end}
+        assert {id(i) for i in tree.overlap(start, end)} == expected
+
+def test_interval_tree_ranges_are_half_open():
+    interval = _Interval(10, 20, None)
+    tree = IntervalTree([interval])
+    assert tree.overlap(0, 10) == []
+    assert tree.overlap(20, 30) == []
+    assert tree.overlap(19, 20) == [interval]
+
+def test_between_includes_slots_crossing_midnight_and_the_week(monkeypatch):
+    monkeypatch.setattr(settings, "TIMEZONE", "UTC")
+    timeline = ScheduleTimeline()
+    timeline.update_schedule(make_schedule(1, 1, ("TUE", "23:00", 120), ("SUN", "23:30", 60)))
+
+    # Early Monday: the run started late on the Sunday before
+    found = timeline.between(MONDAY, MONDAY + timedelta(minutes=15))
+    assert [(o["slot_id"], o["start"]) for o in found] == [(11, "2026-10-11T23:30:00+00:00")]
+    assert found[0]["end"] == "2026-10-12T00:30:00+00:00"
+
+    # Early Wednesday: Tuesday's slot runs on past midnight
+    wednesday = MONDAY + timedelta(days=2)
+    found = timeline.between(wednesday + timedelta(minutes=30), wednesday + timedelta(hours=2))
+    assert [(o["slot_id"], o["start"]) for o in found] == [(10, "2026-10-13T23:00:00+00:00")]
+
+    # A run is reported once for each week it overlaps
+    found = timeline.between(MONDAY, MONDAY + timedelta(weeks=2))
+    assert [o["start"] for o in found] == [
+        "2026-10-11T23:30:00+00:00", "2026-10-13T23:00:00+00:00",
+        "2026-10-18T23:30:00+00:00", "2026-10-20T23:00:00+00:00",
+        "2026-10-25T23:30:00+00:00",
+    ]
+    assert timeline.between(MONDAY, MONDAY + timedelta(weeks=1), solenoid_id=2) == []
+
+def test_between_takes_naive_and_aware_times(monkeypatch):
+    monkeypatch.setattr(settings, "TIMEZONE", "Europe/Berlin")
+    timeline = ScheduleTimeline()
+    timeline.update_schedule(make_schedule(1, 1, ("MON", "06:00", 30)))
+
+    # 06:00 in Berlin is 04:00 UTC in October
+    naive = timeline.between(MONDAY + timedelta(hours=5), MONDAY + timedelta(hours=7))
+    aware = timeline.between(
+        datetime(2026, 10, 12, 3, tzinfo=timezone.utc), MONDAY + timedelta(hours=7)
+    )
+    assert [o["start"] for o in naive] == [o["start"] for o in aware] == ["2026-10-12T06:00:00+02:00"]
+
+def test_find_conflicts_on_shared_solenoids():
+    timeline = ScheduleTimeline()
+    timeline.update_schedule(make_schedule(1, 1, ("TUE", "23:00", 120), ("SUN", "23:30", 60)))
+    timeline.update_schedule(make_schedule(2, 2, ("MON", "00:00", 60)))
+
+    candidate = make_schedule(3, 1, event_type="p2")
+    occurrences = compile_slots(candidate, [
+        models.ScheduleTimeSlot(id=30, start_time=time(0, 15), duration_minutes=10, days_of_week="MON,WED"),
+        models.ScheduleTimeSlot(id=31, start_time=time(12, 0), duration_minutes=10, days_of_week="MON"),
+    ], (1,))
+    conflicts = timeline.find_conflicts(occurrences)
+    assert [
+        (c["slot_start"], c["conflicting_slot_id"], c["conflicting_start"], c["type"])
+        for c in conflicts
+    ] == [
+        # Across the end of the week, then across Tuesday midnight
+        ("MON 00:15", 11, "SUN 23:30", "priority"),
+        ("WED 00:15", 10, "TUE 23:00", "priority"),
+    ]
+    assert conflicts[0]["solenoid_ids"] == [1]
+    assert timeline.find_conflicts(occurrences, exclude_schedule_id=1) == []